@@ -85,6 +85,14 @@ imports=dionaea.log,dionaea.services,dionaea.ihandlers
 sys_paths=default
 service_configs=@DIONAEA_CONFDIR@/services-enabled/*.yaml
 ihandler_configs=@DIONAEA_CONFDIR@/ihandlers-enabled/*.yaml
+# Limits of the data recorded by the python stream processor and the RTP streams of the SIP service
+# Max bytes per connection and max bytes in memory of all connections, 0 = no limit
+# bistream.max_size=16777216
+# bistream.max_total=268435456
+# Write the capture of a connection to a temporary file once it has more bytes in memory, 0 = disabled
+# bistream.spill_size=0
+# bistream.spill_dir=@DIONAEA_STATEDIR@/bistreams/spill/
+bistream.dir=@DIONAEA_STATEDIR@/bistreams/
 
 [module.pcap]
 any.interface=any
@@ -15,6 +15,10 @@ struct incident;
 struct ihandlers
 {
 	GList *handlers;
+	/* matching handlers by origin, cleared if a handler is added or removed */
+	GHashTable *index;
+	/* incremented if a handler is removed */
+	unsigned int generation;
 };
 
 
@@ -29,6 +33,7 @@ struct ihandler
 
 struct ihandler *ihandler_new(char *pattern, ihandler_cb cb, void *ctx);
 void ihandler_free(struct ihandler *i);
+void ihandlers_index_clear(void);
 
 enum opaque_data_type
 {
@@ -84,6 +89,8 @@ struct incident
 
 struct incident *incident_new(const char *origin);
 void incident_free(struct incident *e);
+/* get the value of a key with any type, NULL if the key does not exist */
+struct opaque_data *incident_value_lookup(struct incident *e, const char *name);
 bool incident_value_int_set(struct incident *e, const char *name, long int val);
 bool incident_value_int_get(struct incident *e, const char *name, long int *val);
 bool incident_value_con_set(struct incident *e, const char *name, struct connection *val);
@@ -4,10 +4,16 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+from cpython.buffer cimport PyBUF_SIMPLE, PyBuffer_Release, PyObject_CheckBuffer, PyObject_GetBuffer
+
 import inspect
 import logging
 import weakref
+from time import perf_counter_ns
+from dionaea.bistream import Bistream
 from dionaea.exception import LoaderError
+from dionaea.framing import get_framing
+from dionaea.timer import timer_wheel
 
 
 logger = logging.getLogger("binding")
@@ -20,6 +26,8 @@ cdef extern from *:
 cdef extern from "module.h":
 	cdef object bytesfrom "PyBytes_FromStringAndSize"(char *v, int len)
 	cdef object stringfrom "PyUnicode_FromStringAndSize"(char *v, int len)
+	cdef object memoryviewfrom "PyMemoryView_FromMemory"(char *mem, Py_ssize_t size, int flags)
+	cdef int c_PyBUF_READ "PyBUF_READ"
 	int c_strlen "strlen" (char *)
 	ctypedef int c_uintptr_t "uintptr_t"
 	char * c_g_strdup "g_strdup" (char *)
@@ -102,7 +110,7 @@ cdef extern from "../../include/connection.h":
 	void c_node_info_set_addr "node_info_set_addr" (c_node_info *, char *)
 
 	ctypedef enum c_connection_transport "enum connection_transport":
-		pass
+		c_connection_transport_tcp "connection_transport_tcp"
 
 	ctypedef enum c_connection_state "enum connection_state":
 		pass
@@ -432,6 +440,23 @@ cdef class connection:
 	cdef c_connection *thisptr
 	cdef bint factory
 	cdef object __weakref__
+	# framing of the incoming data, see dionaea.framing
+	cdef unsigned int io_in_min
+	cdef bint io_in_framed
+	cdef unsigned int frame_header_size
+	cdef unsigned int frame_length_offset
+	cdef unsigned int frame_length_size
+	cdef bint frame_length_big_endian
+	cdef unsigned long long frame_length_mask
+	cdef unsigned long long frame_length_adjust
+	cdef bint io_in_view
+
+	#: Frame format of the incoming data, name of a known format or a dionaea.framing.FrameSpec
+	io_in_framing = None
+	#: Do not call handle_io_in() before N bytes have been received
+	io_in_min_size = 0
+	#: Pass the data as memoryview, only valid during the call of handle_io_in()
+	io_in_memoryview = False
 
 
 	def __cinit__(self):
@@ -488,6 +513,8 @@ cdef class connection:
 		if self.factory == False and self.thisptr.protocol.ctx == <void *>self:
 			INCREF(self)
 
+		self.set_io_in_framing(self.io_in_framing, self.io_in_min_size, self.io_in_memoryview)
+
 #	def __dealloc__(self):
 #		print "goodbye connection"
 
@@ -594,6 +621,24 @@ cdef class connection:
 		"""callback for flushed out buffer"""
 		pass
 
+	def set_io_in_framing(self, framing=None, min_size=0, view=False):
+		"""set the framing of the incoming data on tcp connections,
+		framing is None, the name of a known format or a dionaea.framing.FrameSpec,
+		handle_io_in() is only called with complete frames and at least min_size bytes,
+		if view is True the data is passed as memoryview"""
+		spec = get_framing(framing)
+		self.io_in_min = max(0, min_size)
+		self.io_in_view = bool(view)
+		self.io_in_framed = spec is not None
+		if spec is None:
+			return
+		self.frame_header_size = spec.header_size
+		self.frame_length_offset = spec.length_offset
+		self.frame_length_size = spec.length_size
+		self.frame_length_big_endian = spec.byteorder == u'big'
+		self.frame_length_mask = spec.length_mask
+		self.frame_length_adjust = spec.length_adjust
+
 	def bind(self, addr, port, iface=u''):
 		"""bind the connection to a given addr and  port, iface is optional (for ipv6 local scope)"""
 		if self.thisptr == NULL:
@@ -637,7 +682,11 @@ cdef class connection:
 		c_connection_connect(self.thisptr,addr_utf8,port,iface_utf8)
 
 	def send(self, data, local=None, remote=None):
-		"""send something to the remote"""
+		"""send something to the remote
+
+		data is text, bytes or a contiguous buffer like a memoryview of a mmap,
+		buffers are copied to the output buffer without creating a bytes object"""
+		cdef Py_buffer view
 		if self.thisptr == NULL:
 			raise ReferenceError(u'the object requested does not exist')
 		if remote is not None and local is not None and self.transport == u'udp':
@@ -659,6 +708,13 @@ cdef class connection:
 			data_bytes = data.encode(u'UTF-8')
 		elif isinstance(data, bytes):
 			data_bytes = data
+		elif PyObject_CheckBuffer(data):
+			PyObject_GetBuffer(data, &view, PyBUF_SIMPLE)
+			try:
+				c_connection_send(self.thisptr, <char *>view.buf, view.len)
+			finally:
+				PyBuffer_Release(&view)
+			return
 		else:
 			raise ValueError(u"requires text/bytes input, got %s" % type(data))
 		c_connection_send(self.thisptr, data_bytes, len(data_bytes))
@@ -785,17 +841,59 @@ cdef void handle_established_cb(c_connection *con) except * with gil:
 	instance = <connection>c_connection_protocol_ctx_get(con)
 	instance.handle_established()
 
+cdef unsigned int io_in_deliverable(connection instance, unsigned char *data, unsigned int size):
+	"""number of bytes to pass to the service, 0 to wait for more data
+	see dionaea.framing.FrameSpec.complete_size()"""
+	cdef unsigned int offset = 0
+	cdef unsigned int i
+	cdef unsigned char *header
+	cdef unsigned long long length
+
+	if size < instance.io_in_min:
+		return 0
+	if not instance.io_in_framed:
+		return size
+
+	while size - offset >= instance.frame_header_size:
+		header = data + offset + instance.frame_length_offset
+		length = 0
+		for i in range(instance.frame_length_size):
+			if instance.frame_length_big_endian:
+				length = (length << 8) | header[i]
+			else:
+				length = length | (<unsigned long long>header[i] << (8 * i))
+		length = (length & instance.frame_length_mask) + instance.frame_length_adjust
+		if length < instance.frame_header_size:
+			# broken frame, let the service handle it
+			return size
+		if length > size - offset:
+			break
+		offset += <unsigned int>length
+	return offset
+
 cdef int handle_io_in_cb(c_connection *con, void *context, void *data, int size) except * with gil:
 #	print "io_in_cb"
 	cdef connection instance
+	cdef unsigned int deliver = size
 	instance = <connection>context
-	bdata = bytesfrom(<char *>data, size)
+	if con.trans == c_connection_transport_tcp:
+		# only tcp keeps the data the service did not consume
+		deliver = io_in_deliverable(instance, <unsigned char *>data, size)
+		if deliver == 0:
+			return 0
+	if instance.io_in_view:
+		bdata = memoryviewfrom(<char *>data, deliver, c_PyBUF_READ)
+	else:
+		bdata = bytesfrom(<char *>data, deliver)
 	try:
 		l = instance.handle_io_in(bdata)
 	except BaseException as e:
 		logging.error("There was an error in the Python service", exc_info=True)
 		instance.close()
-		return len(bdata)
+		return deliver
+	finally:
+		if instance.io_in_view:
+			bdata.release()
 	return l
 
 cdef void handle_io_out_cb(c_connection *con, void *context) except * with gil:
@@ -873,32 +971,23 @@ cdef c_bool handle_timeout_idle_cb(c_connection *con, void *ctx) except * with g
 
 
 cdef void process_io_in(c_connection *con, c_processor_data *pd, void *data, int size) except * with gil:
-	bdata = bytesfrom(<char *>data, size)
 	cdef connection instance
 	instance = <connection>c_connection_protocol_ctx_get(con)
-
 	if instance.thisptr.processor_data != NULL:
-		if len(instance.bistream) > 0 and instance.bistream[-1][0] == u'in':
-			instance.bistream[-1] = (u'in', instance.bistream[-1][1] + bdata)
-		else:
-			instance.bistream.append((u'in',bdata))
+		instance.bistream.append(u'in', bytesfrom(<char *>data, size))
 	return
 
 cdef void process_io_out(c_connection *con, c_processor_data *pd, void *data, int size) except * with gil:
 	cdef connection instance
 	instance = <connection>c_connection_protocol_ctx_get(con)
 	if instance.thisptr.processor_data != NULL:
-		bdata = bytesfrom(<char *>data, size)
-		if len(instance.bistream) > 0 and instance.bistream[-1][0] == u'out':
-			instance.bistream[-1] = (u'out', instance.bistream[-1][1] + bdata)
-		else:
-			instance.bistream.append((u'out',bdata))
+		instance.bistream.append(u'out', bytesfrom(<char *>data, size))
 	return
 
 cdef c_bool process_process(c_connection *con, void *config) except * with gil:
 	cdef connection instance
 	instance = <connection>c_connection_protocol_ctx_get(con)
-	instance.bistream = []
+	instance.bistream = Bistream()
 
 def dlhfn(name, number, path, line, msg):
 	if isinstance(name, unicode):
@@ -963,6 +1052,7 @@ cdef extern from "glib.h":
 cdef extern from "../../include/incident.h":
 	ctypedef enum c_opaque_data_type "opaque_data_type":
 		opaque_type_none
+		opaque_type_bytes
 		opaque_type_string
 		opaque_type_int
 		opaque_type_ptr
@@ -991,6 +1081,7 @@ cdef extern from "../../include/incident.h":
 
 	ctypedef struct c_incident "struct incident":
 		char *origin
+		GHashTable *data
 
 	c_incident *c_incident_new "incident_new"(char *origin)
 	void c_incident_report "incident_report" (c_incident *i)
@@ -1012,6 +1103,7 @@ cdef extern from "../../include/incident.h":
 	c_bool c_incident_value_none_set "incident_value_none_set"(c_incident *e, char *name)
 	c_bool c_incident_value_none_get "incident_value_none_get"(c_incident *e, char *name)
 
+	c_opaque_data *c_incident_value_lookup "incident_value_lookup" (c_incident *e, char *name)
 	c_bool c_incident_keys_get "incident_keys_get" (c_incident *e, char ***keys)
 	void c_incident_dump "incident_dump" (c_incident *)
 
@@ -1100,6 +1192,9 @@ cdef py_from_opaque(c_opaque_data *value) with gil:
 	if value.type == opaque_type_string:
 		c_opaque_data_string_get(value, &s)
 		return stringfrom(s.str, s.len)
+	elif value.type == opaque_type_bytes:
+		c_opaque_data_string_get(value, &s)
+		return bytesfrom(s.str, s.len)
 	elif value.type == opaque_type_int:
 		c_opaque_data_int_get(value, &i)
 		return i
@@ -1178,34 +1273,18 @@ cdef class incident:
 			c_incident_value_none_set(self.thisptr, key)
 
 	def __getattr__(self, key):
-		cdef c_uintptr_t x
-		cdef connection c
-		cdef c_connection *cc
-		cdef c_GString *s
-		cdef long int i
-		cdef c_GList *l
-		cdef GHashTable *d
+		cdef c_opaque_data *value
 		if isinstance(key, unicode):
 			key = key.encode(u'UTF-8')
-		if c_incident_value_con_get(self.thisptr, key, &cc) == True:
-			c = NEW_C_CONNECTION_CLASS(connection)
-			c.thisptr = <c_connection *>cc
-			INIT_C_CONNECTION_CLASS(c, c)
-			return c
-		elif c_incident_value_bytes_get(self.thisptr, key, &s) == True:
-			return bytesfrom(s.str, s.len)
-		elif c_incident_value_string_get(self.thisptr, key, &s) == True:
-			return stringfrom(s.str, s.len)
-		elif c_incident_value_int_get(self.thisptr, key, &i) == True:
-			return i
-		elif c_incident_value_list_get(self.thisptr,key,&l) == True:
-			return py_from_glist(l)
-		elif c_incident_value_dict_get(self.thisptr,key,&d) == True:
-			return py_from_ghashtable(d)
-		elif c_incident_value_none_get(self.thisptr,key) == True:
-			return None
-		else:
+		# the value knows its type, a single lookup is enough
+		value = c_incident_value_lookup(self.thisptr, key)
+		if value == NULL:
 			raise AttributeError(u"%s does not exist" % key.decode(u'UTF-8'))
+		return py_from_opaque(value)
+
+	def to_dict(self):
+		"""all values of the incident in a dict"""
+		return py_from_ghashtable(self.thisptr.data)
 
 	def report(self):
 		c_incident_report(self.thisptr)
@@ -1233,39 +1312,95 @@ cdef extern from "../../include/incident.h":
 cdef extern from "module.h":
 	void c_traceable_ihandler_cb "traceable_ihandler_cb" (c_incident *, void *)
 
+cdef class _dispatch_entry:
+	"""cached handler method for an incident origin and the dispatch counters"""
+	cdef object func
+	cdef object name
+	cdef bint bound
+	cdef bint specific
+	cdef unsigned long long count
+	cdef unsigned long long time_ns
+
+cdef _dispatch_entry lookup_dispatch_entry(ihandler handler, bytes origin):
+	cdef _dispatch_entry entry = _dispatch_entry()
+	name = u"handle_incident_" + origin.decode(u'ascii').replace(u".", u"_")
+	method = getattr(handler, name, None)
+	entry.specific = method is not None
+	if method is None:
+		name = u"handle_incident"
+		method = handler.handle_incident
+	entry.name = name
+	# store the function instead of the bound method, the cache must not reference the handler
+	if getattr(method, u"__self__", None) is handler:
+		entry.func = method.__func__
+		entry.bound = False
+	else:
+		entry.func = method
+		entry.bound = True
+	handler.dispatch_cache[origin] = entry
+	return entry
+
 cdef void c_python_ihandler_cb (c_incident *i, void *ctx) except * with gil:
 	cdef ihandler handler
 	cdef incident pi
+	cdef _dispatch_entry entry
 	handler = <ihandler>ctx
 	pi = NEW_C_INCIDENT_CLASS(incident)
 	pi.thisptr = i
 	INIT_C_INCIDENT_CLASS(pi,pi)
-	origin = pi.origin
-	if isinstance(origin, bytes):
-		origin = origin.decode(u'ascii')
-	elif not isinstance(origin, unicode):
-		raise ValueError(u"requires text/bytes input, got %s" % type(origin))
-	origin = origin.replace(u".",u"_")
-	try:
-		method = getattr(handler, u"handle_incident_" + origin)
-	except:
-		handler.handle_incident(pi)
-		return
+	origin = bytesfrom(i.origin, c_strlen(i.origin))
+	entry = handler.dispatch_cache.get(origin)
+	if entry is None:
+		entry = lookup_dispatch_entry(handler, origin)
 
+	start = perf_counter_ns()
 	try:
-		method(pi)
-	except BaseException as e:
-		logging.error("There was an error while handling the incident", exc_info=True)
+		if not entry.specific:
+			if entry.bound:
+				entry.func(pi)
+			else:
+				entry.func(handler, pi)
+			return
+
+		try:
+			if entry.bound:
+				entry.func(pi)
+			else:
+				entry.func(handler, pi)
+		except BaseException as e:
+			logging.error("There was an error while handling the incident", exc_info=True)
+	finally:
+		entry.count += 1
+		entry.time_ns += perf_counter_ns() - start
 
 
 cdef class ihandler:
 	cdef c_ihandler *thisptr
+	cdef dict dispatch_cache
+
+	def __cinit__(self, *args, **kwargs):
+		self.dispatch_cache = {}
+
 	def __init__(self, pattern):
 		pattern = pattern.encode(u'UTF-8')
 		self.thisptr = c_ihandler_new(pattern, <ihandler_cb> c_traceable_ihandler_cb, <void *>self)
 
+	def dispatch_stats(self):
+		"""number of incidents and the time spent in the handler by origin"""
+		cdef _dispatch_entry entry
+		result = {}
+		for origin, entry in self.dispatch_cache.items():
+			result[origin.decode(u'ascii')] = {
+				u"count": entry.count,
+				u"time": entry.time_ns / 1e9,
+				u"method": entry.name,
+			}
+		return result
+
 	def __dealloc__(self):
-		c_ihandler_free(self.thisptr)
+		# The handler is freed before ihandler.__init__() if the constructor of a subclass has failed
+		if self.thisptr != NULL:
+			c_ihandler_free(self.thisptr)
 
 	def apply_config(self, config):
 		"""
@@ -1293,6 +1428,13 @@ cdef extern from "modules.h":
 	void c_set_ihandler "set_ihandler" (c_ihandler *)
 	void c_set_processor "set_processor" (c_processor *)
 
+cdef extern from "module.h":
+	ctypedef void (*python_timer_cb)()
+	void c_python_timer_start "python_timer_start" (double interval, python_timer_cb cb)
+
+cdef void handle_timer_cb() except * with gil:
+	timer_wheel.advance()
+
 def init_traceables():
 	cdef c_protocol proto
 	proto.ctx_new = <protocol_handler_ctx_new>_factory
@@ -1319,4 +1461,6 @@ def init_traceables():
 	p.process = <processor_process>process_process
 	c_set_processor(&p)
 
+	c_python_timer_start(timer_wheel.resolution, <python_timer_cb>handle_timer_cb)
+
 ###
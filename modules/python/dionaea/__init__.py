@@ -9,11 +9,12 @@ import glob
 import logging
 import pkgutil
 import traceback
-from threading import Event, Thread
 from typing import Callable, Optional
 
 import yaml
 
+from dionaea.timer import timer_wheel
+
 logger = logging.getLogger('dionaea')
 logger.setLevel(logging.DEBUG)
 
@@ -53,9 +54,10 @@ class IHandlerLoader(object, metaclass=RegisterClasses):
         ihandler.stop()
 
 
-class SubTimer(Thread):
+class Timer(object):
     """
-    Our own Timer class because some attributes we have to user are undocumented in the Python stub files.
+    Call a function after a given time. All timers are managed by the timer wheel of the event loop, the function is
+    called in the thread of the event loop.
 
     :param interval: Wait interval sconds until the callback is called.
     :param function: The callback function.
@@ -66,7 +68,6 @@ class SubTimer(Thread):
     """
     def __init__(self, interval: float, function: Callable, delay: Optional[float] = None, repeat=False,
                  args: Optional[list] = None, kwargs: Optional[dict] = None):
-        Thread.__init__(self)
         self.interval = interval
         self.function = function
         self.delay = delay
@@ -75,66 +76,39 @@ class SubTimer(Thread):
         self.repeat = repeat
         self.args = args if args is not None else []
         self.kwargs = kwargs if kwargs is not None else {}
-        self.finished = Event()
-
-    def cancel(self):
-        """Stop the timer if it hasn't finished yet."""
-        self.finished.set()
-
-    def run(self) -> None:
-        self.finished.wait(self.delay)
-        if not self.finished.is_set():
-            self.function(*self.args, **self.kwargs)
-        while self.repeat and not self.finished.wait(self.interval):
-            if not self.finished.is_set():
-                self.function(*self.args, **self.kwargs)
+        # Managed by the timer wheel
+        self._slot = None
+        self._expires = 0
 
+    def __repr__(self):
+        return "<Timer %r interval=%r repeat=%r>" % (self.function, self.interval, self.repeat)
 
-class Timer(object):
-    """
-    Extend Timer with additional functions like cancel and reset it. It uses the SubTimer() internally.
-
-    :param interval: Wait interval sconds until the callback is called.
-    :param function: The callback function.
-    :param delay: Time in seconds before the callback is called for the first time. It not set interval is used.
-    :param repeat: Call function every $interval seconds.
-    :param args: Optional arguments passed to the callback function.
-    :param kwargs: Opional arguments passed to the callback function.
-    """
-    def __init__(self, interval: float, function: Callable, delay: Optional[float] = None, repeat=False,
-                 args: Optional[list] = None, kwargs: Optional[dict] = None):
-        self.interval = interval
-        self.function = function
-        self.delay = delay
-        if self.delay is None:
-            self.delay = self.interval
-        self.repeat = repeat
-        self.args = args if args is not None else []
-        self.kwargs = kwargs if kwargs is not None else {}
-        self._timer: Optional[SubTimer] = None
+    @property
+    def active(self) -> bool:
+        """True if the timer is scheduled"""
+        return self._slot is not None
 
     def start(self) -> None:
         """Start the Timer"""
-        self._timer = SubTimer(
-            interval=self.interval,
-            function=self.function,
-            delay=self.delay,
-            repeat=self.repeat,
-            args=self.args,
-            kwargs=self.kwargs,
-        )
-        self._timer.start()
+        timer_wheel.schedule(self, self.delay)
 
     def cancel(self) -> None:
         """Cancel the Timer"""
-        if self._timer:
-            self._timer.cancel()
+        timer_wheel.cancel(self)
+
+    def stop(self) -> None:
+        """Cancel the Timer"""
+        self.cancel()
 
     def reset(self) -> None:
         """Restart the Timer"""
-        self.cancel()
         self.start()
 
+    def _expired(self) -> None:
+        if self.repeat:
+            timer_wheel.schedule(self, self.interval)
+        self.function(*self.args, **self.kwargs)
+
 
 def load_submodules(base_pkg=None):
     if base_pkg is None:
@@ -0,0 +1,304 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Record the data of a connection in both directions.
+
+The python stream processor records the data of a connection in a :class:`Bistream`. The chunks are kept in a list
+and only joined if the data is requested, so recording is linear in the number of bytes. The memory used by a
+single connection and by all connections is limited. If the limits are reached the capture is truncated or, if a
+spill directory is configured, written to a temporary file.
+
+Captures are exported in the format of the dump files of the packet trace, see :mod:`dionaea.trace`. Every record
+starts with a header (timestamp as double, direction as unsigned char, length of the data as unsigned int in network
+byte order) followed by the raw data. The files can be read with :func:`dionaea.trace.read_dump` without loading the
+whole capture and replayed with ``tests/benchmark/replay.py --dump``.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from dionaea.trace import DIRECTION_IN, DIRECTION_OUT, read_dump, record_header
+
+logger = logging.getLogger("bistream")
+logger.setLevel(logging.DEBUG)
+
+_directions = {
+    "in": DIRECTION_IN,
+    "out": DIRECTION_OUT,
+}
+_direction_names = {
+    DIRECTION_IN: "in",
+    DIRECTION_OUT: "out",
+}
+
+
+class BistreamLimits(object):
+    """
+    Limits of the recorded data shared by all captures.
+
+    :param max_size: Max number of bytes recorded per connection, 0 for no limit
+    :param max_total: Max number of bytes kept in memory by all connections, 0 for no limit
+    :param spill_size: Write the capture of a connection to a file once it has more bytes in memory, 0 to disable
+    :param spill_dir: Directory of the spill files, spilling is disabled if not set
+    :param dir: Directory to save captures to, e.g. the RTP streams of the SIP service
+    """
+    def __init__(self, max_size: int = 16 * 1024 * 1024, max_total: int = 256 * 1024 * 1024, spill_size: int = 0,
+                 spill_dir: Optional[str] = None, dir: Optional[str] = None):
+        self.max_size = max_size
+        self.max_total = max_total
+        self.spill_size = spill_size
+        self.spill_dir = spill_dir
+        self.dir = dir
+        #: Number of bytes currently kept in memory by all captures
+        self.total = 0
+        #: Number of truncated captures
+        self.truncated = 0
+        #: Number of captures written to a spill file
+        self.spilled = 0
+
+    def configure(self, config: Dict[str, Any]):
+        """
+        Apply the 'bistream.*' values of the python module config.
+
+        Missing values are not changed.
+        """
+        for name in ("max_size", "max_total", "spill_size"):
+            value = config.get("bistream.%s" % name)
+            if value is None:
+                continue
+            try:
+                setattr(self, name, int(value))
+            except ValueError:
+                logger.warning("Unable to parse bistream.%s value '%s'", name, value)
+        for name in ("spill_dir", "dir"):
+            value = config.get("bistream.%s" % name)
+            if value:
+                setattr(self, name, value)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "total": self.total,
+            "truncated": self.truncated,
+            "spilled": self.spilled,
+        }
+
+
+#: Limits of the process, configured from the python module config
+bistream_limits = BistreamLimits()
+
+
+class Bistream(object):
+    """
+    Capture of the data of a connection.
+
+    For compatibility with the list used before, iterating a capture yields tuples of direction ('in' or 'out') and
+    data with consecutive chunks of the same direction joined.
+
+    :param limits: The shared limits, default are the limits of the process
+    :param max_size: Max number of bytes of this capture, default is the value of the limits
+    :param spill_size: Spill to a file once more bytes are in memory, default is the value of the limits
+    """
+    def __init__(self, limits: Optional[BistreamLimits] = None, max_size: Optional[int] = None,
+                 spill_size: Optional[int] = None):
+        if limits is None:
+            limits = bistream_limits
+        self.limits = limits
+        self.max_size = limits.max_size if max_size is None else max_size
+        self.spill_size = limits.spill_size if spill_size is None else spill_size
+        #: Number of bytes recorded
+        self.size = 0
+        #: True if data has been dropped because of the limits
+        self.truncated = False
+        self._records: List[Tuple[float, int, bytes]] = []
+        self._memory_size = 0
+        self._segments = 0
+        self._last_direction: Optional[int] = None
+        self._fp: Optional[BinaryIO] = None
+        self.spill_path: Optional[str] = None
+
+    def __len__(self) -> int:
+        return self._segments
+
+    def __bool__(self) -> bool:
+        return self._segments > 0
+
+    def __iter__(self) -> Iterator[Tuple[str, bytes]]:
+        direction = None
+        chunks: List[bytes] = []
+        for _, record_direction, data in self.records():
+            if record_direction != direction and chunks:
+                yield _direction_names[direction], b"".join(chunks)
+                chunks = []
+            direction = record_direction
+            chunks.append(data)
+        if chunks:
+            yield _direction_names[direction], b"".join(chunks)
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def spilled(self) -> bool:
+        return self.spill_path is not None
+
+    def append(self, direction: str, data: bytes) -> bool:
+        """
+        Record a chunk of data.
+
+        :param direction: 'in' or 'out'
+        :param data: The data
+        :return: False if the data has been truncated
+        """
+        if self.truncated:
+            return False
+        length = len(data)
+        complete = True
+        if self.max_size and self.size + length > self.max_size:
+            length = self.max_size - self.size
+            complete = False
+
+        if self._fp is None:
+            limits = self.limits
+            spill_needed = (
+                (self.spill_size and self._memory_size + length > self.spill_size) or
+                (limits.max_total and limits.total + length > limits.max_total)
+            )
+            if spill_needed and not self._spill() and limits.max_total:
+                # No spill file, keep as much as the global limit allows
+                available = max(0, limits.max_total - limits.total)
+                if length > available:
+                    length = available
+                    complete = False
+
+        if length > 0:
+            if length < len(data):
+                data = data[:length]
+            self._add(_directions.get(direction, DIRECTION_IN), data)
+
+        if not complete:
+            self.truncated = True
+            self.limits.truncated += 1
+            logger.debug("Capture truncated after %d bytes", self.size)
+        return complete
+
+    def _add(self, direction: int, data: bytes):
+        record = (time.time(), direction, data)
+        if self._fp is not None:
+            self._write_record(self._fp, record)
+        else:
+            self._records.append(record)
+            self._memory_size += len(data)
+            self.limits.total += len(data)
+        self.size += len(data)
+        if direction != self._last_direction:
+            self._segments += 1
+            self._last_direction = direction
+
+    def _spill(self) -> bool:
+        spill_dir = self.limits.spill_dir
+        if not spill_dir:
+            return False
+        try:
+            os.makedirs(spill_dir, exist_ok=True)
+            fd, path = tempfile.mkstemp(prefix="bistream-", dir=spill_dir)
+            fp = os.fdopen(fd, "w+b")
+        except OSError:
+            logger.warning("Unable to create spill file in %s", spill_dir, exc_info=True)
+            return False
+
+        for record in self._records:
+            self._write_record(fp, record)
+        self._release()
+        self._fp = fp
+        self.spill_path = path
+        self.limits.spilled += 1
+        return True
+
+    def _release(self):
+        self.limits.total -= self._memory_size
+        self._memory_size = 0
+        self._records = []
+
+    @staticmethod
+    def _write_record(fp: BinaryIO, record: Tuple[float, int, bytes]):
+        timestamp, direction, data = record
+        fp.write(record_header.pack(timestamp, direction, len(data)))
+        fp.write(data)
+
+    def records(self) -> Iterator[Tuple[float, int, bytes]]:
+        """
+        Iterate over the recorded chunks.
+
+        :return: Tuples of timestamp, direction and data
+        """
+        if self._fp is None:
+            yield from list(self._records)
+            return
+        self._fp.flush()
+        with open(self.spill_path, "rb") as fp:
+            yield from read_dump(fp)
+
+    def write(self, fp: BinaryIO) -> int:
+        """
+        Export the capture.
+
+        :param fp: File opened in binary mode
+        :return: Number of bytes of data written
+        """
+        if self._fp is not None:
+            self._fp.flush()
+            with open(self.spill_path, "rb") as src:
+                shutil.copyfileobj(src, fp)
+            return self.size
+        for record in self._records:
+            self._write_record(fp, record)
+        return self.size
+
+    def save(self, directory: str, prefix: str = "bistream-") -> Optional[str]:
+        """
+        Save the capture to a new file in the given directory.
+
+        A spill file is moved to the directory and the capture is closed.
+
+        :return: The path of the file
+        """
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=prefix, dir=directory)
+        with os.fdopen(fd, "wb") as fp:
+            if self._fp is None:
+                self.write(fp)
+                return path
+        self._fp.close()
+        self._fp = None
+        shutil.move(self.spill_path, path)
+        self.spill_path = None
+        self.close()
+        return path
+
+    def close(self):
+        """
+        Release the memory of the capture and remove the spill file.
+        """
+        self._release()
+        self._segments = 0
+        self._last_direction = None
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if self.spill_path is not None:
+            try:
+                os.unlink(self.spill_path)
+            except OSError:
+                pass
+            self.spill_path = None
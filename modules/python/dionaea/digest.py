@@ -0,0 +1,223 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Compute the digests of downloaded files.
+
+All digests are computed in a single pass over the file. Large files are mapped into memory and hashed in big chunks,
+hashlib releases the GIL while hashing so other Python threads are not blocked.
+
+The results are cached per process and keyed by device, inode, size and modification time of the file. The same
+binaries are delivered again and again, so a file is only read once even if it is stored, submitted and uploaded by
+several handlers.
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import mmap
+import os
+from threading import Lock
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger("digest")
+logger.setLevel(logging.DEBUG)
+
+#: Digests attached to the dionaea.download.complete.* incidents
+ALGORITHMS = ("md5", "sha1", "sha256", "sha512")
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(filename: str, algorithms: Iterable[str] = ALGORITHMS,
+              chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, str]:
+    """
+    Compute several digests of a file in a single pass.
+
+    :param filename: File to read
+    :param algorithms: Names of the hashlib algorithms
+    :param chunk_size: Files larger than this are mapped into memory, smaller files are read at once
+    :return: Digests as hex string by algorithm name
+    """
+    digests = [(name, hashlib.new(name)) for name in algorithms]
+    with open(filename, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        if size > chunk_size:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                view = memoryview(data)
+                try:
+                    for offset in range(0, len(view), chunk_size):
+                        chunk = view[offset:offset + chunk_size]
+                        for _, digest in digests:
+                            digest.update(chunk)
+                        chunk.release()
+                finally:
+                    view.release()
+        else:
+            # The file might grow while reading, read until the end
+            while True:
+                buf = fp.read(chunk_size)
+                if not buf:
+                    break
+                for _, digest in digests:
+                    digest.update(buf)
+    return {name: digest.hexdigest() for name, digest in digests}
+
+
+class StreamHasher(object):
+    """
+    Compute several digests of data passed in chunks, e.g. while a file is written.
+
+    :param algorithms: Names of the hashlib algorithms
+    """
+    def __init__(self, algorithms: Iterable[str] = ALGORITHMS):
+        self._digests = [(name, hashlib.new(name)) for name in algorithms]
+
+    def update(self, data: bytes):
+        for _, digest in self._digests:
+            digest.update(data)
+
+    def hexdigests(self) -> Dict[str, str]:
+        """
+        :return: Digests as hex string by algorithm name
+        """
+        return {name: digest.hexdigest() for name, digest in self._digests}
+
+
+def _file_key(stat_result: os.stat_result) -> Tuple[int, int, int, int]:
+    return stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+class FileHasher(object):
+    """
+    Compute the digests of files and cache the results.
+
+    :param algorithms: Names of the hashlib algorithms
+    :param cache_size: Max number of files in the cache, 0 disables the cache
+    :param chunk_size: Size of the chunks to hash
+    """
+    def __init__(self, algorithms: Iterable[str] = ALGORITHMS, cache_size: int = 4096,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.algorithms = tuple(algorithms)
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Tuple[int, int, int, int], Dict[str, str]]" = OrderedDict()
+        self._lock = Lock()
+
+    def configure(self, cache_size: Optional[int] = None, chunk_size: Optional[int] = None):
+        """
+        Change the limits, the cache is truncated if it is too big.
+        """
+        with self._lock:
+            if cache_size is not None:
+                self.cache_size = max(0, int(cache_size))
+            if chunk_size is not None:
+                self.chunk_size = max(4096, int(chunk_size))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def digests(self, filename: str) -> Dict[str, str]:
+        """
+        Get the digests of a file, the file is only read if it has changed since the last call.
+
+        :param filename: File to read
+        :return: Digests as hex string by algorithm name
+        """
+        key = _file_key(os.stat(filename))
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return dict(result)
+            self.misses += 1
+
+        result = hash_file(filename, algorithms=self.algorithms, chunk_size=self.chunk_size)
+
+        # Do not cache the result if the file has been modified while reading
+        if self.cache_size > 0 and _file_key(os.stat(filename)) == key:
+            with self._lock:
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return dict(result)
+
+    def add(self, filename: str, digests: Dict[str, str]):
+        """
+        Add the digests of a file computed while it was written, so the file is not read again.
+
+        :param filename: The file, it must not be changed after the digests have been computed
+        :param digests: Digests of all configured algorithms as returned by StreamHasher.hexdigests()
+        """
+        if self.cache_size <= 0 or any(name not in digests for name in self.algorithms):
+            return
+        key = _file_key(os.stat(filename))
+        with self._lock:
+            self._cache[key] = {name: digests[name] for name in self.algorithms}
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def discard(self, filename: str):
+        """
+        Remove the digests of a file from the cache, must be called before a file added with add() is removed.
+
+        Otherwise a new file reusing the inode might get the digests of the removed file.
+        """
+        try:
+            key = _file_key(os.stat(filename))
+        except OSError:
+            return
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def digest(self, filename: str, algorithm: str) -> str:
+        """
+        Get a single digest of a file.
+
+        :param filename: File to read
+        :param algorithm: Name of the algorithm, must be one of the configured algorithms
+        :return: Digest as hex string
+        """
+        return self.digests(filename)[algorithm]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+#: Hasher shared by all handlers of the process
+file_hasher = FileHasher()
+
+
+def incident_digest(icd: Any, algorithm: str) -> str:
+    """
+    Get a digest of a downloaded file from a dionaea.download.complete.* incident.
+
+    The digest attached to the incident by the store handler is used if available. Otherwise it is computed from the
+    file, the result is cached.
+
+    :param icd: The incident with the attribute 'file'
+    :param algorithm: Name of the algorithm
+    :return: Digest as hex string
+    """
+    try:
+        value = getattr(icd, "%shash" % algorithm)
+    except AttributeError:
+        value = None
+    if value:
+        return value
+    return file_hasher.digest(icd.file, algorithm)
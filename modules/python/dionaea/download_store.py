@@ -0,0 +1,273 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Content-addressed store for the downloaded files.
+
+The files are stored in the download directory. With the flat layout the file name is the MD5 checksum, with the
+sha256 layout the files are stored in sharded sub directories like ``ab/cd/abcd...``, so no directory gets too big.
+
+An optional index records the digests, the size, the first and the last time a file has been seen and how often it
+has been downloaded. The SHA256 digests of all known files are kept in memory, so a download seen before is detected
+without touching the filesystem. The index is updated from a dedicated thread.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from dionaea.digest import ALGORITHMS, hash_file
+from dionaea.writer import BatchWriter, sqlite_savepoint
+
+logger = logging.getLogger("download_store")
+logger.setLevel(logging.DEBUG)
+
+LAYOUT_FLAT = "flat"
+LAYOUT_SHA256 = "sha256"
+LAYOUTS = (LAYOUT_FLAT, LAYOUT_SHA256)
+
+
+class DownloadIndex(object):
+    """
+    Index of the stored files in a SQLite database.
+
+    :param filename: The database file
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.dbh = sqlite3.connect(filename, check_same_thread=False)
+        self.dbh.execute(
+            """CREATE TABLE IF NOT EXISTS downloads (
+                sha256 TEXT PRIMARY KEY,
+                md5 TEXT NOT NULL,
+                sha1 TEXT,
+                sha512 TEXT,
+                size INTEGER,
+                path TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 1
+            )"""
+        )
+        self.dbh.execute("CREATE INDEX IF NOT EXISTS downloads_md5_idx ON downloads (md5)")
+        self.dbh.commit()
+
+        #: Path by SHA256 digest of all known files
+        self.paths: Dict[str, str] = {}
+        for sha256, path in self.dbh.execute("SELECT sha256, path FROM downloads"):
+            self.paths[sha256] = path
+        logger.info("Loaded %d file(s) from the download index %s", len(self.paths), filename)
+
+        self._writer: Optional[BatchWriter] = None
+
+    def start(self, max_queue_size: int = 10000, commit_interval: float = 5.0):
+        """
+        Start the thread to write to the index.
+        """
+        self._writer = BatchWriter(
+            commit=self.dbh.commit,
+            rollback=self.dbh.rollback,
+            savepoint=lambda: sqlite_savepoint(self.dbh),
+            max_queue_size=max_queue_size,
+            commit_max_rows=1000,
+            commit_interval=commit_interval,
+            name="download_index",
+        )
+        self._writer.start()
+
+    def stop(self):
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+        self.dbh.commit()
+        self.dbh.close()
+
+    def get_path(self, sha256: str) -> Optional[str]:
+        """
+        Look up a file in memory.
+
+        :return: The path of the stored file or None if it is unknown
+        """
+        return self.paths.get(sha256)
+
+    def add(self, digests: Dict[str, str], size: int, path: str, timestamp: Optional[float] = None):
+        """
+        Add a new file to the index.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self.paths[digests["sha256"]] = path
+        self._submit(self._insert, digests, size, path, timestamp, timestamp, 1)
+
+    def hit(self, sha256: str, timestamp: Optional[float] = None):
+        """
+        Record another download of a known file.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self._submit(self._update_hit, sha256, timestamp)
+
+    def _submit(self, func, *args):
+        if self._writer is None:
+            func(*args)
+        else:
+            self._writer.put(func, *args)
+
+    def _insert(self, digests: Dict[str, str], size: int, path: str, first_seen: float, last_seen: float, hits: int):
+        self.dbh.execute(
+            """INSERT INTO downloads (sha256, md5, sha1, sha512, size, path, first_seen, last_seen, hits)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (sha256) DO UPDATE SET
+                first_seen = MIN(first_seen, excluded.first_seen),
+                last_seen = MAX(last_seen, excluded.last_seen),
+                hits = hits + excluded.hits""",
+            (
+                digests["sha256"], digests["md5"], digests.get("sha1"), digests.get("sha512"), size, path,
+                first_seen, last_seen, hits
+            )
+        )
+
+    def _update_hit(self, sha256: str, timestamp: float):
+        self.dbh.execute(
+            "UPDATE downloads SET hits = hits + 1, last_seen = MAX(last_seen, ?) WHERE sha256 = ?",
+            (timestamp, sha256)
+        )
+
+
+class DownloadStore(object):
+    """
+    Store the downloaded files by their digests.
+
+    :param root: The download directory
+    :param layout: 'flat' or 'sha256'
+    :param shard_depth: Number of sub directory levels with the sha256 layout, every level uses two hex digits
+    :param index: Optional index of the stored files
+    """
+    def __init__(self, root: str, layout: str = LAYOUT_FLAT, shard_depth: int = 2,
+                 index: Optional[DownloadIndex] = None):
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown layout '%s'" % layout)
+        self.root = root
+        self.layout = layout
+        self.shard_depth = max(0, min(shard_depth, 8))
+        self.index = index
+
+    def get_path(self, digests: Dict[str, str]) -> str:
+        """
+        Get the path of a file in the store.
+        """
+        if self.layout == LAYOUT_FLAT:
+            return os.path.join(self.root, digests["md5"])
+        sha256 = digests["sha256"]
+        shards = [sha256[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, sha256)
+
+    def add(self, filename: str, digests: Dict[str, str], timestamp: Optional[float] = None,
+            move: bool = False) -> Tuple[str, bool]:
+        """
+        Add a file to the store, if it is already known only the index is updated.
+
+        :param filename: The file to add
+        :param digests: The digests of the file
+        :param timestamp: Time the file has been downloaded, default is now
+        :param move: Move the file instead of linking or copying it
+        :return: The path in the store and True if the file is new
+        """
+        if self.index is not None:
+            path = self.index.get_path(digests["sha256"])
+            if path is not None:
+                self.index.hit(digests["sha256"], timestamp)
+                return path, False
+
+        path = self.get_path(digests)
+        if os.path.exists(path):
+            is_new = False
+        else:
+            self._store(filename, path, move=move)
+            is_new = True
+
+        if self.index is not None:
+            self.index.add(digests, os.stat(path).st_size, path, timestamp)
+        return path, is_new
+
+    def _store(self, filename: str, path: str, move: bool = False):
+        if self.layout != LAYOUT_FLAT:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if move:
+            shutil.move(filename, path)
+            return
+        try:
+            os.link(filename, path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            # Different filesystem or hard links not supported
+            shutil.copy2(filename, path)
+
+    def stop(self):
+        if self.index is not None:
+            self.index.stop()
+
+
+def iter_flat_directory(directory: str) -> Iterator[str]:
+    """
+    Iterate over the files of a flat download directory, sub directories and temporary files are skipped.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            if entry.name.startswith(".") or entry.name.endswith(".tmp"):
+                continue
+            yield entry.path
+
+
+def import_directory(store: DownloadStore, directory: str, move: bool = False,
+                     commit_every: int = 1000) -> Dict[str, int]:
+    """
+    Import the files of an existing flat download directory.
+
+    The modification time of a file is used as first and last seen time.
+
+    :param store: The store to import the files into
+    :param directory: The directory with the files to import
+    :param move: Move the files instead of linking or copying them
+    :param commit_every: Commit the index after N files
+    :return: Number of imported, duplicate and failed files
+    """
+    result = {
+        "imported": 0,
+        "duplicates": 0,
+        "errors": 0,
+    }
+    for count, filename in enumerate(iter_flat_directory(directory), start=1):
+        try:
+            mtime = os.stat(filename).st_mtime
+            digests = hash_file(filename, algorithms=ALGORITHMS)
+            indexed = store.index is not None and store.index.get_path(digests["sha256"]) is not None
+            path, is_new = store.add(filename, digests, timestamp=mtime, move=move)
+        except OSError:
+            logger.warning("Unable to import file %s", filename, exc_info=True)
+            result["errors"] += 1
+            continue
+
+        if is_new or (store.index is not None and not indexed):
+            result["imported"] += 1
+        else:
+            result["duplicates"] += 1
+            if move and os.path.exists(filename) and not os.path.samefile(filename, path):
+                os.unlink(filename)
+
+        if store.index is not None and count % commit_every == 0:
+            store.index.dbh.commit()
+
+    if store.index is not None:
+        store.index.dbh.commit()
+    return result
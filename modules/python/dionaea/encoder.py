@@ -0,0 +1,139 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+JSON encoders and helpers to serialize incidents.
+
+The fastest available encoder is used by default. orjson and ujson are optional, the json module from the standard
+library is always available.
+"""
+
+from datetime import datetime
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+logger = logging.getLogger("encoder")
+logger.setLevel(logging.DEBUG)
+
+
+def _encode_json(data: Any) -> bytes:
+    return json.dumps(data).encode("utf-8")
+
+
+def _encode_orjson(data: Any) -> bytes:
+    return orjson.dumps(data)
+
+
+def _encode_ujson(data: Any) -> bytes:
+    return ujson.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+#: Available encoders ordered by preference
+ENCODERS: Dict[str, Callable[[Any], bytes]] = {}
+if orjson is not None:
+    ENCODERS["orjson"] = _encode_orjson
+if ujson is not None:
+    ENCODERS["ujson"] = _encode_ujson
+ENCODERS["json"] = _encode_json
+
+
+def get_json_encoder(name: Optional[str] = None) -> Callable[[Any], bytes]:
+    """
+    Get a function to encode data as UTF-8 encoded JSON.
+
+    :param name: Name of the encoder (orjson, ujson or json). Use None or auto to get the fastest available encoder.
+    :return: The encode function
+    """
+    if name is None or name == "auto":
+        return next(iter(ENCODERS.values()))
+
+    encoder = ENCODERS.get(name)
+    if encoder is None:
+        logger.warning("JSON encoder %s not available, using %s", name, next(iter(ENCODERS.keys())))
+        return next(iter(ENCODERS.values()))
+    return encoder
+
+
+class TimestampCache(object):
+    """
+    Create ISO 8601 UTC timestamps like datetime.utcnow().isoformat().
+
+    The date and time part is only formatted once per second.
+    """
+    def __init__(self):
+        self._second = None
+        self._prefix = ""
+
+    def __call__(self, now: Optional[float] = None) -> str:
+        if now is None:
+            now = time.time()
+        second = int(now)
+        if second != self._second:
+            self._prefix = datetime.utcfromtimestamp(second).isoformat()
+            self._second = second
+        usec = min(round((now - second) * 1000000), 999999)
+        if usec == 0:
+            return self._prefix
+        return "%s.%06d" % (self._prefix, usec)
+
+
+utc_timestamp = TimestampCache()
+
+
+def flatten_list(objs: Iterable[Dict[str, Any]], keys: Sequence[str]) -> Dict[str, List[Any]]:
+    """
+    Convert a list of objects into an object of lists, e.g. for Elasticsearch.
+
+    :param objs: The objects
+    :param keys: The keys of the objects
+    :return: One list of values for every key
+    """
+    result: Dict[str, List[Any]] = {key: [] for key in keys}
+    values = [(key, result[key]) for key in keys]
+    for obj in objs:
+        for key, value_list in values:
+            v = obj.get(key)
+            # eleasticsearch can not handle arrays that contain arrays
+            # flatten the arrays by joining the subarrays
+            if isinstance(v, (tuple, list)):
+                v = " ".join(v)
+            value_list.append(v)
+    return result
+
+
+def flatten_lists(data: Dict[str, Any], schema: Iterable[Tuple[Sequence[str], Sequence[str]]]) -> Dict[str, Any]:
+    """
+    Flatten the lists of objects given by the schema in one pass.
+
+    :param data: The data, it is modified in place
+    :param schema: Tuples of the path to the list and the keys of the objects in the list
+    :return: The data
+    """
+    for path, keys in schema:
+        parent: Any = data
+        for name in path[:-1]:
+            parent = parent.get(name)
+            if parent is None:
+                break
+        if parent is None:
+            continue
+        objs = parent.get(path[-1])
+        if objs is None:
+            continue
+        parent[path[-1]] = flatten_list(objs, keys)
+    return data
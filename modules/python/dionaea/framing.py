@@ -0,0 +1,139 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Framing of the incoming data of stream based services.
+
+By default the core calls ``handle_io_in()`` of a service every time new data has been received and passes all the
+data not consumed so far. A service waiting for the rest of a big request gets the same data again and again.
+
+A service can declare how its requests are framed, the core checks the buffered data and calls the service only if
+at least one complete frame is available. Only complete frames are passed to the service::
+
+    class mysqld(connection):
+        io_in_framing = "mysql"
+
+Instead of a frame format a service can set ``io_in_min_size`` to wait for at least N bytes. With
+``io_in_memoryview = True`` the data is passed as read-only memoryview of the buffer of the core instead of a copy.
+The view is only valid during the call of ``handle_io_in()``, so the service must copy everything it wants to keep.
+
+The framing is only applied to TCP connections. The settings can be changed at runtime with
+``connection.set_io_in_framing()``.
+"""
+
+from typing import TYPE_CHECKING, Dict, Optional, Union
+
+if TYPE_CHECKING:
+    # typing.Literal requires Python 3.8, typing_extensions is only needed for the type check
+    from typing_extensions import Literal
+    ByteOrder = Literal["little", "big"]
+else:
+    ByteOrder = str
+
+
+class FrameSpec(object):
+    """
+    Description of the length prefixed frames of a protocol.
+
+    :param header_size: Number of bytes required to read the length of a frame
+    :param length_offset: Offset of the length field in the header
+    :param length_size: Size of the length field in bytes (1-4)
+    :param byteorder: Byte order of the length field, 'big' or 'little'
+    :param length_mask: Mask applied to the value of the length field
+    :param length_adjust: Added to the value of the length field to get the size of the whole frame, e.g. the size of
+                          the header if it is not included in the length
+    """
+    __slots__ = ("header_size", "length_offset", "length_size", "byteorder", "length_mask", "length_adjust")
+
+    def __init__(self, header_size: int, length_offset: int, length_size: int, byteorder: ByteOrder = "big",
+                 length_mask: int = 0xffffffff, length_adjust: int = 0):
+        if not 1 <= length_size <= 4:
+            raise ValueError("The size of the length field must be between 1 and 4")
+        if length_offset < 0 or header_size < length_offset + length_size:
+            raise ValueError("The length field must be part of the header")
+        if byteorder not in ("big", "little"):
+            raise ValueError("Unknown byte order '%s'" % byteorder)
+        if length_mask < 0 or length_adjust < 0:
+            raise ValueError("The length mask and the length adjustment must not be negative")
+        self.header_size = header_size
+        self.length_offset = length_offset
+        self.length_size = length_size
+        self.byteorder: ByteOrder = byteorder
+        self.length_mask = length_mask
+        self.length_adjust = length_adjust
+
+    def __repr__(self):
+        return (
+            "FrameSpec(header_size=%d, length_offset=%d, length_size=%d, byteorder=%r, length_mask=0x%x, "
+            "length_adjust=%d)" % (
+                self.header_size, self.length_offset, self.length_size, self.byteorder, self.length_mask,
+                self.length_adjust
+            )
+        )
+
+    def frame_size(self, data: Union[bytes, memoryview], offset: int = 0) -> Optional[int]:
+        """
+        Get the size of the frame starting at the given offset.
+
+        :return: The size of the frame or None if the header is incomplete
+        """
+        if len(data) - offset < self.header_size:
+            return None
+        start = offset + self.length_offset
+        length = int.from_bytes(data[start:start + self.length_size], self.byteorder)
+        return (length & self.length_mask) + self.length_adjust
+
+    def complete_size(self, data: Union[bytes, memoryview]) -> int:
+        """
+        Get the size of all complete frames at the beginning of the data.
+
+        This is the reference implementation of the check done by the core. If a frame is shorter than its header the
+        data is broken and all of it is returned, so the service can handle the error.
+
+        :return: Number of bytes to pass to the service, 0 to wait for more data
+        """
+        offset = 0
+        while True:
+            size = self.frame_size(data, offset)
+            if size is None:
+                return offset
+            if size < self.header_size:
+                return len(data)
+            if size > len(data) - offset:
+                return offset
+            offset += size
+
+
+#: NetBIOS session service and SMB over TCP, 17 bit length after the type
+NETBIOS = FrameSpec(header_size=4, length_offset=1, length_size=3, length_mask=0x1ffff, length_adjust=4)
+#: TDS (MSSQL), the length in the 8 byte header includes the header
+TDS = FrameSpec(header_size=8, length_offset=2, length_size=2)
+#: MySQL, 3 byte length of the payload followed by the sequence id
+MYSQL = FrameSpec(header_size=4, length_offset=0, length_size=3, byteorder="little", length_adjust=4)
+#: MongoDB wire protocol, the length includes the length field
+MONGODB = FrameSpec(header_size=4, length_offset=0, length_size=4, byteorder="little")
+
+FRAMINGS: Dict[str, FrameSpec] = {
+    "netbios": NETBIOS,
+    "tds": TDS,
+    "mysql": MYSQL,
+    "mongodb": MONGODB,
+}
+
+
+def get_framing(value: Union[None, str, FrameSpec]) -> Optional[FrameSpec]:
+    """
+    Get the frame description by name.
+
+    :param value: None, the name of a known format or a FrameSpec
+    :return: The frame description or None if the data is not framed
+    """
+    if value is None or isinstance(value, FrameSpec):
+        return value
+    try:
+        return FRAMINGS[value]
+    except KeyError:
+        raise ValueError("Unknown framing '%s'" % value)
@@ -6,7 +6,7 @@
 
 from dionaea import IHandlerLoader, Timer
 from dionaea.core import ihandler, incident, g_dionaea, connection
-from dionaea.util import sha512file
+from dionaea.digest import incident_digest
 
 import os
 import logging
@@ -399,38 +399,43 @@ class hpfeedihandler(ihandler):
             logger.warn('exception when publishing: {0}'.format(e))
 
     def handle_incident_dionaea_download_complete_again(self, i):
-        if not hasattr(i, 'con') or not self.client.connected: return
-        logger.debug('hash complete, publishing md5 {0}, path {1}'.format(i.md5hash, i.file))
+        values = i.to_dict()
+        con = values.get("con")
+        if con is None or not self.client.connected:
+            return
+        logger.debug('hash complete, publishing md5 {0}, path {1}'.format(values["md5hash"], values["file"]))
         try:
             tstamp = timestr()
-            sha512 = sha512file(i.file)
+            sha512 = incident_digest(i, "sha512")
             self.client.publish(
                 CAPTURECHAN,
                 time=tstamp,
-                saddr=i.con.remote.host,
-                sport=str(i.con.remote.port),
+                saddr=con.remote.host,
+                sport=str(con.remote.port),
                 daddr=self._ownip(i),
-                dport=str(i.con.local.port),
-                md5=i.md5hash,
+                dport=str(con.local.port),
+                md5=values["md5hash"],
                 sha512=sha512,
-                url=i.url
+                url=values["url"]
             )
         except Exception as e:
             logger.warn('exception when publishing: {0}'.format(e))
 
     def handle_incident_dionaea_modules_python_smb_dcerpc_request(self, i):
-        if not hasattr(i, 'con') or not self.client.connected:
+        values = i.to_dict()
+        con = values.get("con")
+        if con is None or not self.client.connected:
             return
-        logger.debug('dcerpc request, publishing uuid {0}, opnum {1}'.format(i.uuid, i.opnum))
+        logger.debug('dcerpc request, publishing uuid {0}, opnum {1}'.format(values["uuid"], values["opnum"]))
         try:
             self.client.publish(
                 DCECHAN,
-                uuid=i.uuid,
-                opnum=i.opnum,
-                saddr=i.con.remote.host,
-                sport=str(i.con.remote.port),
+                uuid=values["uuid"],
+                opnum=values["opnum"],
+                saddr=con.remote.host,
+                sport=str(con.remote.port),
                 daddr=self._ownip(i),
-                dport=str(i.con.local.port)
+                dport=str(con.local.port)
             )
         except Exception as e:
             logger.warn('exception when publishing: {0}'.format(e))
@@ -444,7 +449,7 @@ class hpfeedihandler(ihandler):
         except Exception as e:
             logger.warn('exception when publishing: {0}'.format(e))
 
-    def _dynip_resolve(self, events, data):
+    def _dynip_resolve(self):
         i = incident("dionaea.upload.request")
         i._url = self.dynip_resolve
         i._callback = "dionaea.modules.python.hpfeeds.dynipresult"
@@ -7,6 +7,9 @@
 
 from dionaea import ServiceLoader
 from dionaea.core import connection, g_dionaea, incident
+from dionaea.digest import file_hasher
+from dionaea.http_form import FormData, FormField, FormParser, MultipartParser, UrlencodedParser, \
+    parse_options_header
 from dionaea.util import detect_shellshock
 from dionaea.exception import ServiceConfigError
 from collections import OrderedDict
@@ -14,18 +17,20 @@ import logging
 import os
 import sys
 import io
-import cgi
 import html
 import mimetypes
+import mmap
 import urllib.parse
 import re
 import tempfile
+import time
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 try:
     import jinja2
     import jinja2.exceptions
+    import jinja2.meta
 except ImportError:
     jinja2 = None
 
@@ -205,6 +210,166 @@ class Headers(object):
         for header in self.prepare(values):
             connection.send_header(header[0], header[1])
 
+    def format(self, values) -> str:
+        """
+        Format the header fields like they are sent.
+        """
+        return "".join("%s: %s\r\n" % header for header in self.prepare(values))
+
+
+def _stat_key(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def stat_sources(paths: List[str]) -> List[Tuple[str, Optional[Tuple[int, int, int]]]]:
+    """
+    Get the state of the files a response is created from, must be called before the files are read.
+    """
+    return [(path, _stat_key(path)) for path in paths]
+
+
+class CachedResponse(object):
+    """
+    Pre-rendered response with the status line, the header fields and the body in one buffer.
+
+    :param data: The response
+    :param head_size: Size of the status line and the header fields
+    :param sources: Files the response has been created from as returned by stat_sources(), the response is invalid
+                    if one of them is changed, removed or created
+    :param template: Template used to render the response
+    """
+    __slots__ = ("data", "head_size", "sources", "template", "checked")
+
+    def __init__(self, data: bytes, head_size: int, sources=None, template=None):
+        self.data = data
+        self.head_size = head_size
+        self.sources = sources or []
+        self.template = template
+        self.checked = time.monotonic()
+
+    @property
+    def head(self) -> bytes:
+        return self.data[:self.head_size]
+
+    def is_valid(self) -> bool:
+        for path, key in self.sources:
+            if _stat_key(path) != key:
+                return False
+        if self.template is not None and not self.template.is_up_to_date:
+            return False
+        return True
+
+
+class StaticCache(object):
+    """
+    Cache of pre-rendered responses shared by all connections of the HTTP service.
+
+    The files of a response are checked for changes at most once per check interval. The least recently used
+    responses are removed if the max size is reached.
+
+    :param max_size: Max number of bytes of all responses
+    :param max_file_size: Max number of bytes of a single response
+    :param check_interval: Min number of seconds between two checks of a response
+    """
+    def __init__(self, max_size: int = 16 * 1024 * 1024, max_file_size: int = 1024 * 1024,
+                 check_interval: float = 1.0):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.check_interval = check_interval
+        #: Number of bytes of all responses
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._entries: "OrderedDict[Any, CachedResponse]" = OrderedDict()
+        self._static_templates: Dict[str, Tuple[Optional[Tuple[int, int, int]], bool]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        now = time.monotonic()
+        if now - entry.checked >= self.check_interval:
+            if not entry.is_valid():
+                self._remove(key)
+                self.invalidated += 1
+                self.misses += 1
+                return None
+            entry.checked = now
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, head: bytes, body: bytes, sources=None, template=None) -> Optional[CachedResponse]:
+        """
+        Add a response to the cache.
+
+        :return: The new entry or None if the response is too big
+        """
+        size = len(head) + len(body)
+        if size > self.max_file_size or size > self.max_size:
+            return None
+        if key in self._entries:
+            self._remove(key)
+        while self._entries and self.size + size > self.max_size:
+            self._remove(next(iter(self._entries)))
+        entry = CachedResponse(head + body, len(head), sources=sources, template=template)
+        self._entries[key] = entry
+        self.size += size
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= len(entry.data)
+
+    def is_static_template(self, template) -> bool:
+        """
+        Check if the output of a template only depends on the config.
+
+        Templates using the connection or other templates are rendered for every request.
+        """
+        filename = template.filename
+        key = _stat_key(filename) if filename else None
+        cached = self._static_templates.get(filename)
+        if cached is not None and key is not None and cached[0] == key:
+            return cached[1]
+
+        static = False
+        try:
+            source = template.environment.loader.get_source(template.environment, template.name)[0]
+            ast = template.environment.parse(source)
+            static = (
+                "connection" not in jinja2.meta.find_undeclared_variables(ast) and
+                not list(jinja2.meta.find_referenced_templates(ast))
+            )
+        except Exception:
+            logger.debug("Unable to analyze template %s", template.name, exc_info=True)
+        if filename and key is not None:
+            self._static_templates[filename] = (key, static)
+        return static
+
+    def clear(self):
+        self._entries.clear()
+        self._static_templates.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+        }
+
 
 class httpd(connection):
     shared_config_values = [
@@ -221,12 +386,16 @@ class httpd(connection):
         "rwchunksize",
         "root",
         "soap_enabled",
+        "static_cache",
         "template_autoindex",
         "template_enabled",
         "template_error_pages",
         "template_file_extension",
         "template_values"
     ]
+    # Use own class so we can add additional files later
+    # Loading the types is expensive, so it is shared by all connections
+    _mimetypes = mimetypes.MimeTypes()
 
     def __init__(self, proto="tcp"):
         logger.debug("http test")
@@ -235,10 +404,14 @@ class httpd(connection):
         self.header: Optional[httpreq] = None
         self.rwchunksize = 64*1024
         self._out.speed.limit = 16*1024
+        # The status line and the header fields are sent with the first part of the body
+        self._head: List[str] = []
+        self._body: Optional[memoryview] = None
+        self._body_pos = 0
         self.env = None
-        self.boundary = None
-        self.fp_tmp = None
+        self.form_parser: Optional[FormParser] = None
         self.cur_length = 0
+        self.body_length = 0
         self.content_length: Optional[int] = None
         self.content_type: Optional[str] = None
 
@@ -259,16 +432,14 @@ class httpd(connection):
         self.global_template = None
         self.file_template = None
         self.soap_enabled = False
+        self.static_cache: Optional[StaticCache] = None
         self.template_autoindex = None
         self.template_enabled = False
         self.template_error_pages = None
         self.template_file_extension = ".j2"
         self.template_values = {}
 
-        # Use own class so we can add additional files later
-        self._mimetypes = mimetypes.MimeTypes()
-
-        self.request_form: Optional[cgi.FieldStorage] = None
+        self.request_form: Optional[FormData] = None
 
     @property
     def request_fields(self):
@@ -336,7 +507,7 @@ class httpd(connection):
                 return header
         return self.default_headers
 
-    def _render_file_template(self, filename):
+    def _get_file_template(self, filename):
         if not self.template_enabled:
             return None
 
@@ -349,11 +520,16 @@ class httpd(connection):
         filename = filename[len(os.path.abspath(self.root)):] + self.template_file_extension
         filename = filename.lstrip("/")
         try:
-            template = self.file_template.get_template(filename)
+            return self.file_template.get_template(filename)
         except jinja2.exceptions.TemplateNotFound:
             logger.debug("Template file '%s' not found", filename)
             return None
 
+    def _render_file_template(self, filename):
+        template = self._get_file_template(filename)
+        if template is None:
+            return None
+
         return template.render(
             connection=self,
             values=self.template_values
@@ -382,6 +558,17 @@ class httpd(connection):
         )
 
     def _render_global_error_page(self, code: int, message: str):
+        template = self._get_global_error_page_template(code)
+        if template is None:
+            return None
+
+        return template.render(
+            code=code,
+            message=message,
+            values=self.template_values
+        )
+
+    def _get_global_error_page_template(self, code: int):
         if not self.template_enabled:
             return None
 
@@ -410,11 +597,7 @@ class httpd(connection):
                 pass
 
             if template:
-                return template.render(
-                    code=code,
-                    message=message,
-                    values=self.template_values
-                )
+                return template
 
         return None
 
@@ -496,6 +679,20 @@ class httpd(connection):
             template_config = {}
         self._apply_template_config(template_config)
 
+        cache_config = config.get("static_cache")
+        if cache_config is None:
+            cache_config = {}
+        self.static_cache = None
+        if cache_config.get("enabled", True):
+            try:
+                self.static_cache = StaticCache(
+                    max_size=int(cache_config.get("max_size", 16384)) * 1024,
+                    max_file_size=int(cache_config.get("max_file_size", 1024)) * 1024,
+                    check_interval=float(cache_config.get("check_interval", 1.0))
+                )
+            except (TypeError, ValueError):
+                logger.warning("Error while converting the values of 'static_cache'. Cache disabled.")
+
     def handle_origin(self, parent):
         pass
 
@@ -545,6 +742,8 @@ class httpd(connection):
                 try:
                     self.content_length = int(self.header.headers[b'content-length'].decode("utf-8"))
                     self.content_type = self.header.headers[b'content-type'].decode("utf-8")
+                    if self.content_length < 0:
+                        raise ValueError("Invalid Content-Length %d" % self.content_length)
                 except Exception:
                     # ignore decode() errors
                     logger.warning("Ignoring decode errors", exc_info=True)
@@ -552,42 +751,16 @@ class httpd(connection):
                     return len(data)
 
                 self.state = STATE_POST
-
-                m = re.compile(
-                    r"multipart/form-data;\s*boundary=(?P<boundary>.*)",
-                    re.IGNORECASE
-                ).match(self.content_type)
-
-                if m:
-                    # More on boundaries see:
-                    # http://www.apps.ietf.org/rfc/rfc2046.html#sec-5.1.1
-                    self.boundary = bytes("--" + m.group("boundary") + "--\r\n", "utf-8")
-
-                # dump post content to file
-                self.fp_tmp = tempfile.NamedTemporaryFile(
-                    delete=False,
-                    dir=self.download_dir,
-                    prefix="http-",
-                    suffix=self.download_suffix
-                )
-
                 self.cur_length = start_of_content
+                if start_of_content + self.content_length > self.max_request_size:
+                    # Do not wait for a body we would not accept
+                    self.cur_length += self.content_length
+                    self._check_max_request_size_reached()
+                    return start_of_content + len(data)
 
-                if self.boundary:
-                    pos = data.find(self.boundary)
-                    # ending boundary not found
-                    if pos < 0:
-                        return start_of_content
-                    self.fp_tmp.write(data[:pos])
-                    self.handle_POST()
-                    return start_of_content + pos
-
-                if len(data) < self.content_length:
-                    return start_of_content
-                self.fp_tmp.write(data[:self.content_length])
-
-                self.handle_POST()
-                return start_of_content + self.content_length
+                self.request_form = FormData()
+                self.form_parser = self._create_form_parser()
+                return start_of_content + self._handle_post_data(data)
 
             elif self.header.type == b'OPTIONS':
                 self.handle_OPTIONS()
@@ -602,40 +775,7 @@ class httpd(connection):
             return len(data)
 
         elif self.state == STATE_POST:
-            data_length = len(data)
-            if self.boundary:
-                pos = data.find(self.boundary)
-
-                if pos < 0:
-                    # boundary not found
-                    length_processed = data_length - len(self.boundary)
-                    if length_processed < 0:
-                        length_processed = 0
-                    self.cur_length = self.cur_length + length_processed
-
-                    if self._check_max_request_size_reached():
-                        return data_length
-                    self.fp_tmp.write(data[:length_processed])
-                    return length_processed
-
-                # boundary found
-                self.fp_tmp.write(data[:pos+len(self.boundary)])
-                self.handle_POST()
-                return pos + len(self.boundary)
-
-            self.cur_length += data_length
-            if self._check_max_request_size_reached():
-                return data_length
-            if self.fp_tmp.tell() + data_length > self.content_length:
-                logger.warning("More data send as specified in the Content-Length header")
-                self.fp_tmp.write(data[:self.content_length - self.fp_tmp.tell()])
-                self.handle_POST()
-                return data_length
-
-            self.fp_tmp.write(data)
-            if self.fp_tmp.tell() == self.content_length:
-                self.handle_POST()
-            return data_length
+            return self._handle_post_data(data)
 
         elif self.state == STATE_PUT:
             logger.debug("putting to me")
@@ -675,65 +815,99 @@ class httpd(connection):
         self.end_headers()
         self.close()
 
-    def handle_POST(self):
-        """
-        Handle the POST method. Send the head and the file. But ignore the POST params.
-        Use the bistreams for a better analysis.
-        """
-        if self.fp_tmp is not None:
-            self.fp_tmp.seek(0)
-            # at least this information are needed for
-            # cgi.FieldStorage() to parse the content
-            tmp_environ = {
-                'REQUEST_METHOD': 'POST',
-                'CONTENT_LENGTH': self.content_length,
-                'CONTENT_TYPE': self.content_type
-            }
-            if sys.version_info[1] >= 8:
-                self.request_form = cgi.FieldStorage(
-                    fp=self.fp_tmp,
-                    environ=tmp_environ,
-                    max_num_fields=self.get_max_num_fields
-                )
-            else:
-                logger.warning("max_num_fields is only supported with Python >= 3.8")
-                self.request_form = cgi.FieldStorage(
-                    fp=self.fp_tmp,
-                    environ=tmp_environ
-                )
-            for field_name in self.request_form.keys():
-                # dump only files
-                if self.request_form[field_name].filename is None:
-                    continue
+    def _create_form_parser(self) -> Optional[FormParser]:
+        content_type, options = parse_options_header(self.content_type)
+        if content_type == "application/x-www-form-urlencoded":
+            return UrlencodedParser(
+                self.request_form,
+                max_num_fields=self.get_max_num_fields,
+                max_field_size=self.max_request_size
+            )
+
+        if content_type == "multipart/form-data":
+            # More on boundaries see:
+            # http://www.apps.ietf.org/rfc/rfc2046.html#sec-5.1.1
+            boundary = options.get("boundary")
+            if not boundary:
+                logger.warning("No boundary for multipart form data found")
+                return None
+            return MultipartParser(
+                boundary.encode("utf-8"),
+                self.request_form,
+                file_factory=self._create_download_file,
+                on_file=self._handle_form_file,
+                max_num_fields=self.get_max_num_fields,
+                max_field_size=self.max_request_size
+            )
 
-                fp_post = self.request_form[field_name].file
+        logger.debug("Ignoring POST content of type %s", content_type)
+        return None
 
-                data = fp_post.read(4096)
+    def _create_download_file(self):
+        return tempfile.NamedTemporaryFile(
+            delete=False,
+            dir=self.download_dir,
+            prefix="http-",
+            suffix=self.download_suffix
+        )
 
-                # don't handle empty files
-                if len(data) == 0:
-                    continue
+    def _handle_form_file(self, field: FormField):
+        """
+        Report an uploaded file as soon as it has been received.
+        """
+        if field.path is None:
+            return
+
+        # don't handle empty files
+        if field.size == 0:
+            field.remove()
+            return
+
+        # The file has been hashed while it was written
+        file_hasher.add(field.path, field.digests)
+        icd = incident("dionaea.download.complete")
+        icd.path = field.path
+        icd.con = self
+        # We need the url for logging
+        icd.url = ""
+        icd.report()
+        field.remove()
+
+    def _handle_post_data(self, data) -> int:
+        """
+        Pass the received part of the body to the form parser.
 
-                fp_tmp = tempfile.NamedTemporaryFile(
-                    delete=False,
-                    dir=self.download_dir,
-                    prefix='http-',
-                    suffix=self.download_suffix
-                )
-                while data != b'':
-                    fp_tmp.write(data)
-                    data = fp_post.read(4096)
+        :return: Number of bytes processed
+        """
+        length = min(len(data), self.content_length - self.body_length)
+        self.cur_length += length
+        if self._check_max_request_size_reached():
+            if self.form_parser is not None:
+                self.form_parser.abort()
+                self.form_parser = None
+            return len(data)
 
-                icd = incident("dionaea.download.complete")
-                icd.path = fp_tmp.name
-                icd.con = self
-                # We need the url for logging
-                icd.url = ""
-                fp_tmp.close()
-                icd.report()
-                os.unlink(fp_tmp.name)
+        if self.form_parser is not None and not self.form_parser.done:
+            self.form_parser.feed(data[:length] if length < len(data) else data)
+        self.body_length += length
+        if self.body_length >= self.content_length:
+            if len(data) > length:
+                logger.warning("More data send as specified in the Content-Length header")
+            self.handle_POST()
+            # Drop the surplus, it would be passed again and again in STATE_SENDFILE
+            return len(data)
+        return length
 
-            os.unlink(self.fp_tmp.name)
+    def handle_POST(self):
+        """
+        Handle the POST method. Send the head and the file.
+
+        The form data has been parsed while the body was received and uploaded files have already been reported.
+        Use the bistreams for a better analysis.
+        """
+        if self.form_parser is not None:
+            self.form_parser.close()
+            self.form_parser = None
 
         x = self.send_head()
         if x:
@@ -764,11 +938,70 @@ class httpd(connection):
             self.copyfile(x)
 
     def copyfile(self, f):
-        self.file = f
+        self._body = self._get_body(f)
+        self._body_pos = 0
         self.state = STATE_SENDFILE
         self.handle_io_out()
 
+    def _get_body(self, f) -> memoryview:
+        """
+        Get the content of a file object returned by send_head() without reading big regular files into memory.
+        """
+        if isinstance(f, io.BytesIO):
+            # No copy for a buffer created from bytes
+            return memoryview(f.getvalue())
+
+        try:
+            size = os.fstat(f.fileno()).st_size
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            size = None
+
+        try:
+            if size is None or size <= self.rwchunksize:
+                # Small files are sent with a single call
+                return memoryview(f.read())
+            # The pages of the file are copied to the output buffer of the connection and it is unmapped after the
+            # last part has been sent
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        finally:
+            f.close()
+
+    def _take_head(self) -> bytes:
+        head = "".join(self._head).encode("utf-8")
+        self._head = []
+        return head
+
+    def _format_head(self, code, message, headers, values) -> bytes:
+        """
+        Format the status line and the header fields of a response.
+        """
+        if message is None:
+            if code in self.responses:
+                message = self.responses[code][0]
+            else:
+                message = ''
+        head = "%s %d %s\r\n" % ("HTTP/1.1", code, message) + headers.format(values) + "\r\n"
+        return head.encode("utf-8")
+
+    def _send_cached(self, entry):
+        """
+        Send a cached response like send_head() does.
+
+        :return: File object to pass to copyfile()
+        """
+        if self.header is not None and self.header.type == b'HEAD':
+            self.send(entry.head)
+            return io.BytesIO(b"")
+        # The head is sent with the content
+        return io.BytesIO(entry.data)
+
     def send_head(self):
+        cache = self.static_cache
+        if cache is not None:
+            entry = cache.get(("file", self.header.path))
+            if entry is not None:
+                return self._send_cached(entry)
+
         rpath = os.path.normpath(self.header.path)
         fpath = os.path.join(self.root, rpath[1:])
         apath = os.path.abspath(fpath)
@@ -814,21 +1047,40 @@ class httpd(connection):
                 return self.send_error(404)
 
             try:
-                content = self._render_file_template(apath)
+                template = self._get_file_template(apath)
             except DionaeaHTTPError as e:
                 return self.send_error(code=e.code)
 
+            sources = None
+            content = None
+            if template is not None:
+                if cache is not None and cache.is_static_template(template):
+                    # The file is used if the template renders no content
+                    sources = stat_sources([template.filename, apath])
+                content = template.render(
+                    connection=self,
+                    values=self.template_values
+                )
+            elif cache is not None:
+                # Invalidate the response if a template is added
+                sources = stat_sources([apath, apath + self.template_file_extension])
+
             if isinstance(content, str):
                 content = content.encode("utf-8")
 
             if content:
-                f = io.BytesIO()
-                f.write(content)
-                f.seek(0)
                 content_length = len(content)
             else:
-                f = io.open(apath, "rb")
-                content_length = os.stat(apath).st_size
+                content = None
+                try:
+                    content_length = os.stat(apath).st_size
+                except OSError:
+                    # Only the template exists but templates are disabled
+                    return self.send_error(404)
+                if sources is not None and content_length <= cache.max_file_size:
+                    with io.open(apath, "rb") as fp:
+                        content = fp.read()
+                    content_length = len(content)
 
             content_type = self.default_content_type
             if self.detect_content_type:
@@ -838,16 +1090,29 @@ class httpd(connection):
                 if detected_mimetype[0]:
                     content_type = detected_mimetype[0]
 
-            self.send_response(200)
             headers = self._get_headers(code=200, filename=apath)
-            headers.send(
-                self,
-                {
-                    "connection": "close",
-                    "content_length": content_length,
-                    "content_type": content_type
-                }
-            )
+            values = {
+                "connection": "close",
+                "content_length": content_length,
+                "content_type": content_type
+            }
+            if sources is not None and content is not None:
+                entry = cache.put(
+                    ("file", self.header.path),
+                    self._format_head(200, None, headers, values),
+                    content,
+                    sources=sources
+                )
+                if entry is not None:
+                    return self._send_cached(entry)
+
+            if content is not None:
+                f = io.BytesIO(content)
+            else:
+                f = io.open(apath, "rb")
+
+            self.send_response(200)
+            headers.send(self, values)
             self.end_headers()
             return f
 
@@ -856,15 +1121,23 @@ class httpd(connection):
     def handle_io_out(self):
         logger.debug("handle_io_out")
         if self.state == STATE_SENDFILE:
-            w = self.file.read(self.rwchunksize)
-            if len(w) > 0:
-                self.send(w)
+            # Only a part is sent every time the output buffer is empty, so the speed limit of the connection is kept
+            body = self._body
+            start = self._body_pos
+            end = start + self.rwchunksize
+            self._body_pos = end
+            last = end >= len(body)
+            head = self._take_head() if self._head else None
+            if head:
+                self.send(head + body[start:end])
+            elif start < len(body):
+                self.send(body[start:end])
             # send call call handle_io_out
             # to avoid double close warning we check state
-            if len(w) < self.rwchunksize and self.state is not None:
+            if last and self.state is not None:
                 self.state = None
                 self.close()
-                self.file.close()
+                self._body = None
 
     def list_directory(self, path):
         """Helper to produce a directory listing (absent index.html).
@@ -877,8 +1150,7 @@ class httpd(connection):
         try:
             filenames = os.listdir(path)
         except os.error:
-            self.send_error(404, "No permission to list directory")
-            return None
+            return self.send_error(404, "No permission to list directory")
 
         files = []
         for name in filenames:
@@ -950,7 +1222,7 @@ class httpd(connection):
                 message = self.responses[code][0]
             else:
                 message = ''
-        self.send("%s %d %s\r\n" % ("HTTP/1.1", code, message))
+        self._head.append("%s %d %s\r\n" % ("HTTP/1.1", code, message))
 
     def send_error(self, code, message=None):
         if message is None:
@@ -958,12 +1230,24 @@ class httpd(connection):
                 message = self.responses[code][0]
             else:
                 message = ''
+
+        cache = self.static_cache
+        cache_key = ("error", code, message)
+        if cache is not None:
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return self._send_cached(entry)
+
         enc = sys.getfilesystemencoding()
 
-        content = self._render_global_error_page(
-            code=code,
-            message=message
-        )
+        content = None
+        template = self._get_global_error_page_template(code)
+        if template is not None:
+            content = template.render(
+                code=code,
+                message=message,
+                values=self.template_values
+            )
 
         if content is None:
             r = []
@@ -983,17 +1267,24 @@ class httpd(connection):
         if isinstance(content, str):
             content = content.encode(enc)
 
-        self.send_response(code, message)
-
         headers = self._get_headers(code=code)
-        headers.send(
-            self,
-            {
-                "connection": "close",
-                "content_length": len(content),
-                "content_type": "text/html; charset=%s" % enc
-            }
-        )
+        values = {
+            "connection": "close",
+            "content_length": len(content),
+            "content_type": "text/html; charset=%s" % enc
+        }
+        if cache is not None and (template is None or cache.is_static_template(template)):
+            entry = cache.put(
+                cache_key,
+                self._format_head(code, message, headers, values),
+                content,
+                template=template
+            )
+            if entry is not None:
+                return self._send_cached(entry)
+
+        self.send_response(code, message)
+        headers.send(self, values)
         self.end_headers()
 
         f = io.BytesIO()
@@ -1002,12 +1293,22 @@ class httpd(connection):
         return f
 
     def send_header(self, key, value):
-        self.send("%s: %s\r\n" % (key, value))
+        self._head.append("%s: %s\r\n" % (key, value))
 
     def end_headers(self):
-        self.send("\r\n")
+        self._head.append("\r\n")
+
+    def close(self):
+        # Responses without body
+        if self._head:
+            self.send(self._take_head())
+        connection.close(self)
 
     def handle_disconnect(self):
+        if self.form_parser is not None:
+            # Remove the file of an incomplete upload
+            self.form_parser.abort()
+            self.form_parser = None
         return False
 
     def handle_timeout_idle(self):
@@ -0,0 +1,438 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Parse the body of HTTP POST requests with form data.
+
+The parsers are fed with the chunks of the body as they are received. Values of fields are kept in memory, the
+content of file parts is written directly to a file and hashed while it is written. So an uploaded file is only
+written once and not read again to compute the digests.
+
+The parsed fields are available as :class:`FormData`, which provides the parts of the interface of
+cgi.FieldStorage used by the templates.
+"""
+
+import logging
+import os
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import unquote_to_bytes
+
+from dionaea.digest import StreamHasher, file_hasher
+
+logger = logging.getLogger("http")
+
+
+def parse_options_header(value: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Parse a header value with options like Content-Type or Content-Disposition.
+
+    :return: Tuple of the lowercase main value and the options by lowercase name
+    """
+    main, _, rest = value.partition(";")
+    options = {}
+    pos = 0
+    length = len(rest)
+    while pos < length:
+        end = rest.find("=", pos)
+        if end < 0:
+            break
+        name = rest[pos:end].strip(" \t;").lower()
+        pos = end + 1
+        while pos < length and rest[pos] in " \t":
+            pos += 1
+        if pos < length and rest[pos] == '"':
+            # Quoted string with escaped characters
+            chars = []
+            pos += 1
+            while pos < length and rest[pos] != '"':
+                if rest[pos] == "\\" and pos + 1 < length:
+                    pos += 1
+                chars.append(rest[pos])
+                pos += 1
+            value = "".join(chars)
+            end = rest.find(";", pos)
+        else:
+            end = rest.find(";", pos)
+            value = rest[pos:end if end >= 0 else length].strip()
+        options[name] = value
+        if end < 0:
+            break
+        pos = end + 1
+    return main.strip().lower(), options
+
+
+class FormField(object):
+    """
+    Field of a submitted form.
+
+    The value of a file part is not kept in memory, it is written to the file returned by the file factory of the
+    parser.
+
+    :param name: Name of the field
+    :param value: Value of the field, None for file parts
+    :param filename: The filename of a file part, None for other fields
+    :param type: The Content-Type of the part
+    :param headers: Headers of the part by lowercase name
+    """
+    def __init__(self, name: Optional[str], value: Optional[str] = None, filename: Optional[str] = None,
+                 type: Optional[str] = None, headers: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.filename = filename
+        self.type = type
+        self.headers = headers if headers is not None else {}
+        #: Number of bytes received
+        self.size = 0
+        #: True if the value has been truncated because of the max field size
+        self.truncated = False
+        #: Path of the file of a file part
+        self.path: Optional[str] = None
+        #: Digests of the content of a file part
+        self.digests: Optional[Dict[str, str]] = None
+        self._value = value
+        self._chunks: List[bytes] = []
+        self._file: Optional[BinaryIO] = None
+        self._hasher: Optional[StreamHasher] = None
+
+    def __repr__(self) -> str:
+        return "FormField(%r, %r)" % (self.name, self.filename if self.filename is not None else self.value)
+
+    @property
+    def value(self) -> Optional[str]:
+        if self._value is None and self.filename is None:
+            self._value = b"".join(self._chunks).decode("utf-8", errors="replace")
+            self._chunks = []
+        return self._value
+
+    def open(self, fp: BinaryIO):
+        self._file = fp
+        self.path = fp.name
+        self._hasher = StreamHasher()
+
+    def write(self, data: bytes, max_size: int = 0):
+        self.size += len(data)
+        if self.filename is not None:
+            if self._file is not None:
+                self._file.write(data)
+                self._hasher.update(data)
+            return
+        if self.truncated:
+            return
+        if max_size and self.size > max_size:
+            data = data[:max(0, len(data) - (self.size - max_size))]
+            self.truncated = True
+            logger.warning("Value of form field '%s' truncated after %d bytes", self.name, max_size)
+        self._chunks.append(bytes(data))
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self.digests = self._hasher.hexdigests()
+        self._hasher = None
+
+    def remove(self):
+        """
+        Close and remove the file of a file part.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._hasher = None
+        if self.path is not None:
+            if self.digests is not None:
+                # The digests might have been added to the cache of the file hasher
+                file_hasher.discard(self.path)
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+class FormData(object):
+    """
+    Fields of a submitted form.
+
+    Like cgi.FieldStorage an item is a single field or a list of fields if more than one field with the name exists.
+    """
+    def __init__(self):
+        #: All fields in the order they have been received
+        self.list: List[FormField] = []
+        self._fields: Dict[Optional[str], List[FormField]] = {}
+
+    def __contains__(self, name) -> bool:
+        return name in self._fields
+
+    def __getitem__(self, name) -> Union[FormField, List[FormField]]:
+        fields = self._fields[name]
+        if len(fields) == 1:
+            return fields[0]
+        return list(fields)
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def add(self, field: FormField):
+        self.list.append(field)
+        self._fields.setdefault(field.name, []).append(field)
+
+    def keys(self) -> List[Optional[str]]:
+        return list(self._fields)
+
+    def getvalue(self, name, default: Any = None) -> Any:
+        fields = self._fields.get(name)
+        if not fields:
+            return default
+        if len(fields) == 1:
+            return fields[0].value
+        return [field.value for field in fields]
+
+    def getlist(self, name) -> List[Optional[str]]:
+        return [field.value for field in self._fields.get(name, [])]
+
+    @property
+    def files(self) -> List[FormField]:
+        return [field for field in self.list if field.filename is not None]
+
+
+class FormParser(object):
+    """
+    Base class of the parsers.
+
+    :param form: The parsed fields are added to this form
+    :param max_num_fields: Max number of fields, additional fields are ignored
+    :param max_field_size: Max number of bytes of the value of a field, longer values are truncated
+    """
+    def __init__(self, form: FormData, max_num_fields: int = 100, max_field_size: int = 64 * 1024):
+        self.form = form
+        self.max_num_fields = max_num_fields
+        self.max_field_size = max_field_size
+        #: Number of ignored fields
+        self.ignored = 0
+        #: True if the end of the form has been found, the rest of the body can be ignored
+        self.done = False
+
+    def _field_allowed(self) -> bool:
+        if self.max_num_fields and len(self.form.list) >= self.max_num_fields:
+            if self.ignored == 0:
+                logger.warning("Max number of form fields reached, ignoring additional fields")
+            self.ignored += 1
+            return False
+        return True
+
+    def feed(self, data: bytes):
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Finish parsing after the complete body has been received.
+        """
+        self.done = True
+
+    def abort(self):
+        """
+        Stop parsing and remove the files of incomplete parts.
+        """
+        self.done = True
+
+
+class UrlencodedParser(FormParser):
+    """
+    Parser for application/x-www-form-urlencoded bodies.
+    """
+    def __init__(self, form: FormData, **kwargs):
+        FormParser.__init__(self, form, **kwargs)
+        self._buf = bytearray()
+
+    def feed(self, data: bytes):
+        if not self.done:
+            self._buf += data
+
+    def close(self):
+        if self.done:
+            return
+        FormParser.close(self)
+        data = bytes(self._buf)
+        self._buf = bytearray()
+        for pair in data.split(b"&"):
+            name, _, value = pair.partition(b"=")
+            if not value:
+                # Blank values are ignored like cgi.FieldStorage did
+                continue
+            if not self._field_allowed():
+                break
+            name = unquote_to_bytes(name.replace(b"+", b" ")).decode("utf-8", errors="replace")
+            field = FormField(name)
+            field.write(unquote_to_bytes(value.replace(b"+", b" ")), max_size=self.max_field_size)
+            self.form.add(field)
+
+    def abort(self):
+        FormParser.abort(self)
+        self._buf = bytearray()
+
+
+class MultipartParser(FormParser):
+    """
+    Parser for multipart/form-data bodies.
+
+    :param boundary: The boundary from the Content-Type header
+    :param form: The parsed fields are added to this form
+    :param file_factory: Called without arguments to create the file for a file part, the file must have a name
+    :param on_file: Called with the field after a file part has been received completely
+    :param max_header_size: Max size of the headers of a part
+    """
+    STATE_PREAMBLE, STATE_DELIMITER, STATE_HEADERS, STATE_BODY = range(4)
+
+    def __init__(self, boundary: bytes, form: FormData, file_factory: Optional[Callable[[], BinaryIO]] = None,
+                 on_file: Optional[Callable[[FormField], None]] = None, max_header_size: int = 16 * 1024,
+                 **kwargs):
+        FormParser.__init__(self, form, **kwargs)
+        self.file_factory = file_factory
+        self.on_file = on_file
+        self.max_header_size = max_header_size
+        self._delimiter = b"\r\n--" + boundary
+        # The first delimiter might not be preceded by a line break
+        self._buf = bytearray(b"\r\n")
+        self._state = self.STATE_PREAMBLE
+        self._part: Optional[FormField] = None
+
+    def feed(self, data: bytes):
+        if self.done:
+            return
+        self._buf += data
+        self._process()
+
+    def _process(self):
+        buf = self._buf
+        delimiter = self._delimiter
+        # Bytes at the end of the buffer which might be the start of a delimiter
+        keep = len(delimiter) - 1
+        while not self.done:
+            if self._state == self.STATE_BODY:
+                pos = buf.find(delimiter)
+                if pos < 0:
+                    if len(buf) > keep:
+                        self._part_data(buf[:len(buf) - keep])
+                        del buf[:len(buf) - keep]
+                    return
+                if pos > 0:
+                    self._part_data(buf[:pos])
+                del buf[:pos + len(delimiter)]
+                self._end_part()
+                self._state = self.STATE_DELIMITER
+
+            elif self._state == self.STATE_PREAMBLE:
+                pos = buf.find(delimiter)
+                if pos < 0:
+                    if len(buf) > keep:
+                        del buf[:len(buf) - keep]
+                    return
+                del buf[:pos + len(delimiter)]
+                self._state = self.STATE_DELIMITER
+
+            elif self._state == self.STATE_DELIMITER:
+                if len(buf) < 2:
+                    return
+                if buf[:2] == b"--":
+                    # Closing delimiter, the epilogue is ignored
+                    buf.clear()
+                    self.done = True
+                    return
+                # Skip the transport padding and the line break
+                pos = buf.find(b"\n")
+                if pos < 0:
+                    if len(buf) > self.max_header_size:
+                        self._error("Invalid delimiter line")
+                    return
+                del buf[:pos + 1]
+                self._state = self.STATE_HEADERS
+
+            elif self._state == self.STATE_HEADERS:
+                if buf[:2] == b"\r\n":
+                    # Part without headers
+                    end = 0
+                    size = 2
+                else:
+                    end = buf.find(b"\r\n\r\n")
+                    size = 4
+                if end < 0:
+                    if len(buf) > self.max_header_size:
+                        self._error("Headers of part too long")
+                    return
+                headers = self._parse_headers(bytes(buf[:end]))
+                del buf[:end + size]
+                self._begin_part(headers)
+                self._state = self.STATE_BODY
+
+    @staticmethod
+    def _parse_headers(data: bytes) -> Dict[str, str]:
+        headers = {}
+        for line in data.decode("utf-8", errors="replace").split("\r\n"):
+            name, sep, value = line.partition(":")
+            if not sep:
+                continue
+            headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def _begin_part(self, headers: Dict[str, str]):
+        if not self._field_allowed():
+            self._part = None
+            return
+        _, options = parse_options_header(headers.get("content-disposition", ""))
+        field = FormField(
+            options.get("name"),
+            filename=options.get("filename"),
+            type=headers.get("content-type"),
+            headers=headers
+        )
+        if field.filename is not None and self.file_factory is not None:
+            try:
+                field.open(self.file_factory())
+            except OSError:
+                logger.warning("Unable to create file for form field '%s'", field.name, exc_info=True)
+        self._part = field
+
+    def _part_data(self, data: bytes):
+        if self._part is not None:
+            self._part.write(data, max_size=self.max_field_size)
+
+    def _end_part(self):
+        field = self._part
+        self._part = None
+        if field is None:
+            return
+        field.close()
+        self.form.add(field)
+        if field.filename is not None and self.on_file is not None:
+            self.on_file(field)
+
+    def _error(self, message: str):
+        logger.warning("Unable to parse multipart form data: %s", message)
+        self.abort()
+
+    def close(self):
+        """
+        Finish parsing, like cgi.FieldStorage the last part ends with the body if the closing delimiter is missing.
+        """
+        if self.done:
+            return
+        if self._state == self.STATE_BODY:
+            if self._buf:
+                self._part_data(self._buf)
+            self._end_part()
+        self._buf = bytearray()
+        FormParser.close(self)
+
+    def abort(self):
+        if self._part is not None:
+            self._part.remove()
+            self._part = None
+        self._buf = bytearray()
+        FormParser.abort(self)
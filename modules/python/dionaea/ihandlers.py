@@ -56,10 +56,32 @@ def start():
                 method()
 
 
+def log_dispatch_stats(handler):
+    stats = handler.dispatch_stats()
+    count = sum(v["count"] for v in stats.values())
+    if count == 0:
+        return
+    logger.debug(
+        "%s handled %d incident(s) in %.3f seconds",
+        str(handler),
+        count,
+        sum(v["time"] for v in stats.values())
+    )
+    for origin, values in sorted(stats.items(), key=lambda item: item[1]["time"], reverse=True):
+        logger.debug(
+            "  %s: %d incident(s) in %.3f seconds (%s)",
+            origin,
+            values["count"],
+            values["time"],
+            values["method"]
+        )
+
+
 def stop():
     global g_handlers
     for handler_loader, ihandlers in g_handlers.items():
         for i in ihandlers:
+            log_dispatch_stats(i)
             logger.debug("deleting %s" % str(i))
             handler_loader.stop(i)
             del i
@@ -7,18 +7,89 @@
 import datetime
 import json
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 from dionaea.core import ihandler
+from dionaea.writer import BatchWriter
 from dionaea.log_db_sql import model
 
 logger = logging.getLogger('log_db_sql')
 logger.setLevel(logging.DEBUG)
 
 
+class IdAllocator(object):
+    """
+    Assign ids to new rows without asking the database for every row.
+
+    Ranges of ids are reserved in the id_range table, so multiple instances can write to the same database.
+
+    :param engine: The database engine
+    :param block_size: Number of ids reserved at once
+    """
+    def __init__(self, engine, block_size=1000):
+        self.engine = engine
+        self.block_size = max(1, block_size)
+        # table name -> [next id, end of the range]
+        self._ranges = {}
+
+    def next(self, model_class):
+        """
+        Get the next id for a table.
+
+        :param model_class: The model class
+        :return: The id
+        :rtype: int
+        """
+        name = model_class.__tablename__
+        id_range = self._ranges.get(name)
+        if id_range is None or id_range[0] >= id_range[1]:
+            id_range = self._reserve(model_class)
+            self._ranges[name] = id_range
+        next_id = id_range[0]
+        id_range[0] += 1
+        return next_id
+
+    def _reserve(self, model_class):
+        table = model.IdRange.__table__
+        name = model_class.__tablename__
+        for _ in range(2):
+            try:
+                with self.engine.begin() as conn:
+                    result = conn.execute(
+                        table.update().where(
+                            table.c.name == name
+                        ).values(
+                            next_id=table.c.next_id + self.block_size
+                        )
+                    )
+                    if result.rowcount == 0:
+                        max_id = conn.execute(select([func.max(model_class.id)])).scalar()
+                        end = (max_id or 0) + 1 + self.block_size
+                        conn.execute(table.insert().values(name=name, next_id=end))
+                    else:
+                        end = conn.execute(select([table.c.next_id]).where(table.c.name == name)).scalar()
+                return [end - self.block_size, end]
+            except IntegrityError:
+                # Another instance has created the row
+                continue
+        raise RuntimeError("Unable to reserve ids for table %s" % name)
+
+
 class LogSQLHandler(ihandler):
+    """
+    Log the incidents to a database supported by SQLAlchemy.
+
+    The incident handlers only build records and pass them to the writer thread. The connections are identified by
+    local ids, the writer thread maps them to the ids of the database rows.
+
+    In bulk insert mode the ids are assigned by an IdAllocator. The rows are collected and written with
+    bulk_insert_mappings() when the writer commits.
+    """
     def __init__(self, path, config=None):
         logger.debug("%s ready!" % (self.__class__.__name__))
         self.path = path
@@ -28,6 +99,21 @@ class LogSQLHandler(ihandler):
         self.attacks = {}
         self.pending = {}
 
+        self._connection_id = 0
+        # Only used by the writer thread: local id -> database id
+        self._connection_ids = OrderedDict()
+        self._connection_ids_max = int(config.get("connection_id_cache_size", 100000))
+        # Only used by the writer thread: local ids mapped since the last commit
+        self._new_connection_ids = []
+        self._writer = None
+
+        self.bulk_insert = bool(config.get("bulk_insert", False))
+        self._id_allocator = None
+        # Only used by the writer thread in bulk insert mode
+        self._bulk_rows = {}
+        self._bulk_connections = {}
+        self._bulk_updates = []
+
     def start(self):
         ihandler.__init__(self, self.path)
         # mapping socket -> attackid
@@ -43,65 +129,258 @@ class LogSQLHandler(ihandler):
         model.Base.query = self.db_session.query_property()
         model.Base.metadata.create_all(bind=engine)
 
+        commit = self._commit
+        rollback = self._rollback
+        if self.bulk_insert:
+            self._id_allocator = IdAllocator(engine, block_size=int(self._config.get("id_block_size", 1000)))
+            commit = self._commit_bulk
+            rollback = self._rollback_bulk
+
+        self._writer = BatchWriter(
+            commit=commit,
+            rollback=rollback,
+            savepoint=self._savepoint,
+            max_queue_size=int(self._config.get("max_queue_size", 10000)),
+            commit_max_rows=int(self._config.get("commit_max_rows", 100)),
+            commit_interval=float(self._config.get("commit_interval", 0)),
+            name="log_db_sql",
+        )
+        self._writer.start()
+
+    def stop(self):
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+
     def handle_incident(self, icd):
         #        print("unknown")
         pass
 
-    def connection_insert(self, icd, connection_type):
-        con = icd.con
-        connection = model.Connection(
-            timestamp=datetime.datetime.now(),
-            type=connection_type,
-            transport=con.transport,
-            protocol=con.protocol,
-            local_host=con.local.host,
-            local_port=con.local.port,
-            remote_host=con.remote.host,
-            remote_port=con.remote.port,
-            remote_hostname=con.remote.hostname
-        )
-        connection.root = connection.id
-
-        self.db_session.add(connection)
-        self.db_session.commit()
+    def _get_connection_id(self, attackid):
+        """
+        Get the database id of a connection. Only call this from the writer thread.
+
+        :param attackid: The local id
+        :return: The database id or None if unknown
+        """
+        return self._connection_ids.get(attackid)
+
+    def _set_connection_id(self, attackid, connection_id):
+        self._connection_ids[attackid] = connection_id
+        self._new_connection_ids.append(attackid)
+        while len(self._connection_ids) > self._connection_ids_max:
+            self._connection_ids.popitem(last=False)
+
+    def _insert(self, model_class, values):
+        """
+        Insert a row. Called in the writer thread.
+
+        :param model_class: The model class
+        :param values: Dict with the column values
+        :return: The id of the row
+        :rtype: int
+        """
+        if self._id_allocator is not None:
+            values["id"] = self._id_allocator.next(model_class)
+            self._bulk_rows.setdefault(model_class, []).append(values)
+            if model_class is model.Connection:
+                self._bulk_connections[values["id"]] = values
+            return values["id"]
+
+        row = model_class(**values)
+        self.db_session.add(row)
+        # Get the id without committing the transaction
+        self.db_session.flush()
+        return row.id
+
+    def _add(self, model_class, values):
+        """
+        Insert a row if the id is not required. Called in the writer thread.
+        """
+        if self._id_allocator is not None:
+            self._insert(model_class, values)
+            return
+        self.db_session.add(model_class(**values))
+
+    def _add_connection_data(self, model_class, attackid, values):
+        """
+        Add a row which is linked to a connection. Called in the writer thread.
+        """
+        connection_id = self._get_connection_id(attackid)
+        if connection_id is None:
+            logger.debug("Unknown connection for attackid %d, skipping %s", attackid, model_class.__name__)
+            return
+        values["connection_id"] = connection_id
+        self._add(model_class, values)
+
+    def _update_connections(self, column, value, values):
+        """
+        Update all connections with the given column value. Called in the writer thread.
+        """
+        if self._id_allocator is not None:
+            # Rows not written yet are updated in place. The updates are
+            # executed before the new rows are inserted, so they only affect
+            # the rows written by previous commits.
+            if column == "id":
+                row = self._bulk_connections.get(value)
+                if row is not None:
+                    row.update(values)
+                    return
+            else:
+                for row in self._bulk_connections.values():
+                    if row[column] == value:
+                        row.update(values)
+            self._bulk_updates.append((column, value, values))
+            return
 
-        # Old trigger
         self.db_session.query(
             model.Connection
         ).filter(
-            model.Connection.id == connection.id and model.Connection.root is None
-        ).update({
-            "root": connection.id
-        })
+            getattr(model.Connection, column) == value
+        ).update(values)
+
+    def _commit_bulk(self):
+        # Called in the writer thread
+        for column, value, values in self._bulk_updates:
+            self.db_session.query(
+                model.Connection
+            ).filter(
+                getattr(model.Connection, column) == value
+            ).update(values, synchronize_session=False)
+
+        # Insert parents before children
+        tables = model.Base.metadata.sorted_tables
+        for model_class in sorted(self._bulk_rows, key=lambda m: tables.index(m.__table__)):
+            self.db_session.bulk_insert_mappings(model_class, self._bulk_rows[model_class])
+
+        self._bulk_rows = {}
+        self._bulk_connections = {}
+        self._bulk_updates = []
         self.db_session.commit()
+        self._new_connection_ids = []
+
+    @contextmanager
+    def _savepoint(self):
+        """
+        Undo the changes of a failed record, the other records of the transaction are kept. Called in the writer
+        thread.
+        """
+        connection_ids = len(self._new_connection_ids)
+        if self._id_allocator is None:
+            try:
+                with self.db_session.begin_nested():
+                    yield
+            except Exception:
+                self._forget_connection_ids(connection_ids)
+                raise
+            return
 
-        attackid = connection.id
+        # In bulk insert mode the rows are written on commit, only remove the rows collected for the record
+        rows = {model_class: len(values) for model_class, values in self._bulk_rows.items()}
+        connections = len(self._bulk_connections)
+        updates = len(self._bulk_updates)
+        try:
+            yield
+        except Exception:
+            for model_class, values in self._bulk_rows.items():
+                del values[rows.get(model_class, 0):]
+            for connection_id in list(self._bulk_connections)[connections:]:
+                del self._bulk_connections[connection_id]
+            del self._bulk_updates[updates:]
+            self._forget_connection_ids(connection_ids)
+            raise
+
+    def _forget_connection_ids(self, start=0):
+        """
+        Remove the connection ids mapped by discarded changes, so no rows are linked to connections which do not
+        exist. Called in the writer thread.
+
+        :param start: Index of the first mapping to remove in the mappings since the last commit
+        """
+        for attackid in self._new_connection_ids[start:]:
+            self._connection_ids.pop(attackid, None)
+        del self._new_connection_ids[start:]
+
+    def _commit(self):
+        # Called in the writer thread
+        self.db_session.commit()
+        self._new_connection_ids = []
+
+    def _rollback(self):
+        # Called in the writer thread
+        self._forget_connection_ids()
+        self.db_session.rollback()
+
+    def _rollback_bulk(self):
+        # Called in the writer thread
+        self._bulk_rows = {}
+        self._bulk_connections = {}
+        self._bulk_updates = []
+        self._forget_connection_ids()
+        self.db_session.rollback()
+
+    def _insert_connection(self, attackid, values, pending):
+        # Called in the writer thread
+        values["root"] = None
+        connection_id = self._insert(model.Connection, values)
+        self._update_connections("id", connection_id, {"root": connection_id})
+        self._set_connection_id(attackid, connection_id)
+
+        for i in pending:
+            child_id = self._get_connection_id(i)
+            if child_id is None:
+                continue
+            self._update_connections("id", child_id, {"root": connection_id, "parent": connection_id})
+            self._update_connections("root", child_id, {"root": connection_id})
+
+    def _update_connection_link(self, childid, parentroot, parentid):
+        # Called in the writer thread
+        child_id = self._get_connection_id(childid)
+        parent_root = self._get_connection_id(parentroot)
+        parent_id = self._get_connection_id(parentid)
+        if child_id is None or parent_root is None or parent_id is None:
+            return
+        self._update_connections("id", child_id, {"root": parent_root, "parent": parent_id})
+
+    def _update_connection_root(self, old_root, new_root):
+        # Called in the writer thread
+        old_root = self._get_connection_id(old_root)
+        new_root = self._get_connection_id(new_root)
+        if old_root is None or new_root is None:
+            return
+        self._update_connections("root", old_root, {"root": new_root})
+
+    def connection_insert(self, icd, connection_type):
+        con = icd.con
+        self._connection_id += 1
+        attackid = self._connection_id
         self.attacks[con] = (attackid, attackid)
 
+        pending = ()
         # maybe this was a early connection?
         if con in self.pending:
             # the connection was linked before we knew it
             # that means we have to
             # - update the connection_root and connection_parent for all connections which had the pending
             # - update the connection_root for all connections which had the 'childid' as connection_root
-            for i in self.pending[con]:
-                print("%s %s %s" % (attackid, attackid, i))
-                self.db_session.query(
-                    model.Connection
-                ).filter(
-                    model.Connection.id == i
-                ).update({
-                    "root": attackid,
-                    "parent": attackid
-                })
-                self.db_session.query(
-                    model.Connection
-                ).filter(
-                    model.Connection.root == i
-                ).update({
-                    "root": attackid
-                })
-            self.db_session.commit()
+            pending = tuple(self.pending[con])
+
+        self._writer.put(
+            self._insert_connection,
+            attackid,
+            dict(
+                timestamp=datetime.datetime.now(),
+                type=connection_type,
+                transport=con.transport,
+                protocol=con.protocol,
+                local_host=con.local.host,
+                local_port=con.local.port,
+                remote_host=con.remote.host,
+                remote_port=con.remote.port,
+                remote_hostname=con.remote.hostname
+            ),
+            pending
+        )
         return attackid
 
     def handle_incident_dionaea_connection_tcp_listen(self, icd):
@@ -172,15 +451,7 @@ class LogSQLHandler(ihandler):
             self.attacks[icd.child] = (parentroot, childid)
             logger.info("child has ids %s", str(self.attacks[icd.child]))
             logger.info("child %i parent %i root %i", childid, parentid, parentroot)
-            self.db_session.query(
-                model.Connection
-            ).filter(
-                model.Connection.id == childid
-            ).update({
-                "root": parentroot,
-                "parent": parentid
-            })
-            self.db_session.commit()
+            self._writer.put(self._update_connection_link, childid, parentroot, parentid)
 
         if icd.child in self.pending:
             # if the new accepted connection was pending
@@ -192,14 +463,7 @@ class LogSQLHandler(ihandler):
             else:
                 childid = parentid
 
-            self.db_session.query(
-                model.Connection
-            ).filter(
-                model.Connection.root == childid
-            ).update({
-                "root": parentroot
-            })
-            self.db_session.commit()
+            self._writer.put(self._update_connection_root, childid, parentroot)
 
     def handle_incident_dionaea_connection_free(self, icd):
         con = icd.con
@@ -218,13 +482,14 @@ class LogSQLHandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("emu profile for attackid %i", attackid)
-        self.db_session.add(
-            model.EmuProfile(
-                connection_id=attackid,
+        self._writer.put(
+            self._add_connection_data,
+            model.EmuProfile,
+            attackid,
+            dict(
                 json_data=icd.profile
             )
         )
-        self.db_session.commit()
 
     def handle_incident_dionaea_download_offer(self, icd):
         con = icd.con
@@ -232,13 +497,14 @@ class LogSQLHandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("offer for attackid %i", attackid)
-        self.db_session.add(
-            model.DownloadOffer(
-                connection_id=attackid,
+        self._writer.put(
+            self._add_connection_data,
+            model.DownloadOffer,
+            attackid,
+            dict(
                 url=icd.url
             )
         )
-        self.db_session.commit()
 
     def handle_incident_dionaea_download_complete_hash(self, icd):
         con = icd.con
@@ -246,14 +512,15 @@ class LogSQLHandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("complete for attackid %i", attackid)
-        self.db_session.add(
-            model.DownloadData(
-                connection_id=attackid,
+        self._writer.put(
+            self._add_connection_data,
+            model.DownloadData,
+            attackid,
+            dict(
                 url=icd.url,
                 md5_hash=icd.md5hash
             )
         )
-        self.db_session.commit()
 
     def handle_incident_dionaea_service_shell_listen(self, icd):
         con = icd.con
@@ -261,13 +528,14 @@ class LogSQLHandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("listen shell for attackid %i", attackid)
-        self.db_session.add(
-            model.EmuService(
-                connection_id=attackid,
+        self._writer.put(
+            self._add_connection_data,
+            model.EmuService,
+            attackid,
+            dict(
                 url="bindshell://{}".format(str(icd.port))
             )
         )
-        self.db_session.commit()
 
     def handle_incident_dionaea_service_shell_connect(self, icd):
         con = icd.con
@@ -275,21 +543,24 @@ class LogSQLHandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("connect shell for attackid %i", attackid)
-        self.db_session.add(
-            model.EmuService(
-                connection_id=attackid,
+        self._writer.put(
+            self._add_connection_data,
+            model.EmuService,
+            attackid,
+            dict(
                 url="connectbackshell://" + str(icd.host) + ":" + str(icd.port)
             )
         )
-        self.db_session.commit()
 
     def handle_incident_dionaea_modules_python_p0f(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.db_session.add(
-                model.P0F(
-                    connection_id=attackid,
+            self._writer.put(
+                self._add_connection_data,
+                model.P0F,
+                attackid,
+                dict(
                     genre=icd.genre,
                     link=icd.link,
                     detail=icd.detail,
@@ -300,67 +571,93 @@ class LogSQLHandler(ihandler):
                     fw=icd.fw
                 )
             )
-            self.db_session.commit()
 
     def handle_incident_dionaea_modules_python_smb_dcerpc_request(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.db_session.add(
-                model.SmbDCERPCRequest(
-                    connection_id=attackid,
+            self._writer.put(
+                self._add_connection_data,
+                model.SmbDCERPCRequest,
+                attackid,
+                dict(
                     uuid=icd.uuid,
                     opnum=icd.opnum
                 )
             )
-            self.db_session.commit()
 
     def handle_incident_dionaea_modules_python_smb_dcerpc_bind(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.db_session.add(
-                model.SmbDCERPCBind(
-                    connection_id=attackid,
+            self._writer.put(
+                self._add_connection_data,
+                model.SmbDCERPCBind,
+                attackid,
+                dict(
                     uuid=icd.uuid,
                     transfer_syntax=icd.transfer_syntax
                 )
             )
-            self.db_session.commit()
 
     def handle_incident_dionaea_modules_python_mssql_login(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.db_session.add(
-                model.MSSQLLogin(
-                    connection_id=attackid,
+            self._writer.put(
+                self._add_connection_data,
+                model.MSSQLLogin,
+                attackid,
+                dict(
                     username=icd.username,
                     password=icd.password
                 )
             )
-            self.db_session.add(
-                model.MSSQLFingerprint(
-                    connection_id=attackid,
+            self._writer.put(
+                self._add_connection_data,
+                model.MSSQLFingerprint,
+                attackid,
+                dict(
                     hostname=icd.hostname,
                     appname=icd.appname,
                     cltintname=icd.cltintname
                 )
             )
-            self.db_session.commit()
 
     def handle_incident_dionaea_modules_python_mssql_cmd(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.db_session.add(
-                model.MSSQLCommand(
-                    connection_id=attackid,
+            self._writer.put(
+                self._add_connection_data,
+                model.MSSQLCommand,
+                attackid,
+                dict(
                     command=icd.cmd,
                     status=icd.status
                 )
             )
-            self.db_session.commit()
+
+    def _insert_virustotal_report(self, md5, permalink, date, scans):
+        # Called in the writer thread
+        scan_id = self._insert(
+            model.VirusTotalScan,
+            dict(
+                md5_hash=md5,
+                permalink=permalink,
+                timestamp=date
+            )
+        )
+
+        for av, res in scans:
+            self._add(
+                model.VirusTotalResult,
+                dict(
+                    virustotal_scan_id=scan_id,
+                    result=res,
+                    scanner=av
+                )
+            )
 
     def handle_incident_dionaea_modules_python_virustotal_report(self, icd):
         md5 = icd.md5hash
@@ -371,41 +668,55 @@ class LogSQLHandler(ihandler):
         if j['response_code'] == 1:
             permalink = j['permalink']
             date = j['scan_date']
-            db_virustotal_scan = model.VirusTotalScan(
-                md5_hash=md5,
-                permalink=permalink,
-                timestamp=date
-            )
-            self.db_session.add(db_virustotal_scan)
 
-            scans = j['scans']
-            for av, val in scans.items():
+            scans = []
+            for av, val in j['scans'].items():
                 res = val['result']
                 # not detected = '' -> NULL
                 if res == '':
                     res = None
+                scans.append((av, res))
 
-                self.db_session.add(
-                    model.VirusTotalResult(
-                        scan=db_virustotal_scan,
-                        result=res,
-                        status=av
-                    )
-                )
-            self.db_session.commit()
+            self._writer.put(self._insert_virustotal_report, md5, permalink, date, tuple(scans))
 
     def handle_incident_dionaea_modules_python_mysql_login(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.db_session.add(
-                model.MySQLLogin(
-                    connection_id=attackid,
+            self._writer.put(
+                self._add_connection_data,
+                model.MySQLLogin,
+                attackid,
+                dict(
                     username=icd.username,
                     password=icd.password
                 )
             )
-            self.db_session.commit()
+
+    def _insert_mysql_command(self, attackid, command, args):
+        # Called in the writer thread
+        connection_id = self._get_connection_id(attackid)
+        if connection_id is None:
+            return
+
+        command_id = self._insert(
+            model.MySQLCommand,
+            dict(
+                connection_id=connection_id,
+                command=command
+            )
+        )
+
+        for i in range(len(args)):
+            arg = args[i]
+            self._add(
+                model.MySQLCommandArgument,
+                dict(
+                    command_id=command_id,
+                    index=i,
+                    value=arg
+                )
+            )
 
     def handle_incident_dionaea_modules_python_mysql_command(self, icd):
         con = icd.con
@@ -414,25 +725,11 @@ class LogSQLHandler(ihandler):
 
         attackid = self.attacks[con][1]
 
-        db_mysql_command = model.MySQLCommand(
-            connection_id=attackid,
-            command=icd.command
-        )
-        self.db_session.add(db_mysql_command)
-
+        args = ()
         if hasattr(icd, 'args'):
-            args = icd.args
-            for i in range(len(args)):
-                arg = args[i]
-                self.db_session.add(
-                    model.MySQLCommandArgument(
-                        command=db_mysql_command,
-                        index=i,
-                        value=arg
-                    )
-                )
+            args = tuple(icd.args)
 
-        self.db_session.commit()
+        self._writer.put(self._insert_mysql_command, attackid, icd.command, args)
 
     def handle_incident_dionaea_modules_python_mqtt_connect(self, icd):
         con = icd.con
@@ -440,9 +737,11 @@ class LogSQLHandler(ihandler):
             return
 
         attackid = self.attacks[con][1]
-        self.db_session.add(
-            model.MQTTFingerprint(
-                connection_id=attackid,
+        self._writer.put(
+            self._add_connection_data,
+            model.MQTTFingerprint,
+            attackid,
+            dict(
                 username=icd.username,
                 password=icd.password,
                 clientid=icd.clientid,
@@ -450,7 +749,6 @@ class LogSQLHandler(ihandler):
                 will_message=icd.willmessage
             )
         )
-        self.db_session.commit()
 
     def handle_incident_dionaea_modules_python_mqtt_publish(self, icd):
         con = icd.con
@@ -458,14 +756,15 @@ class LogSQLHandler(ihandler):
             return
 
         attackid = self.attacks[con][1]
-        self.db_session.add(
-            model.MQTTPublishCommand(
-                connection_id=attackid,
+        self._writer.put(
+            self._add_connection_data,
+            model.MQTTPublishCommand,
+            attackid,
+            dict(
                 topic=icd.publishtopic,
                 message=icd.publishmessage
             )
         )
-        self.db_session.commit()
 
     def handle_incident_dionaea_modules_python_mqtt_subscribe(self, icd):
         con = icd.con
@@ -473,20 +772,23 @@ class LogSQLHandler(ihandler):
             return
 
         attackid = self.attacks[con][1]
-        self.db_session.add(
-            model.MQTTSubscribeCommand(
-                connection_id=attackid,
+        self._writer.put(
+            self._add_connection_data,
+            model.MQTTSubscribeCommand,
+            attackid,
+            dict(
                 messageid=icd.subscribemessageid,
                 topic=icd.subscribetopic
             )
         )
-        self.db_session.commit()
 
-    def handle_incident_dionaea_modules_python_sip_command(self, icd):
+    def _insert_sip_command(self, attackid, values, addrs, vias, sdp_data):
+        # Called in the writer thread
         def add_addr(_type, addr):
-            self.db_session.add(
-                model.SipAddress(
-                    command=db_sip_command,
+            self._add(
+                model.SipAddress,
+                dict(
+                    command_id=command_id,
                     type=_type,
                     display_name=addr["display_name"],
                     uri_scheme=addr["uri"]["scheme"],
@@ -498,21 +800,23 @@ class LogSQLHandler(ihandler):
             )
 
         def add_sdp_condata(c):
-            self.db_session.add(
-                model.SipSdpConnection(
-                    sip_command=db_sip_command,
+            self._add(
+                model.SipSdpConnection,
+                dict(
+                    sip_command_id=command_id,
                     network_type=c["nettype"],
                     address_type=c["addrtype"],
                     connection_address=c["connection_address"],
                     ttl=c["ttl"],
-                    number_of_address=c["number_of_addresses"]
+                    number_of_addresses=c["number_of_addresses"]
                 )
             )
 
         def add_sdp_media(c):
-            self.db_session.add(
-                model.SipSdpMedia(
-                    sip_command=db_sip_command,
+            self._add(
+                model.SipSdpMedia,
+                dict(
+                    sip_command_id=command_id,
                     media=c["media"],
                     port=c["port"],
                     number_of_ports=c["number_of_ports"],
@@ -521,9 +825,10 @@ class LogSQLHandler(ihandler):
             )
 
         def add_sdp_origin(o):
-            self.db_session.add(
-                model.SipSdpOrigin(
-                    sip_command=db_sip_command,
+            self._add(
+                model.SipSdpOrigin,
+                dict(
+                    sip_command_id=command_id,
                     username=o["username"],
                     session_id=o["sess_id"],
                     session_version=o["sess_version"],
@@ -533,6 +838,38 @@ class LogSQLHandler(ihandler):
                 )
             )
 
+        connection_id = self._get_connection_id(attackid)
+        if connection_id is None:
+            return
+
+        values = dict(values)
+        values["connection_id"] = connection_id
+        command_id = self._insert(model.SipCommand, values)
+
+        for name, addr in addrs:
+            add_addr(name, addr)
+
+        for via in vias:
+            self._add(
+                model.SipVia,
+                dict(
+                    command_id=command_id,
+                    protocol=via["protocol"],
+                    address=via["address"],
+                    port=via["port"]
+                )
+            )
+
+        if sdp_data is not None:
+            if 'o' in sdp_data:
+                add_sdp_origin(sdp_data['o'])
+            if 'c' in sdp_data:
+                add_sdp_condata(sdp_data['c'])
+            if 'm' in sdp_data:
+                for i in sdp_data['m']:
+                    add_sdp_media(i)
+
+    def handle_incident_dionaea_modules_python_sip_command(self, icd):
         def calc_allow(a):
             b = { b'UNKNOWN'  :(1<<0),
                 'ACK'       :(1<<1),
@@ -563,39 +900,25 @@ class LogSQLHandler(ihandler):
             return
 
         attackid = self.attacks[con][1]
-        db_sip_command = model.SipCommand(
-            connection_id=attackid,
+        values = dict(
             method=icd.method,
             call_id=icd.call_id,
             user_agent=icd.user_agent,
             allow=calc_allow(icd.allow)
         )
-        self.db_session.add(db_sip_command)
 
+        addrs = []
         for name in ("addr", "to", "contact"):
-            add_addr(name, icd.get(name))
+            addrs.append((name, icd.get(name)))
 
         for i in icd.get('from'):
-            add_addr('from', i)
-
-        for via in icd.get('via'):
-            self.db_session.add(
-                model.SipVia(
-                    command=db_sip_command,
-                    protocol=via["protocol"],
-                    address=via["address"],
-                    port=via["port"]
-                )
-            )
-
-        sdp_data = icd.get("sdp")
-        if sdp_data is not None:
-            if 'o' in sdp_data:
-                add_sdp_origin(sdp_data['o'])
-            if 'c' in sdp_data:
-                add_sdp_condata(sdp_data['c'])
-            if 'm' in sdp_data:
-                for i in sdp_data['m']:
-                    add_sdp_media(i)
-
-        self.db_session.commit()
+            addrs.append(('from', i))
+
+        self._writer.put(
+            self._insert_sip_command,
+            attackid,
+            values,
+            tuple(addrs),
+            tuple(icd.get('via')),
+            icd.get("sdp")
+        )
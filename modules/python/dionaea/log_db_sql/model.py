@@ -34,6 +34,16 @@ class Connection(Base):
     remote_hostname = Column(String(255))
 
 
+class IdRange(Base):
+    """
+    Next free id of a table. Used to reserve ranges of ids in bulk insert mode.
+    """
+    __tablename__ = "id_range"
+
+    name = Column(String(255), primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
+
 class DownloadData(Base):
     __tablename__ = "download_data"
 
@@ -100,9 +100,7 @@ class LogJsonHandler(ihandler):
                 return
 
         idata = {}
-        for k in icd.keys():
-            n = k.decode("ASCII")
-            v = getattr(icd, n)
+        for n, v in icd.to_dict().items():
             if isinstance(v, (int, float, str, list, tuple, dict)) or v is None:
                 logger.debug("Add '%s' to icd data", n)
                 idata[n] = v
@@ -114,7 +112,7 @@ class LogJsonHandler(ihandler):
                 logger.debug("Decode and add '%s' to icd data", n)
                 idata[n] = v.decode(encoding="utf-8", errors="replace")
             elif isinstance(v, connection):
-                k = k.decode("ASCII")
+                k = n
                 if k == "con":
                     k = "connection"
 
@@ -141,7 +139,7 @@ class LogJsonHandler(ihandler):
                 tmp_data["id"] = conn_id
                 idata[k] = tmp_data
             else:
-                logger.warning("Incident '%s' with unknown data type '%s' for key '%s'", icd.origin, type(v), k)
+                logger.warning("Incident '%s' with unknown data type '%s' for key '%s'", icd.origin, type(v), n)
 
         data = {
             "timestamp": datetime.utcnow().isoformat(),
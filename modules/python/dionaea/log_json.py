@@ -4,60 +4,338 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+from collections import deque
 from datetime import datetime
-import json
+import gzip
+import http.client
 import logging
+import os
+import shutil
+import time
 from urllib.parse import urlparse
 
 from dionaea import IHandlerLoader
 from dionaea.core import ihandler
+from dionaea.encoder import flatten_lists, get_json_encoder, utc_timestamp
 from dionaea.exception import LoaderError
+from dionaea.writer import BatchWriter
 
 
 logger = logging.getLogger("log_json")
 logger.setLevel(logging.DEBUG)
 
 
-class FileHandler(object):
-    handle_schemes = ["file"]
+class BaseHandler(object):
+    """
+    Base class of all handlers. The data is serialized and written in a dedicated thread.
+
+    :param str url: The URL
+    :param dict config: The config of the handler
+    """
+    handle_schemes = []
 
-    def __init__(self, url):
+    def __init__(self, url, config=None):
+        if config is None:
+            config = {}
         self.url = url
-        url = urlparse(url)
+        self.encode = get_json_encoder(config.get("encoder"))
+        self.writer = BatchWriter(
+            commit=self.flush,
+            max_queue_size=int(config.get("max_queue_size", 10000)),
+            commit_max_rows=int(config.get("batch_size", 100)),
+            commit_interval=float(config.get("batch_interval", 0)),
+            name="log_json(%s)" % url,
+        )
+
+    def start(self):
+        self.writer.start()
+
+    def stop(self):
+        self.writer.stop()
+        self.close()
+
+    def submit(self, data):
+        """
+        Queue the data. Called from the event loop.
+
+        :param dict data: The data, it must not be modified after it has been submitted.
+        """
+        self.writer.put(self.write, data)
+
+    def write(self, data):
+        """
+        Write the data. Called in the writer thread.
+        """
+        raise NotImplementedError("do it")
+
+    def flush(self):
+        """
+        Write the buffered data at the end of a batch. Called in the writer thread.
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class FileHandler(BaseHandler):
+    """
+    Write one JSON document per line.
+
+    The file can be rotated by size or time. Rotated files get the timestamp appended to their name and can be
+    compressed with gzip.
+    """
+    handle_schemes = ["file"]
+
+    def __init__(self, url, config=None):
+        if config is None:
+            config = {}
+        BaseHandler.__init__(self, url, config=config)
+        self.filename = urlparse(url).path
+        self.buffer_size = int(config.get("buffer_size", 64 * 1024))
+        self.rotate_size = int(config.get("rotate_size", 0))
+        self.rotate_interval = float(config.get("rotate_interval", 0))
+        self.compress = bool(config.get("compress", False))
+        self.fp = None
+        self._opened = None
         try:
-            self.fp = open(url.path, "a")
+            self._open()
         except OSError as e:
-            raise LoaderError("Unable to open file %s Error message '%s'", url.path, e.strerror)
+            raise LoaderError("Unable to open file %s Error message '%s'", self.filename, e.strerror)
 
-    def submit(self, data):
-        data = json.dumps(data)
-        self.fp.write(data)
-        self.fp.write("\n")
+    def _open(self):
+        self.fp = open(self.filename, "ab", buffering=self.buffer_size)
+        self._opened = time.monotonic()
+
+    def write(self, data):
+        self.fp.write(self.encode(data))
+        self.fp.write(b"\n")
+
+    def flush(self):
         self.fp.flush()
+        if self.rotate_size > 0 and self.fp.tell() >= self.rotate_size:
+            self.rotate()
+        elif self.rotate_interval > 0 and time.monotonic() - self._opened >= self.rotate_interval:
+            self.rotate()
+
+    def rotate(self):
+        self.fp.close()
+        filename = "%s.%s" % (self.filename, datetime.utcnow().strftime("%Y%m%d%H%M%S"))
+        i = 0
+        while os.path.exists(filename) or os.path.exists(filename + ".gz"):
+            i += 1
+            filename = "%s.%s.%d" % (self.filename, datetime.utcnow().strftime("%Y%m%d%H%M%S"), i)
+        try:
+            os.rename(self.filename, filename)
+            if self.compress:
+                with open(filename, "rb") as f_in, gzip.open(filename + ".gz", "wb") as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                os.unlink(filename)
+        except OSError:
+            logger.warning("Unable to rotate file %s", self.filename, exc_info=True)
+        self._open()
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
 
 
-class HTTPHandler(object):
+class HTTPHandler(BaseHandler):
+    """
+    Send the data to a HTTP(S) endpoint using a persistent connection.
+
+    Supported formats:
+
+    * json - One request per document
+    * ndjson - One document per line, one request per batch
+    * elasticsearch - Body for the Elasticsearch bulk API, one request per batch
+
+    If the endpoint is not available the requests are written to the spool directory and sent later.
+    """
     handle_schemes = ["http", "https"]
 
-    def __init__(self, url):
-        self.url = url
+    def __init__(self, url, config=None):
+        if config is None:
+            config = {}
+        BaseHandler.__init__(self, url, config=config)
+        self._url = urlparse(url)
+        self.format = config.get("format", "json")
+        if self.format not in ("json", "ndjson", "elasticsearch"):
+            raise LoaderError("Unknown format %s", self.format)
+        self.timeout = float(config.get("timeout", 10))
+        self.retries = int(config.get("retries", 3))
+        self.backoff = float(config.get("backoff", 1.0))
+        self.backoff_max = float(config.get("backoff_max", 300.0))
+        self.spool_dir = config.get("spool_dir")
+        self.spool_max_size = int(config.get("spool_max_size", 100 * 1024 * 1024))
+
+        self.conn = None
+        self._lines = []
+        # The endpoint is not used before this time
+        self._retry_after = 0.0
+        self._retry_backoff = self.backoff
+        self._spool_counter = 0
+        # Spooled files with their sizes, oldest first
+        self._spool_files = deque()
+        self._spool_size = 0
+        self.dropped = 0
+
+        if self.spool_dir is not None:
+            try:
+                os.makedirs(self.spool_dir, exist_ok=True)
+            except OSError as e:
+                raise LoaderError("Unable to create spool dir %s Error message '%s'", self.spool_dir, e.strerror)
+            self._load_spool()
+
+    def write(self, data):
+        if self.format == "elasticsearch":
+            self._lines.append(b'{"index":{}}')
+        self._lines.append(self.encode(data))
+        if self.format == "json":
+            self._send_body(self._lines.pop())
+
+    def flush(self):
+        if self.format == "json" or len(self._lines) == 0:
+            return
+        self._lines.append(b"")
+        body = b"\n".join(self._lines)
+        self._lines = []
+        self._send_body(body)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _content_type(self):
+        if self.format == "json":
+            return "application/json"
+        return "application/x-ndjson"
+
+    def _connect(self):
+        if self._url.scheme == "https":
+            return http.client.HTTPSConnection(self._url.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self._url.netloc, timeout=self.timeout)
+
+    def _post(self, body):
+        """
+        Send the body using the persistent connection.
 
-    def submit(self, data):
-        from urllib.request import Request, urlopen
-        data = json.dumps(data)
-        data = data.encode("ASCII")
-        req = Request(
-            self.url,
-            data=data,
-            headers={
-                "Content-Type": "application/json"
-            }
+        :return: True on success
+        """
+        path = self._url.path or "/"
+        if self._url.query:
+            path += "?" + self._url.query
+        for _ in range(2):
+            if self.conn is None:
+                self.conn = self._connect()
+            try:
+                self.conn.request("POST", path, body=body, headers={
+                    "Content-Type": self._content_type(),
+                    "Connection": "keep-alive",
+                })
+                response = self.conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                # The server might have closed the idle connection, try once more with a new one
+                self.close()
+                continue
+            if response.will_close:
+                self.close()
+            if 200 <= response.status < 300:
+                return True
+            logger.warning("Unable to submit data to %s: HTTP status %d", self.url, response.status)
+            return False
+        return False
+
+    def _send(self, body):
+        """
+        Send the body, retry with exponential backoff.
+
+        :return: True on success
+        """
+        if time.monotonic() < self._retry_after:
+            return False
+
+        delay = self.backoff
+        for i in range(self.retries + 1):
+            if self._post(body):
+                self._retry_backoff = self.backoff
+                return True
+            if i < self.retries:
+                time.sleep(delay)
+                delay = min(delay * 2, self.backoff_max)
+
+        # Do not block the writer while the endpoint is down
+        logger.warning("Unable to submit data to %s, retry in %.1f seconds", self.url, self._retry_backoff)
+        self._retry_after = time.monotonic() + self._retry_backoff
+        self._retry_backoff = min(self._retry_backoff * 2, self.backoff_max)
+        return False
+
+    def _send_body(self, body):
+        if not self._send_spool():
+            self._spool(body)
+            return
+        if not self._send(body):
+            self._spool(body)
+
+    def _load_spool(self):
+        """
+        Load the files left in the spool dir, afterwards the list of spooled files is only kept in memory.
+        """
+        filenames = sorted(
+            os.path.join(self.spool_dir, f) for f in os.listdir(self.spool_dir) if f.endswith(".spool")
         )
-        # ToDo: parse response
-        response = urlopen(req)
-        # Debug:
-        #from pprint import pprint
-        #pprint(response)
+        for filename in filenames:
+            size = os.path.getsize(filename)
+            self._spool_files.append((filename, size))
+            self._spool_size += size
+
+    def _send_spool(self):
+        """
+        Send the spooled requests first to keep the order.
+
+        :return: True if the spool is empty
+        """
+        if self.spool_dir is None:
+            return True
+        while self._spool_files:
+            filename, size = self._spool_files[0]
+            try:
+                with open(filename, "rb") as fp:
+                    body = fp.read()
+            except FileNotFoundError:
+                logger.warning("Spooled file %s has been removed", filename)
+                body = None
+            if body is not None:
+                if not self._send(body):
+                    return False
+                os.unlink(filename)
+            self._spool_files.popleft()
+            self._spool_size -= size
+        return True
+
+    def _spool(self, body):
+        if self.spool_dir is None:
+            self.dropped += 1
+            return
+
+        if self._spool_size + len(body) > self.spool_max_size:
+            self.dropped += 1
+            logger.warning("Spool dir %s is full, %d request(s) dropped", self.spool_dir, self.dropped)
+            return
+
+        self._spool_counter += 1
+        filename = os.path.join(
+            self.spool_dir,
+            "%.6f-%d.spool" % (time.time(), self._spool_counter)
+        )
+        with open(filename + ".tmp", "wb") as fp:
+            fp.write(body)
+        os.rename(filename + ".tmp", filename)
+        self._spool_files.append((filename, len(body)))
+        self._spool_size += len(body)
 
 
 class LogJsonHandlerLoader(IHandlerLoader):
@@ -72,6 +350,12 @@ class LogJsonHandlerLoader(IHandlerLoader):
 
 
 class LogJsonHandler(ihandler):
+    #: Lists of objects to flatten if flat_data is enabled and the keys of the objects
+    flatten_schema = (
+        (("credentials",), ("password", "username")),
+        (("ftp", "commands"), ("command", "arguments")),
+    )
+
     def __init__(self, path, config=None):
         logger.debug("%s ready!", self.__class__.__name__)
         ihandler.__init__(self, path)
@@ -82,6 +366,9 @@ class LogJsonHandler(ihandler):
         self.attacks = {}
         self.handlers = []
         self.flat_data = config.get("flat_data", False)
+        # Shared connection objects, they are never modified after they have been created
+        self._connection_skeletons = {}
+        encoder = config.get("encoder")
         handlers = config.get("handlers")
         if not isinstance(handlers, list) or len(handlers) == 0:
             logger.warning("No handlers specified")
@@ -89,12 +376,25 @@ class LogJsonHandler(ihandler):
             handlers = []
 
         for handler in handlers:
+            # The handler is an URL or a dict with the URL and the handler config
+            handler_config = {"encoder": encoder}
+            if isinstance(handler, dict):
+                handler_config.update(handler)
+                handler = handler.get("url", "")
             url = urlparse(handler)
             for h in (FileHandler, HTTPHandler,):
                 if url.scheme in h.handle_schemes:
-                    self.handlers.append(h(url=handler))
+                    self.handlers.append(h(url=handler, config=handler_config))
                     break
 
+    def start(self):
+        for handler in self.handlers:
+            handler.start()
+
+    def stop(self):
+        for handler in self.handlers:
+            handler.stop()
+
     def handle_incident(self, icd):
         #        print("unknown")
         pass
@@ -116,40 +416,7 @@ class LogJsonHandler(ihandler):
         data["credentials"].append(credentials)
 
     def _flatten_data(self, data):
-        # Add more if needed
-        for k in [
-            "credentials",
-            "ftp.commands"
-        ]:
-            d = None
-            d2 = data
-            k2 = ""
-            for k2 in k.split("."):
-                d = d2
-                d2 = d.get(k2)
-                if d2 is None:
-                    break
-            if d is None or d2 is None:
-                continue
-            d[k2] = self._flatten_list(d2)
-        return data
-
-    def _flatten_list(self, objs):
-        result = {}
-        keys = set()
-        for obj in objs:
-            keys = keys | set(obj.keys())
-        for key in keys:
-            result[key] = []
-        for obj in objs:
-            for key in keys:
-                v = obj.get(key)
-                # eleasticsearch can not handle arrays that contain arrays
-                # flatten the arrays by joining the subarrays
-                if isinstance(v, (tuple, list)):
-                    v = " ".join(v)
-                result[key].append(v)
-        return result
+        return flatten_lists(data, self.flatten_schema)
 
     def _prepare_value(self, v):
         """
@@ -165,18 +432,24 @@ class LogJsonHandler(ihandler):
     def _serialize_connection(self, icd, connection_type):
         con = icd.con
 
-        data = {
-            "connection": {
+        key = (con.protocol, con.transport, connection_type)
+        connection = self._connection_skeletons.get(key)
+        if connection is None:
+            connection = {
                 "protocol": con.protocol,
                 "transport": con.transport,
                 "type": connection_type
-            },
+            }
+            self._connection_skeletons[key] = connection
+
+        data = {
+            "connection": connection,
             "dst_ip": con.local.host,
             "dst_port": con.local.port,
             "src_hostname": self._prepare_value(con.remote.hostname),
             "src_ip": con.remote.host,
             "src_port": con.remote.port,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": utc_timestamp()
         }
         self.attacks[con] = data
 
@@ -260,16 +533,16 @@ class LogJsonHandler(ihandler):
         self._append_credentials(icd)
 
     def handle_incident_dionaea_modules_python_p0f(self, icd):
-        con = icd.con
-        data = self.attacks.get(con)
+        values = icd.to_dict()
+        data = self.attacks.get(values["con"])
         if data:
             data["p0f"] = {
-                "detail": icd.detail,
-                "dist": icd.dist,
-                "fw": icd.fw,
-                "genre": icd.genre,
-                "link": icd.link,
-                "nat": icd.nat,
-                "tos": icd.tos,
-                "uptime": icd.uptime
+                "detail": values["detail"],
+                "dist": values["dist"],
+                "fw": values["fw"],
+                "genre": values["genre"],
+                "link": values["link"],
+                "nat": values["nat"],
+                "tos": values["tos"],
+                "uptime": values["uptime"]
             }
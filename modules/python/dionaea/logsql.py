@@ -6,6 +6,7 @@
 
 from dionaea import IHandlerLoader
 from dionaea.core import ihandler
+from dionaea.writer import BatchWriter, sqlite_savepoint
 
 import logging
 import json
@@ -29,6 +30,16 @@ class logsqlhandler(ihandler):
         logger.debug("%s ready!" % (self.__class__.__name__))
         self.path = path
         self.filename = config.get("file")
+        self.journal_mode = config.get("journal_mode")
+        # write-behind: the statements are written by the writer thread in one
+        # transaction if max_rows statements are written or interval seconds have passed
+        self.commit_max_rows = int(config.get("commit_max_rows", 1))
+        self.commit_interval = float(config.get("commit_interval", 0))
+        self.max_queue_size = int(config.get("max_queue_size", 10000))
+
+        # statements of the incident currently handled
+        self._statements = []
+        self._writer = None
 
     def start(self):
         ihandler.__init__(self, self.path)
@@ -38,10 +49,18 @@ class logsqlhandler(ihandler):
         self.pending = {}
 
 #       self.dbh = sqlite3.connect(user = g_dionaea.config()['modules']['python']['logsql']['file'])
-        self.dbh = sqlite3.connect(self.filename)
+        # after the setup the database is only used by the writer thread
+        self.dbh = sqlite3.connect(self.filename, check_same_thread=False)
         self.cursor = self.dbh.cursor()
         update = False
 
+        if self.journal_mode is not None:
+            r = self.cursor.execute("PRAGMA journal_mode = %s" % self.journal_mode).fetchone()
+            logger.info("Using sqlite journal mode %s", r[0])
+            if r[0].lower() == "wal":
+                # durable at checkpoints, a crash only loses the last transactions
+                self.cursor.execute("PRAGMA synchronous = NORMAL")
+
         self.cursor.execute("""CREATE TABLE IF NOT EXISTS
             connections (
                 connection INTEGER PRIMARY KEY,
@@ -588,6 +607,28 @@ class logsqlhandler(ihandler):
             #            print(e)
             logger.debug("... not required")
 
+        # connection ids are assigned by us, so connection_insert() does not
+        # have to wait for the row to be written to know its id
+        r = self.cursor.execute("SELECT MAX(connection) FROM connections").fetchone()
+        self._connection_id = r[0] if r[0] is not None else 0
+
+        self.dbh.commit()
+
+        self._writer = BatchWriter(
+            commit=self.dbh.commit,
+            savepoint=lambda: sqlite_savepoint(self.dbh),
+            max_queue_size=self.max_queue_size,
+            commit_max_rows=self.commit_max_rows,
+            commit_interval=self.commit_interval,
+            name="log_sqlite",
+        )
+        self._writer.start()
+
+    def stop(self):
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+
     def __del__(self):
         logger.info("Closing sqlite handle")
         self.cursor.close()
@@ -595,6 +636,31 @@ class logsqlhandler(ihandler):
         self.dbh.close()
         self.dbh = None
 
+    def _execute(self, sql, params=()):
+        """
+        Add a statement to the statements of the current incident.
+
+        :param sql: SQL statement or a callable that is called with the cursor
+        :param params: Parameters for the statement
+        """
+        self._statements.append((sql, params))
+
+    def _commit(self):
+        """
+        Pass the statements of the current incident to the writer thread.
+        """
+        statements = tuple(self._statements)
+        self._statements = []
+        self._writer.put(self._write_statements, statements)
+
+    def _write_statements(self, statements):
+        # Called in the writer thread, if a statement fails the writer rolls back all statements of the incident
+        for sql, params in statements:
+            if callable(sql):
+                sql(self.cursor)
+            else:
+                self.cursor.execute(sql, params)
+
     def _handle_credentials(self, icd):
         """
         Insert credentials into the logins table.
@@ -604,11 +670,11 @@ class logsqlhandler(ihandler):
         con = icd.con
         if con in self.attacks:
             attack_id = self.attacks[con][1]
-            self.cursor.execute(
+            self._execute(
                 "INSERT INTO logins (connection, login_username, login_password) VALUES (?,?,?)",
                 (attack_id, icd.username, icd.password)
             )
-            self.dbh.commit()
+            self._commit()
 
     def handle_incident(self, icd):
         #        print("unknown")
@@ -616,11 +682,12 @@ class logsqlhandler(ihandler):
 
     def connection_insert(self, icd, connection_type):
         con=icd.con
-        r = self.cursor.execute("INSERT INTO connections (connection_timestamp, connection_type, connection_transport, connection_protocol, local_host, local_port, remote_host, remote_hostname, remote_port) VALUES (?,?,?,?,?,?,?,?,?)",
-                                (time.time(), connection_type, con.transport, con.protocol, con.local.host, con.local.port, con.remote.host, con.remote.hostname, con.remote.port) )
-        attackid = self.cursor.lastrowid
+        self._connection_id += 1
+        attackid = self._connection_id
+        self._execute("INSERT INTO connections (connection, connection_root, connection_timestamp, connection_type, connection_transport, connection_protocol, local_host, local_port, remote_host, remote_hostname, remote_port) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                                (attackid, attackid, time.time(), connection_type, con.transport, con.protocol, con.local.host, con.local.port, con.remote.host, con.remote.hostname, con.remote.port) )
         self.attacks[con] = (attackid, attackid)
-        self.dbh.commit()
+        self._commit()
 
         # maybe this was a early connection?
         if con in self.pending:
@@ -630,11 +697,11 @@ class logsqlhandler(ihandler):
             # - update the connection_root for all connections which had the 'childid' as connection_root
             for i in self.pending[con]:
                 print("%s %s %s" % (attackid, attackid, i))
-                self.cursor.execute("UPDATE connections SET connection_root = ?, connection_parent = ? WHERE connection = ?",
+                self._execute("UPDATE connections SET connection_root = ?, connection_parent = ? WHERE connection = ?",
                                     (attackid, attackid, i ) )
-                self.cursor.execute("UPDATE connections SET connection_root = ? WHERE connection_root = ?",
+                self._execute("UPDATE connections SET connection_root = ? WHERE connection_root = ?",
                                     (attackid, i ) )
-            self.dbh.commit()
+            self._commit()
 
         return attackid
 
@@ -718,9 +785,9 @@ class logsqlhandler(ihandler):
             logger.info("child has ids %s" % str(self.attacks[icd.child]))
             logger.info("child %i parent %i root %i" %
                         (childid, parentid, parentroot) )
-            r = self.cursor.execute("UPDATE connections SET connection_root = ?, connection_parent = ? WHERE connection = ?",
+            r = self._execute("UPDATE connections SET connection_root = ?, connection_parent = ? WHERE connection = ?",
                                     (parentroot, parentid, childid) )
-            self.dbh.commit()
+            self._commit()
 
         if icd.child in self.pending:
             # if the new accepted connection was pending
@@ -732,9 +799,9 @@ class logsqlhandler(ihandler):
             else:
                 childid = parentid
 
-            self.cursor.execute("UPDATE connections SET connection_root = ? WHERE connection_root = ?",
+            self._execute("UPDATE connections SET connection_root = ? WHERE connection_root = ?",
                                 (parentroot, childid) )
-            self.dbh.commit()
+            self._commit()
 
     def handle_incident_dionaea_connection_free(self, icd):
         con=icd.con
@@ -755,9 +822,9 @@ class logsqlhandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("emu profile for attackid %i" % attackid)
-        self.cursor.execute("INSERT INTO emu_profiles (connection, emu_profile_json) VALUES (?,?)",
+        self._execute("INSERT INTO emu_profiles (connection, emu_profile_json) VALUES (?,?)",
                             (attackid, icd.profile) )
-        self.dbh.commit()
+        self._commit()
 
 
     def handle_incident_dionaea_download_offer(self, icd):
@@ -766,9 +833,9 @@ class logsqlhandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("offer for attackid %i" % attackid)
-        self.cursor.execute("INSERT INTO offers (connection, offer_url) VALUES (?,?)",
+        self._execute("INSERT INTO offers (connection, offer_url) VALUES (?,?)",
                             (attackid, icd.url) )
-        self.dbh.commit()
+        self._commit()
 
     def handle_incident_dionaea_download_complete_hash(self, icd):
         con=icd.con
@@ -776,9 +843,9 @@ class logsqlhandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("complete for attackid %i" % attackid)
-        self.cursor.execute("INSERT INTO downloads (connection, download_url, download_md5_hash) VALUES (?,?,?)",
+        self._execute("INSERT INTO downloads (connection, download_url, download_md5_hash) VALUES (?,?,?)",
                             (attackid, icd.url, icd.md5hash) )
-        self.dbh.commit()
+        self._commit()
 
 
     def handle_incident_dionaea_service_shell_listen(self, icd):
@@ -787,9 +854,9 @@ class logsqlhandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("listen shell for attackid %i" % attackid)
-        self.cursor.execute("INSERT INTO emu_services (connection, emu_service_url) VALUES (?,?)",
+        self._execute("INSERT INTO emu_services (connection, emu_service_url) VALUES (?,?)",
                             (attackid, "bindshell://"+str(icd.port)) )
-        self.dbh.commit()
+        self._commit()
 
     def handle_incident_dionaea_service_shell_connect(self, icd):
         con=icd.con
@@ -797,17 +864,17 @@ class logsqlhandler(ihandler):
             return
         attackid = self.attacks[con][1]
         logger.info("connect shell for attackid %i" % attackid)
-        self.cursor.execute("INSERT INTO emu_services (connection, emu_service_url) VALUES (?,?)",
+        self._execute("INSERT INTO emu_services (connection, emu_service_url) VALUES (?,?)",
                             (attackid, "connectbackshell://"+str(icd.host)+":"+str(icd.port)) )
-        self.dbh.commit()
+        self._commit()
 
     def handle_incident_dionaea_modules_python_p0f(self, icd):
         con=icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.cursor.execute("INSERT INTO p0fs (connection, p0f_genre, p0f_link, p0f_detail, p0f_uptime, p0f_tos, p0f_dist, p0f_nat, p0f_fw) VALUES (?,?,?,?,?,?,?,?,?)",
+            self._execute("INSERT INTO p0fs (connection, p0f_genre, p0f_link, p0f_detail, p0f_uptime, p0f_tos, p0f_dist, p0f_nat, p0f_fw) VALUES (?,?,?,?,?,?,?,?,?)",
                                 ( attackid, icd.genre, icd.link, icd.detail, icd.uptime, icd.tos, icd.dist, icd.nat, icd.fw))
-            self.dbh.commit()
+            self._commit()
 
     def handle_incident_dionaea_modules_python_ftp_login(self, icd):
         self._handle_credentials(icd)
@@ -816,35 +883,35 @@ class logsqlhandler(ihandler):
         con=icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.cursor.execute("INSERT INTO dcerpcrequests (connection, dcerpcrequest_uuid, dcerpcrequest_opnum) VALUES (?,?,?)",
+            self._execute("INSERT INTO dcerpcrequests (connection, dcerpcrequest_uuid, dcerpcrequest_opnum) VALUES (?,?,?)",
                                 (attackid, icd.uuid, icd.opnum))
-            self.dbh.commit()
+            self._commit()
 
     def handle_incident_dionaea_modules_python_smb_dcerpc_bind(self, icd):
         con=icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.cursor.execute("INSERT INTO dcerpcbinds (connection, dcerpcbind_uuid, dcerpcbind_transfersyntax) VALUES (?,?,?)",
+            self._execute("INSERT INTO dcerpcbinds (connection, dcerpcbind_uuid, dcerpcbind_transfersyntax) VALUES (?,?,?)",
                                 (attackid, icd.uuid, icd.transfersyntax))
-            self.dbh.commit()
+            self._commit()
 
     def handle_incident_dionaea_modules_python_mssql_login(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.cursor.execute("INSERT INTO logins (connection, login_username, login_password) VALUES (?,?,?)",
+            self._execute("INSERT INTO logins (connection, login_username, login_password) VALUES (?,?,?)",
                                 (attackid, icd.username, icd.password))
-            self.cursor.execute("INSERT INTO mssql_fingerprints (connection, mssql_fingerprint_hostname, mssql_fingerprint_appname, mssql_fingerprint_cltintname) VALUES (?,?,?,?)",
+            self._execute("INSERT INTO mssql_fingerprints (connection, mssql_fingerprint_hostname, mssql_fingerprint_appname, mssql_fingerprint_cltintname) VALUES (?,?,?,?)",
                                 (attackid, icd.hostname, icd.appname, icd.cltintname))
-            self.dbh.commit()
+            self._commit()
 
     def handle_incident_dionaea_modules_python_mssql_cmd(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.cursor.execute("INSERT INTO mssql_commands (connection, mssql_command_status, mssql_command_cmd) VALUES (?,?,?)",
+            self._execute("INSERT INTO mssql_commands (connection, mssql_command_status, mssql_command_cmd) VALUES (?,?,?)",
                                 (attackid, icd.status, icd.cmd))
-            self.dbh.commit()
+            self._commit()
 
     def handle_incident_dionaea_modules_python_virustotal_report(self, icd):
         md5 = icd.md5hash
@@ -854,48 +921,56 @@ class logsqlhandler(ihandler):
         if j['response_code'] == 1: # file was known to virustotal
             permalink = j['permalink']
             date = j['scan_date']
-            self.cursor.execute("INSERT INTO virustotals (virustotal_md5_hash, virustotal_permalink, virustotal_timestamp) VALUES (?,?,strftime('%s',?))",
-                                (md5, permalink, date))
-            self.dbh.commit()
+            scans = j['scans']
 
-            virustotal = self.cursor.lastrowid
+            def insert_report(cursor):
+                cursor.execute("INSERT INTO virustotals (virustotal_md5_hash, virustotal_permalink, virustotal_timestamp) VALUES (?,?,strftime('%s',?))",
+                                    (md5, permalink, date))
+                virustotal = cursor.lastrowid
 
-            scans = j['scans']
-            for av, val in scans.items():
-                res = val['result']
-                # not detected = '' -> NULL
-                if res == '':
-                    res = None
+                for av, val in scans.items():
+                    res = val['result']
+                    # not detected = '' -> NULL
+                    if res == '':
+                        res = None
 
-                self.cursor.execute("""INSERT INTO virustotalscans (virustotal, virustotalscan_scanner, virustotalscan_result) VALUES (?,?,?)""",
-                                    (virustotal, av, res))
-#                logger.debug("scanner {} result {}".format(av,scans[av]))
-            self.dbh.commit()
+                    cursor.execute("""INSERT INTO virustotalscans (virustotal, virustotalscan_scanner, virustotalscan_result) VALUES (?,?,?)""",
+                                        (virustotal, av, res))
+#                    logger.debug("scanner {} result {}".format(av,scans[av]))
+
+            self._execute(insert_report)
+            self._commit()
 
     def handle_incident_dionaea_modules_python_mysql_login(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.cursor.execute("INSERT INTO logins (connection, login_username, login_password) VALUES (?,?,?)",
+            self._execute("INSERT INTO logins (connection, login_username, login_password) VALUES (?,?,?)",
                                 (attackid, icd.username, icd.password))
-            self.dbh.commit()
+            self._commit()
 
 
     def handle_incident_dionaea_modules_python_mysql_command(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.cursor.execute("INSERT INTO mysql_commands (connection, mysql_command_cmd) VALUES (?,?)",
-                                (attackid, icd.command))
-            cmdid = self.cursor.lastrowid
-
+            command = icd.command
+            args = []
             if hasattr(icd, 'args'):
                 args = icd.args
+
+            def insert_command(cursor):
+                cursor.execute("INSERT INTO mysql_commands (connection, mysql_command_cmd) VALUES (?,?)",
+                                    (attackid, command))
+                cmdid = cursor.lastrowid
+
                 for i in range(len(args)):
                     arg = args[i]
-                    self.cursor.execute("INSERT INTO mysql_command_args (mysql_command, mysql_command_arg_index, mysql_command_arg_data) VALUES (?,?,?)",
+                    cursor.execute("INSERT INTO mysql_command_args (mysql_command, mysql_command_arg_index, mysql_command_arg_data) VALUES (?,?,?)",
                                         (cmdid, i, arg))
-            self.dbh.commit()
+
+            self._execute(insert_command)
+            self._commit()
 
     def handle_incident_dionaea_modules_python_sip_command(self, icd):
         con = icd.con
@@ -928,14 +1003,24 @@ class logsqlhandler(ihandler):
             return allow
 
         attackid = self.attacks[con][1]
-        self.cursor.execute("""INSERT INTO sip_commands
-            (connection, sip_command_method, sip_command_call_id,
-            sip_command_user_agent, sip_command_allow) VALUES (?,?,?,?,?)""",
-                            (attackid, icd.method, icd.call_id, icd.user_agent, calc_allow(icd.allow)))
-        cmdid = self.cursor.lastrowid
-
-        def add_addr(cmd, _type, addr):
-            self.cursor.execute("""INSERT INTO sip_addrs
+        method = icd.method
+        call_id = icd.call_id
+        user_agent = icd.user_agent
+        allow = calc_allow(icd.allow)
+        addrs = [
+            ('addr', icd.get('addr')),
+            ('to', icd.get('to')),
+            ('contact', icd.get('contact')),
+        ]
+        for i in icd.get('from'):
+            addrs.append(('from', i))
+        vias = icd.get('via')
+        sdp = None
+        if hasattr(icd,'sdp'):
+            sdp = icd.sdp
+
+        def add_addr(cursor, cmd, _type, addr):
+            cursor.execute("""INSERT INTO sip_addrs
                 (sip_command, sip_addr_type, sip_addr_display_name,
                 sip_addr_uri_scheme, sip_addr_uri_user, sip_addr_uri_password,
                 sip_addr_uri_host, sip_addr_uri_port) VALUES (?,?,?,?,?,?,?,?)""",
@@ -945,14 +1030,9 @@ class logsqlhandler(ihandler):
                                         'user'], addr['uri']['password'],
                                     addr['uri']['host'], addr['uri']['port']
                                 ))
-        add_addr(cmdid,'addr',icd.get('addr'))
-        add_addr(cmdid,'to',icd.get('to'))
-        add_addr(cmdid,'contact',icd.get('contact'))
-        for i in icd.get('from'):
-            add_addr(cmdid,'from',i)
 
-        def add_via(cmd, via):
-            self.cursor.execute("""INSERT INTO sip_vias
+        def add_via(cursor, cmd, via):
+            cursor.execute("""INSERT INTO sip_vias
                 (sip_command, sip_via_protocol, sip_via_address, sip_via_port)
                 VALUES (?,?,?,?)""",
                                 (
@@ -961,12 +1041,9 @@ class logsqlhandler(ihandler):
 
                                 ))
 
-        for i in icd.get('via'):
-            add_via(cmdid, i)
-
-        def add_sdp(cmd, sdp):
+        def add_sdp(cursor, cmd, sdp):
             def add_origin(cmd, o):
-                self.cursor.execute("""INSERT INTO sip_sdp_origins
+                cursor.execute("""INSERT INTO sip_sdp_origins
                     (sip_command, sip_sdp_origin_username,
                     sip_sdp_origin_sess_id, sip_sdp_origin_sess_version,
                     sip_sdp_origin_nettype, sip_sdp_origin_addrtype,
@@ -979,7 +1056,7 @@ class logsqlhandler(ihandler):
                                         o['unicast_address']
                                     ))
             def add_condata(cmd, c):
-                self.cursor.execute("""INSERT INTO sip_sdp_connectiondatas
+                cursor.execute("""INSERT INTO sip_sdp_connectiondatas
                     (sip_command, sip_sdp_connectiondata_nettype,
                     sip_sdp_connectiondata_addrtype, sip_sdp_connectiondata_connection_address,
                     sip_sdp_connectiondata_ttl, sip_sdp_connectiondata_number_of_addresses)
@@ -990,7 +1067,7 @@ class logsqlhandler(ihandler):
                                         c['ttl'], c['number_of_addresses']
                                     ))
             def add_media(cmd, c):
-                self.cursor.execute("""INSERT INTO sip_sdp_medias
+                cursor.execute("""INSERT INTO sip_sdp_medias
                     (sip_command, sip_sdp_media_media,
                     sip_sdp_media_port, sip_sdp_media_number_of_ports,
                     sip_sdp_media_proto)
@@ -1008,33 +1085,50 @@ class logsqlhandler(ihandler):
                 for i in sdp['m']:
                     add_media(cmd, i)
 
-        if hasattr(icd,'sdp') and icd.sdp is not None:
-            add_sdp(cmdid,icd.sdp)
+        # the child rows need the id of the sip_commands row,
+        # so the inserts run together in the writer thread
+        def insert_command(cursor):
+            cursor.execute("""INSERT INTO sip_commands
+                (connection, sip_command_method, sip_command_call_id,
+                sip_command_user_agent, sip_command_allow) VALUES (?,?,?,?,?)""",
+                                (attackid, method, call_id, user_agent, allow))
+            cmdid = cursor.lastrowid
 
-        self.dbh.commit()
+            for _type, addr in addrs:
+                add_addr(cursor, cmdid, _type, addr)
+
+            for i in vias:
+                add_via(cursor, cmdid, i)
+
+            if sdp is not None:
+                add_sdp(cursor, cmdid, sdp)
+
+        self._execute(insert_command)
+
+        self._commit()
 
     def handle_incident_dionaea_modules_python_mqtt_connect(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            #self.cursor.execute("INSERT INTO logins (connection, login_username, login_password) VALUES (?,?,?)",
+            #self._execute("INSERT INTO logins (connection, login_username, login_password) VALUES (?,?,?)",
             #    (attackid, icd.username, icd.password))
-            self.cursor.execute("INSERT INTO mqtt_fingerprints (connection, mqtt_fingerprint_clientid, mqtt_fingerprint_willtopic, mqtt_fingerprint_willmessage,mqtt_fingerprint_username,mqtt_fingerprint_password) VALUES (?,?,?,?,?,?)",
+            self._execute("INSERT INTO mqtt_fingerprints (connection, mqtt_fingerprint_clientid, mqtt_fingerprint_willtopic, mqtt_fingerprint_willmessage,mqtt_fingerprint_username,mqtt_fingerprint_password) VALUES (?,?,?,?,?,?)",
                 (attackid, icd.clientid, icd.willtopic, icd.willmessage, icd.username, icd.password))
-            self.dbh.commit()
+            self._commit()
 
     def handle_incident_dionaea_modules_python_mqtt_publish(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.cursor.execute("INSERT INTO mqtt_publish_commands (connection, mqtt_publish_command_topic, mqtt_publish_command_message) VALUES (?,?,?)",
+            self._execute("INSERT INTO mqtt_publish_commands (connection, mqtt_publish_command_topic, mqtt_publish_command_message) VALUES (?,?,?)",
                 (attackid, icd.publishtopic, icd.publishmessage))
-            self.dbh.commit()
+            self._commit()
 
     def handle_incident_dionaea_modules_python_mqtt_subscribe(self, icd):
         con = icd.con
         if con in self.attacks:
             attackid = self.attacks[con][1]
-            self.cursor.execute("INSERT INTO mqtt_subscribe_commands (connection, mqtt_subscribe_command_messageid, mqtt_subscribe_command_topic) VALUES (?,?,?)",
+            self._execute("INSERT INTO mqtt_subscribe_commands (connection, mqtt_subscribe_command_messageid, mqtt_subscribe_command_topic) VALUES (?,?,?)",
                 (attackid, icd.subscribemessageid, icd.subscribetopic))
-            self.dbh.commit()
+            self._commit()
@@ -28,6 +28,7 @@ class mongod(connection):
     shared_config_values = [
         "config",
     ]
+    io_in_framing = "mongodb"
 
     def __init__(self):
         connection.__init__(self, "tcp")
@@ -59,6 +59,76 @@ MQTT_Connect_Flags = {
 #MQTT Version 3.1.1 OASIS Standard (29 October 2014)
 # http://docs.oasis-open.org/mqtt/mqtt/v3.1.1/os/mqtt-v3.1.1-os.pdf
 
+# mqtt-v3.1.1-os.pdf - page 19
+# The Remaining Length is encoded in up to 4 bytes, 7 bits per byte, the highest bit is set if more bytes follow
+MQTT_REMAINING_LENGTH_MAX = 268435455
+
+
+def decode_remaining_length(data, offset=0):
+	"""
+	Decode the Remaining Length at the given offset.
+
+	:return: Tuple of the value and the number of bytes used or None if the data is incomplete
+	:raises ValueError: If the value is encoded in more than 4 bytes
+	"""
+	value = 0
+	for i in range(4):
+		if offset + i >= len(data):
+			return None
+		b = data[offset + i]
+		value |= (b & 0x7f) << (7 * i)
+		if b & 0x80 == 0:
+			return value, i + 1
+	raise ValueError("Malformed Remaining Length")
+
+
+def encode_remaining_length(value):
+	buf = bytearray()
+	while True:
+		b = value & 0x7f
+		value >>= 7
+		if value > 0:
+			buf.append(b | 0x80)
+		else:
+			buf.append(b)
+			return bytes(buf)
+
+
+def packet_size(data, offset=0):
+	"""
+	Get the size of the control packet starting at the given offset.
+
+	:return: Size of the fixed header and the remaining data or None if the fixed header is incomplete
+	:raises ValueError: If the Remaining Length is malformed
+	"""
+	r = decode_remaining_length(data, offset + 1)
+	if r is None:
+		return None
+	return 1 + r[1] + r[0]
+
+
+class MQTTRemainingLengthField(Field):
+	def __init__(self, name, default):
+		Field.__init__(self, name, default, "B")
+
+	def size(self, pkt, x):
+		return len(encode_remaining_length(self.i2m(pkt, x)))
+
+	def i2len(self, pkt, x):
+		return self.size(pkt, x)
+
+	def addfield(self, pkt, s, val):
+		return s + encode_remaining_length(self.i2m(pkt, val))
+
+	def getfield(self, pkt, s):
+		r = decode_remaining_length(s)
+		if r is None:
+			# Truncated, use the bytes available like a ByteField would
+			return s[1:], (s[0] & 0x7f if len(s) > 0 else 0)
+		value, used = r
+		return s[used:], value
+
+
 class MQTT_ControlMessage_Type(Packet):
 	name="MQTT Control Message"
 	fields_desc =[
@@ -70,9 +140,9 @@ class MQTT_Connect(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_CONNECT
 	fields_desc =[
 		ByteField("HeaderFlags",0x00),
-		ByteField("MessageLength",0x00),
+		MQTTRemainingLengthField("MessageLength",0x00),
 		FieldLenField("ProtocolNameLength",None, fmt='H', length_of="ProtocolName"),
-		StrFixedLenField("ProtocolName", "", 6),
+		StrLenField("ProtocolName", b"", length_from=lambda x:x.ProtocolNameLength),
 		ByteField("Version",0x00),
 		FlagsField("ConnectFlags", 0x00, -8, MQTT_Connect_Flags),
 		XShortField("KeepAlive",0),
@@ -94,7 +164,7 @@ class MQTT_ConnectACK(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_CONNECTACK
 	fields_desc =[
 		ByteField("HeaderFlags",0x20),
-		ByteField("MessageLength",0x02),
+		MQTTRemainingLengthField("MessageLength",0x02),
 		XShortField("ConnectionACK",0x00)
 	]
 
@@ -103,7 +173,7 @@ class MQTT_Publish(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_PUBLISH
 	fields_desc =[
 		ByteField("HeaderFlags",0x00),
-		ByteField("MessageLength",0x00),
+		MQTTRemainingLengthField("MessageLength",0x00),
 		FieldLenField("TopicLength",None, fmt='H', length_of="Topic"),
 		StrLenField("Topic",b"",length_from=lambda x:x.TopicLength),
 		ConditionalField(XShortField("PacketIdentifier",0), lambda x: x.HeaderFlags & (MQTT_CONTROLMESSAGE_TYPE_QoS1 | MQTT_CONTROLMESSAGE_TYPE_QoS2)),
@@ -115,7 +185,7 @@ class MQTT_PublishACK(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_CONNECTACK
 	fields_desc =[
 		ByteField("HeaderFlags",0x40),
-		ByteField("MessageLength",0x02),
+		MQTTRemainingLengthField("MessageLength",0x02),
 		XShortField("ConnectionACK",0x00),
 	]
 
@@ -124,7 +194,7 @@ class MQTT_PublishACK_Identifier(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_CONNECTACK
 	fields_desc =[
 		ByteField("HeaderFlags",0x40),
-		ByteField("MessageLength",0x02),
+		MQTTRemainingLengthField("MessageLength",0x02),
 		XShortField("PacketIdentifier",0x00),
 	]
 
@@ -133,7 +203,7 @@ class MQTT_Publish_Release(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_PUBLISHREL
 	fields_desc =[
 		ByteField("HeaderFlags",0x00),
-		ByteField("MessageLength",0x00),
+		MQTTRemainingLengthField("MessageLength",0x00),
 		XShortField("PacketIdentifier",0x00),
 	]
 
@@ -142,7 +212,7 @@ class MQTT_Subscribe(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_SUBSCRIBE
 	fields_desc =[
 		ByteField("HeaderFlags",0x00),
-		ByteField("MessageLength",0x00),
+		MQTTRemainingLengthField("MessageLength",0x00),
 		ConditionalField(XShortField("PacketIdentifier",0), lambda x: x.HeaderFlags & (MQTT_CONTROLMESSAGE_TYPE_QoS1 | MQTT_CONTROLMESSAGE_TYPE_QoS2)),
 		FieldLenField("TopicLength",None, fmt='H', length_of="Topic"),
 		StrLenField("Topic",b"",length_from=lambda x:x.TopicLength),
@@ -154,7 +224,7 @@ class MQTT_SubscribeACK(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_SUBSCRIBEACK
 	fields_desc =[
 		ByteField("HeaderFlags",0x90),
-		ByteField("MessageLength",0x02),
+		MQTTRemainingLengthField("MessageLength",0x02),
 		ByteField("GrantedQoS",0x00),
 	]
 
@@ -163,7 +233,7 @@ class MQTT_SubscribeACK_Identifier(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_SUBSCRIBEACK
 	fields_desc =[
 		ByteField("HeaderFlags",0x90),
-		ByteField("MessageLength",0x02),
+		MQTTRemainingLengthField("MessageLength",0x03),
 		XShortField("PacketIdentifier",0x00),
 		ByteField("GrantedQoS",0x00),
 	]
@@ -173,7 +243,7 @@ class MQTT_PingRequest(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_PINGREQ
 	fields_desc =[
 		ByteField("HeaderFlags",0x00),
-		ByteField("MessageLength",0x00),
+		MQTTRemainingLengthField("MessageLength",0x00),
 	]
 
 class MQTT_PingResponse(Packet):
@@ -181,7 +251,7 @@ class MQTT_PingResponse(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_PINGRES
 	fields_desc =[
 		ByteField("HeaderFlags",0xd0),
-		ByteField("MessageLength",0x00),
+		MQTTRemainingLengthField("MessageLength",0x00),
 	]
 
 class MQTT_DisconnectReq(Packet):
@@ -189,5 +259,5 @@ class MQTT_DisconnectReq(Packet):
 	controlmessage_type = MQTT_CONTROLMESSAGE_TYPE_DISCONNECT
 	fields_desc =[
 		ByteField("HeaderFlags",0x00),
-		ByteField("MessageLength",0x00),
+		MQTTRemainingLengthField("MessageLength",0x00),
 	]
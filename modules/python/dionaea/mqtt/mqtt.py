@@ -14,124 +14,159 @@ import os
 import tempfile
 
 from dionaea.mqtt.include.packets import *
+from dionaea.trace import PacketTrace
 
 logger = logging.getLogger('mqtt')
 
 class mqttd(connection):
+	shared_config_values = [
+		"max_packet_size",
+		"packet_trace"
+	]
+	packet_trace = PacketTrace("mqttd")
+	#: Close the connection if a client announces a bigger packet
+	max_packet_size = 1024 * 1024
+
 	def __init__ (self):
 		connection.__init__(self,"tcp")
-		self.buf = b''
+
+	def apply_config(self, config):
+		if config is None:
+			config = {}
+		self.packet_trace = PacketTrace.from_config("mqttd", config)
+		self.max_packet_size = config.get("max_packet_size", self.max_packet_size)
 
 	def handle_established(self):
 		self.timeouts.idle = 120
 		self.processors()
 
 	def handle_io_in(self, data):
-		l=0
-		size = 0
-		chunk = b''
-
-		if len(data) > l:
-			p = None
-			x = None
+		# Clients may send several control packets at once, e.g. CONNECT, SUBSCRIBE and PUBLISH.
+		# Handle all complete packets and keep the rest until more data has been received.
+		offset = 0
+		responses = []
+		while offset < len(data):
 			try:
+				size = packet_size(data, offset)
+			except ValueError:
+				logger.warn("Bad MQTT Packet, malformed Remaining Length")
+				self.close()
+				return len(data)
+
+			if size is None or len(data) - offset < size:
+				if size is not None and size > self.max_packet_size:
+					logger.warn("MQTT Packet too big, Length = {}".format(size))
+					self.close()
+					return len(data)
+				break
+
+			packet = data[offset:offset + size]
+			offset += size
 
-				if len(data) > 0:
-					p = MQTT_ControlMessage_Type(data);
-					p.show()
-
-					self.pendingPacketType = p.ControlPacketType
-					logger.debug("MQTT Control Packet Type {}".format(self.pendingPacketType))
-
-				if len(data) == 0:
-					logger.warn("Bad MQTT Packet, Length = 0")
-
+			try:
+				r = self.handle_packet(packet)
 			except:
 				t = traceback.format_exc()
 				logger.error(t)
-				return l
-
-			if self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_CONNECT:
-				x = MQTT_Connect(data)
-
-				i = incident("dionaea.modules.python.mqtt.connect")
-				i.con = self
-				i.clientid = x.ClientID
-				i.willtopic = x.WillTopic
-				i.willmessage = x.WillMessage
-				i.username = x.Username
-				i.password = x.Password
-				i.report()
-
-			elif (  ((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_PUBLISH) == 48) &
-				((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_QoS1) > 0) ) :
-				x = MQTT_Publish(data)
-
-				i = incident("dionaea.modules.python.mqtt.publish")
-				i.con = self
-				i.publishtopic = x.Topic
-				i.publishmessage = x.Message
-				i.report()
-
-			elif (  ((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_PUBLISH) == 48) &
-				((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_QoS2) > 0) ) :
-				x = MQTT_Publish(data)
-
-				i = incident("dionaea.modules.python.mqtt.publish")
-				i.con = self
-				i.publishtopic = x.Topic
-				i.publishmessage = x.Message
-				i.report()
-
-			elif (  ((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_PUBLISHREL) == 96) &
-				((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_QoS1) > 0) ) :
-				x = MQTT_Publish_Release(data)
-
-			elif self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_PUBLISH:
-				x = MQTT_Publish(data)
-
-				i = incident("dionaea.modules.python.mqtt.publish")
-				i.con = self
-				i.publishtopic = x.Topic
-				i.publishmessage = x.Message
-				i.report()
-
-			elif (  ((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_SUBSCRIBE) == 128) &
-				((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_QoS1) > 0) ) :
-				x = MQTT_Subscribe(data)
-
-				i = incident("dionaea.modules.python.mqtt.subscribe")
-				i.con = self
-				i.subscribemessageid = x.PacketIdentifier
-				i.subscribetopic = x.Topic
-				i.report()
-
-			elif self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_SUBSCRIBE:
-				x = MQTT_Subscribe(data)
-
-				i = incident("dionaea.modules.python.mqtt.subscribe")
-				i.con = self
-				i.subscribemessageid = x.PacketIdentifier
-				i.subscribetopic = x.Topic
-				i.report()
-
-			elif self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_PINGREQ:
-				x = MQTT_PingRequest(data)
-
-			elif self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_DISCONNECT:
-				x = MQTT_DisconnectReq(data)
-
-			self.buf = b''
-			x.show()
-
-			r = None
-			r = self.process( self.pendingPacketType, x)
+				continue
 
 			if r:
-				r.show()
-				self.send(r.build())
+				self.packet_trace.trace("out", r)
+				responses.append(r.build())
+
+		if responses:
+			buf = b"".join(responses)
+			self.packet_trace.dump("out", buf)
+			self.send(buf)
+
+		return offset
+
+	def handle_packet(self, data):
+		"""
+		Handle a single control packet.
+
+		:return: The response or None
+		"""
+		x = None
+		self.pendingPacketType = data[0]
+		logger.debug("MQTT Control Packet Type {}".format(self.pendingPacketType))
+
+		if self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_CONNECT:
+			x = MQTT_Connect(data)
+
+			i = incident("dionaea.modules.python.mqtt.connect")
+			i.con = self
+			i.clientid = x.ClientID
+			i.willtopic = x.WillTopic
+			i.willmessage = x.WillMessage
+			i.username = x.Username
+			i.password = x.Password
+			i.report()
+
+		elif (  ((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_PUBLISH) == 48) &
+			((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_QoS1) > 0) ) :
+			x = MQTT_Publish(data)
+
+			i = incident("dionaea.modules.python.mqtt.publish")
+			i.con = self
+			i.publishtopic = x.Topic
+			i.publishmessage = x.Message
+			i.report()
+
+		elif (  ((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_PUBLISH) == 48) &
+			((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_QoS2) > 0) ) :
+			x = MQTT_Publish(data)
+
+			i = incident("dionaea.modules.python.mqtt.publish")
+			i.con = self
+			i.publishtopic = x.Topic
+			i.publishmessage = x.Message
+			i.report()
+
+		elif (  ((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_PUBLISHREL) == 96) &
+			((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_QoS1) > 0) ) :
+			x = MQTT_Publish_Release(data)
+
+		elif self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_PUBLISH:
+			x = MQTT_Publish(data)
+
+			i = incident("dionaea.modules.python.mqtt.publish")
+			i.con = self
+			i.publishtopic = x.Topic
+			i.publishmessage = x.Message
+			i.report()
+
+		elif (  ((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_SUBSCRIBE) == 128) &
+			((self.pendingPacketType & MQTT_CONTROLMESSAGE_TYPE_QoS1) > 0) ) :
+			x = MQTT_Subscribe(data)
+
+			i = incident("dionaea.modules.python.mqtt.subscribe")
+			i.con = self
+			i.subscribemessageid = x.PacketIdentifier
+			i.subscribetopic = x.Topic
+			i.report()
+
+		elif self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_SUBSCRIBE:
+			x = MQTT_Subscribe(data)
+
+			i = incident("dionaea.modules.python.mqtt.subscribe")
+			i.con = self
+			i.subscribemessageid = x.PacketIdentifier
+			i.subscribetopic = x.Topic
+			i.report()
+
+		elif self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_PINGREQ:
+			x = MQTT_PingRequest(data)
+
+		elif self.pendingPacketType == MQTT_CONTROLMESSAGE_TYPE_DISCONNECT:
+			x = MQTT_DisconnectReq(data)
+
+		if x is not None:
+			self.packet_trace.trace("in", x, data)
+		else:
+			self.packet_trace.dump("in", data)
 
-		return len(data)
+		return self.process(self.pendingPacketType, x)
 
 	def process(self, PacketType, p):
 		r =''
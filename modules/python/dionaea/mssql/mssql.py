@@ -5,6 +5,7 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 from dionaea.core import incident, connection
+from dionaea.trace import PacketTrace
 
 import traceback
 import logging
@@ -17,10 +18,19 @@ logger = logging.getLogger('MSSQL')
 
 
 class mssqld(connection):
+    shared_config_values = [
+        "packet_trace"
+    ]
+    packet_trace = PacketTrace("mssqld")
+    io_in_framing = "tds"
+
     def __init__ (self):
         connection.__init__(self,"tcp")
         self.buf = b''
 
+    def apply_config(self, config):
+        self.packet_trace = PacketTrace.from_config("mssqld", config)
+
     def handle_established(self):
         self.timeouts.idle = 120
         self.processors()
@@ -45,7 +55,6 @@ class mssqld(connection):
                     return l
 
                 p = TDS_Header(data[l:l+8])
-                p.show()
 
                 if p.Length == 0:
                     logger.warning("Bad TDS Header, Length = 0")
@@ -56,6 +65,7 @@ class mssqld(connection):
 
                 chunk = data[l:l+p.Length]
                 p = TDS_Header(chunk)
+                self.packet_trace.trace("in", p, chunk)
 
                 l += p.Length
                 self.buf += chunk[8:]
@@ -82,7 +92,7 @@ class mssqld(connection):
                 x = TDS_TDS5_Query_Request(self.buf)
 
             self.buf = b''
-            x.show()
+            self.packet_trace.trace("in", x)
 
             r = None
 
@@ -102,8 +112,9 @@ class mssqld(connection):
                     mssqlheader.Type = r.tds_type
                     rp = mssqlheader/r
                 rp.Length = len(rp)
-                rp.show()
-                self.send(rp.build())
+                buf = rp.build()
+                self.packet_trace.trace("out", rp, buf)
+                self.send(buf)
 
         # logger.warning("return len(data) %d l %s", len(data), l)
         return l
@@ -252,7 +263,7 @@ class mssqld(connection):
                     x = TDS_TDS5_Query_Request(self.buf)
 
                 self.buf = b''
-                x.show()
+                self.packet_trace.trace("in", x)
 
                 self.process( self.pendingPacketType, x, self.buf[9:])
             self.session.close()
@@ -0,0 +1,201 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Databases of the MySQL service.
+
+The sqlite database files are opened once per process and shared by all connections. Attackers must not be able to
+change them, so they are opened read-only and only statements reading data are authorized. Results of queries can be
+kept in a small cache per database.
+
+Databases with the path ':memory:' are scratch databases, every connection gets its own empty database and the
+attackers are allowed to change it, e.g. to create the tables used to drop a UDF library.
+"""
+
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+logger = logging.getLogger("mysqld")
+
+MEMORY = ":memory:"
+
+#: Pragmas allowed to be used by attackers, all others might change the database or the connection
+allowed_pragmas = {
+    "foreign_key_list",
+    "index_info",
+    "index_list",
+    "table_info",
+}
+
+
+def _authorize(action, arg1, arg2, db_name, trigger_name):
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_PRAGMA and arg1 not in allowed_pragmas:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+def normalize_query(query: bytes) -> bytes:
+    """
+    Normalize the text of a query to be used as key of the query cache.
+
+    Whitespace is only collapsed if the query has no quoted strings or identifiers, so different queries never result
+    in the same key.
+    """
+    query = query.strip().rstrip(b";").strip()
+    if b"'" in query or b'"' in query or b"`" in query:
+        return query
+    return b" ".join(query.split())
+
+
+class Database(object):
+    """
+    Read-only sqlite database shared by all connections or writable scratch database of a connection.
+
+    :param name: Name of the database
+    :param path: Path of the sqlite file or ':memory:'
+    :param mmap_size: Max number of bytes of the file to access with memory-mapped I/O, 0 to disable
+    :param pool_size: Max number of idle cursors kept
+    :param cache_size: Max number of query results kept, 0 to disable the cache
+    :param immutable: Open the file as immutable, it must not be changed while dionaea is running
+    :param writable: Allow statements changing the database, only used for scratch databases in memory
+    """
+    def __init__(self, name: str, path: str, mmap_size: int = 64 * 1024 * 1024, pool_size: int = 4,
+                 cache_size: int = 256, immutable: bool = True, writable: bool = False):
+        self.name = name
+        self.path = path
+        self.mmap_size = mmap_size
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self.immutable = immutable
+        self.writable = writable
+        self.dbh = self._connect()
+        self._cursors: List[sqlite3.Cursor] = []
+        self._cache: "OrderedDict[bytes, Any]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def is_scratch(self) -> bool:
+        return self.path == MEMORY
+
+    def scratch(self) -> "Database":
+        """
+        Create a new scratch database for a connection, the results of queries are not cached.
+        """
+        return Database(self.name, MEMORY, mmap_size=0, pool_size=1, cache_size=0, writable=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.is_scratch:
+            dbh = sqlite3.connect(self.path)
+        else:
+            uri = "file:%s?mode=ro" % quote(os.path.abspath(self.path))
+            if self.immutable:
+                uri += "&immutable=1"
+            dbh = sqlite3.connect(uri, uri=True)
+        if not self.writable:
+            dbh.execute("PRAGMA query_only = 1")
+        if self.mmap_size:
+            dbh.execute("PRAGMA mmap_size = %d" % int(self.mmap_size))
+        dbh.set_authorizer(_authorize)
+        return dbh
+
+    def execute(self, query: str, parameters=()) -> Tuple[Optional[List[str]], List[tuple]]:
+        """
+        Execute a query with a cursor of the pool.
+
+        :return: Tuple of the column names, None if the statement has no result, and all rows
+        """
+        if self._cursors:
+            cursor = self._cursors.pop()
+        else:
+            cursor = self.dbh.cursor()
+        # A cursor of a failed query is not returned to the pool
+        result = cursor.execute(query, parameters)
+        if result.description is None:
+            names = None
+            rows = []
+        else:
+            names = [column[0] for column in result.description]
+            rows = result.fetchall()
+        if len(self._cursors) < self.pool_size:
+            self._cursors.append(cursor)
+        else:
+            cursor.close()
+        return names, rows
+
+    def cache_get(self, key: bytes) -> Optional[Any]:
+        value = self._cache.get(key)
+        if value is None:
+            self.cache_misses += 1
+            return None
+        self.cache_hits += 1
+        self._cache.move_to_end(key)
+        return value
+
+    def cache_put(self, key: bytes, value: Any):
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def close(self):
+        self._cursors = []
+        self._cache.clear()
+        self.dbh.close()
+
+
+#: Databases opened by this process
+_databases: Dict[Tuple, Database] = {}
+
+
+def open_databases(config: Optional[Dict[str, Any]]) -> Dict[str, Database]:
+    """
+    Open the databases of the service config.
+
+    Databases with the same name and options are only opened once per process. The scratch databases are only
+    templates, use Database.scratch() to create the database of a connection.
+
+    :param config: The 'databases' value of the service config
+    :return: The databases by name
+    """
+    databases = {}
+    if not isinstance(config, dict):
+        return databases
+
+    for name, db_config in config.items():
+        if not isinstance(db_config, dict) or not db_config.get("path"):
+            logger.warning("No path for database '%s' configured", name)
+            continue
+        try:
+            options: Dict[str, Any] = {
+                "mmap_size": int(db_config.get("mmap_size", 64 * 1024 * 1024)),
+                "pool_size": int(db_config.get("pool_size", 4)),
+                "cache_size": int(db_config.get("query_cache_size", 256)),
+                "immutable": bool(db_config.get("immutable", True)),
+            }
+        except (TypeError, ValueError):
+            logger.warning("Unable to parse the config of database '%s'", name, exc_info=True)
+            continue
+
+        key = (name, db_config["path"]) + tuple(sorted(options.items()))
+        db = _databases.get(key)
+        if db is None:
+            try:
+                db = Database(name, db_config["path"], **options)
+            except sqlite3.Error:
+                logger.warning("Unable to open database '%s' %s", name, db_config["path"], exc_info=True)
+                continue
+            _databases[key] = db
+        databases[name] = db
+    return databases
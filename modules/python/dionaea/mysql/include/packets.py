@@ -4,6 +4,8 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import struct
+
 from dionaea.smb.include.packet import Packet, bind_bottom_up
 from dionaea.smb.include.fieldtypes import ByteField, StrNullField, IntField
 from dionaea.smb.include.fieldtypes import StrFixedLenField, FlagsField
@@ -374,6 +376,69 @@ class MySQL_Result_Row_Data(Packet):
             "ColumnValues",None,LengthCodedBinaryField("ColumnValue",b'')),
     ]
 
+
+class MySQL_Reply(object):
+    """
+    Pre-serialized reply of one or more packets.
+
+    The payloads are built once, only the sequence numbers in the packet headers are patched if the reply is sent. The
+    data of the last used sequence numbers is kept, so a reply used as a template is built only once in most cases.
+
+    :param packets: List of packets or already serialized payloads
+    :param keep_packets: Keep the packets to trace them, if False the payloads are traced as raw data
+    """
+    max_cached = 4
+
+    def __init__(self, packets, keep_packets=True):
+        payloads = [p if isinstance(p, (bytes, bytearray)) else p.build() for p in packets]
+        self.packets = list(packets) if keep_packets else None
+        self.count = len(payloads)
+        self._offsets = []
+        chunks = []
+        offset = 0
+        for payload in payloads:
+            chunks.append(struct.pack("<I", len(payload))[:3])
+            chunks.append(b"\0")
+            chunks.append(payload)
+            self._offsets.append(offset + 3)
+            offset += 4 + len(payload)
+        self._template = b"".join(chunks)
+        self._built = {}
+
+    def __len__(self):
+        return len(self._template)
+
+    def build(self, number=0):
+        """
+        Serialize the reply.
+
+        :param number: Sequence number of the first packet
+        :return: The data of all packets
+        """
+        number &= 0xff
+        data = self._built.get(number)
+        if data is not None:
+            return data
+        buf = bytearray(self._template)
+        for i, offset in enumerate(self._offsets):
+            buf[offset] = (number + i) & 0xff
+        data = bytes(buf)
+        if len(self._built) >= self.max_cached:
+            self._built.clear()
+        self._built[number] = data
+        return data
+
+    def trace(self, packet_trace, direction, number=0):
+        """
+        Trace all packets of the reply with their headers.
+        """
+        if not packet_trace.enabled or self.packets is None:
+            return
+        for i, p in enumerate(self.packets):
+            if isinstance(p, (bytes, bytearray)):
+                continue
+            packet_trace.trace(direction, MySQL_Packet_Header(Number=(number + i) & 0xff) / p)
+
 # >>> from dionaea.mysql.include.packets import *
 # >>> a = MySQL_Client_Authentication()
 # >>> b = MySQL_Server_Greeting()
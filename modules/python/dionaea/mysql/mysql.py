@@ -8,10 +8,11 @@
 import logging
 import os
 import re
-import sqlite3
 import tempfile
 
 from dionaea.core import incident, connection, g_dionaea
+from dionaea.trace import PacketTrace
+from .database import normalize_query, open_databases
 from .include.packets import *
 
 from .var import VarHandler
@@ -19,36 +20,181 @@ from .var import VarHandler
 logger = logging.getLogger('mysqld')
 
 re_show_var = re.compile(
-    r"show\s+((?P<global>global)\s+)?variables(\s+like\s+(?P<sep>\"|')(?P<like>.*?)(?P=sep))?",
+    rb"show\s+((?P<global>global)\s+)?variables(\s+like\s+(?P<sep>\"|')(?P<like>.*?)(?P=sep))?",
     re.I
 )
 
 re_select_var = re.compile(
-    r"select\s+(?P<full_name>@(?P<global>@)?(?P<name>\w+))(\s+limit\s+\d+)?",
+    rb"select\s+(?P<full_name>@(?P<global>@)?(?P<name>\w+))(\s+limit\s+\d+)?",
     re.I
 )
 
+re_function = re.compile(rb"(?P<name>[A-Za-z0-9_.]+)\((?P<args>.*?)\)+")
+re_url = re.compile(
+    rb"(?P<url>(http|ftp|https)://([\w_-]+(?:(?:\.[\w_-]+)+))([\w.,@?^=%&:/~+#-]*[\w@?^=%&/~+#-])?)"
+)
+
+#: Replies not depending on the state of the connection or the server variables
+reply_ok = MySQL_Reply([MySQL_Result_OK()])
+reply_ok_set = MySQL_Reply([MySQL_Result_OK(Message="#2")])
+reply_error_no_database = MySQL_Reply([MySQL_Result_Error(Message="No such database")])
+reply_error_syntax = MySQL_Reply([
+    MySQL_Result_Error(
+        Message="#1064 - You have an error in your SQL syntax; check the manual that corresponds to your MySQL "
+                "server version for the right syntax to use"
+    )
+])
+reply_error_sql = MySQL_Reply([MySQL_Result_Error(Message="Learn SQL!")])
+
+#: Max size of a reply kept in the query cache of a database
+query_cache_max_reply_size = 64 * 1024
+
+eof_payload = MySQL_Result_EOF(ServerStatus=0x002).build()
+show_variables_payloads = [
+    MySQL_Result_Header(FieldCount=2).build(),
+    MySQL_Result_Field(
+        Catalog='def',
+        Name="Variable_name",
+        CharSet=33,
+        Length=75,
+        Type=FIELD_TYPE_VAR_STRING,
+        Flags=FLAG_NOT_NULL,
+        Decimals=0
+    ).build(),
+    MySQL_Result_Field(
+        Catalog='def',
+        Name="Value",
+        CharSet=33,
+        Length=75,
+        Type=FIELD_TYPE_VAR_STRING,
+        Flags=FLAG_NOT_NULL,
+        Decimals=0
+    ).build(),
+    eof_payload,
+]
+
+
+class ReplyCache(object):
+    """
+    Replies depending on the server variables.
+
+    The greeting, the rows of SHOW VARIABLES and the result sets of selected variables are built once. The cache must
+    be cleared if the variables change.
+
+    :param VarHandler vars: The server variables
+    """
+    def __init__(self, vars):
+        self.vars = vars
+        self.clear()
+
+    def clear(self):
+        self._greeting = None
+        self._rows = None
+        self._show_variables = None
+        self._select_var = {}
+
+    def greeting(self):
+        if self._greeting is None:
+            var_version = self.vars.values.get("version")
+            self._greeting = MySQL_Reply([
+                MySQL_Server_Greeting(
+                    ServerVersion="%s\0" % var_version
+                )
+            ])
+        return self._greeting
+
+    def rows(self):
+        """
+        Serialized rows of SHOW VARIABLES in the order of the variables.
+
+        :return: List of tuples of the name and the row
+        """
+        if self._rows is None:
+            self._rows = [
+                (name.encode("ascii"), MySQL_Result_Row_Data(ColumnValues=[name + '\0', "%s\0" % var]).build())
+                for name, var in self.vars.values.items()
+            ]
+        return self._rows
+
+    def show_variables(self, pattern=None):
+        """
+        Result set of SHOW VARIABLES.
+
+        :param pattern: Compiled pattern to filter the variable names, only the unfiltered result set is kept
+        """
+        if pattern is not None:
+            rows = [row for name, row in self.rows() if pattern.match(name)]
+            return MySQL_Reply(show_variables_payloads + rows + [eof_payload], keep_packets=False)
+
+        if self._show_variables is None:
+            rows = [row for _, row in self.rows()]
+            self._show_variables = MySQL_Reply(show_variables_payloads + rows + [eof_payload], keep_packets=False)
+        return self._show_variables
+
+    def select_var(self, var_name, var_full_name):
+        """
+        Result set of selecting a variable.
+
+        :return: The reply or None if the variable does not exist
+        """
+        key = (var_name, var_full_name)
+        reply = self._select_var.get(key)
+        if reply is not None:
+            return reply
+        var = self.vars.values.get(var_name)
+        if var is None:
+            return None
+        reply = MySQL_Reply([
+            MySQL_Result_Header(FieldCount=1),
+            MySQL_Result_Field(
+                Catalog='def',
+                Name=var_full_name,
+                CharSet=33,
+                Length=75,
+                Type=FIELD_TYPE_VAR_STRING,
+                Flags=FLAG_NOT_NULL,
+                Decimals=0
+            ),
+            MySQL_Result_EOF(ServerStatus=0x002),
+            MySQL_Result_Row_Data(ColumnValues=["%s\0" % var]),
+            MySQL_Result_EOF(ServerStatus=0x002),
+        ])
+        # Only existing variables are kept, so the size of the cache is limited
+        self._select_var[key] = reply
+        return reply
+
 
 class mysqld(connection):
     shared_config_values = [
         "config",
+        "databases",
         "download_dir",
-        "download_suffix"
+        "download_suffix",
+        "packet_trace"
     ]
+    packet_trace = PacketTrace("mysqld")
+    io_in_framing = "mysql"
     vars = VarHandler()
+    replies = ReplyCache(vars)
+    regex_statement = re.compile(
+        rb"""([A-Za-z0-9_.]+\(.*?\)+|\(.*?\)+|"(?:[^"]|\"|"")*"+|'[^'](?:|\'|'')*'+|`(?:[^`]|``)*`+|[^ ,]+|,)"""
+    )
 
     def __init__(self):
         connection.__init__(self, "tcp")
         self.config = None
+        self.databases = {}
+        #: Scratch databases of this connection by name
+        self.scratch_databases = {}
+        self.database = None
         self.state = ""
-        self.regex_statement = re.compile(
-            r"""([A-Za-z0-9_.]+\(.*?\)+|\(.*?\)+|"(?:[^"]|\"|"")*"+|'[^'](?:|\'|'')*'+|`(?:[^`]|``)*`+|[^ ,]+|,)"""
-        )
         self.download_dir = None
         self.download_suffix = ".tmp"
 
     def apply_config(self, config):
         self.config = config.get("databases")
+        self.databases = open_databases(self.config)
+        self.packet_trace = PacketTrace.from_config("mysqld", config)
 
         dionaea_config = g_dionaea.config().get("dionaea")
         self.download_dir = dionaea_config.get("download.dir")
@@ -66,46 +212,114 @@ class mysqld(connection):
                 logger.warning("Config value '%s' does not exist")
                 continue
             obj.value = value
+        self.replies.clear()
 
     def handle_established(self):
         self.processors()
         self.state = 'greeting'
-        var_version = self.vars.values.get("version")
-        greeting = MySQL_Server_Greeting(
-            ServerVersion="%s\0" % var_version
-        )
-        a = MySQL_Packet_Header(Number=0) / greeting
-        a.show()
-        self.send(a.build())
+        greeting = self.replies.greeting()
+        buf = greeting.build(0)
+        greeting.trace(self.packet_trace, "out", 0)
+        self.packet_trace.dump("out", buf)
+        self.send(buf)
         self._open_db('information_schema')
 
+    def handle_disconnect(self):
+        for db in self.scratch_databases.values():
+            db.close()
+        self.scratch_databases = {}
+        return False
+
     def _open_db(self, Database):
-        logger.warn("DATABASE opening %s" % Database)
-        try:
-            p = self.config[Database]['path']
-            logger.warn("open db %s -> %s" % (Database, p))
-            self.dbh = sqlite3.connect(p)
-            self.cursor = self.dbh.cursor()
-            self.database = Database
-            return True
-        except:
+        if isinstance(Database, bytes):
+            Database = Database.decode("utf-8", errors="replace")
+        db = self.databases.get(Database)
+        if db is None:
+            logger.debug("Database %s does not exist", Database)
             return False
+        logger.debug("Using database %s -> %s", Database, db.path)
+        self.database = Database
+        return True
+
+    def _get_db(self):
+        """
+        Get the database in use, a scratch database is only created if it is used by the connection.
+
+        :return: The database or None if no database is in use
+        """
+        db = self.databases.get(self.database)
+        if db is None or not db.is_scratch:
+            return db
+        scratch = self.scratch_databases.get(self.database)
+        if scratch is None:
+            scratch = self.scratch_databases[self.database] = db.scratch()
+        return scratch
+
+    def _query(self, query, key=None):
+        """
+        Execute a query and return the result set, the result set of a query is kept in the query cache.
+
+        :param str query: The query
+        :param bytes key: The key for the query cache, if None the result is not cached
+        :return: The reply or None if the statement has no result
+        """
+        db = self._get_db()
+        if key is not None:
+            r = db.cache_get(key)
+            if r is not None:
+                return r
+
+        names, rows = db.execute(query)
+        if names is None:
+            return None
+        r = self._result_set(names, rows)
+        if key is not None and len(r) <= query_cache_max_reply_size:
+            db.cache_put(key, r)
+        return r
+
+    def _result_set(self, names, rows, fields=None):
+        if fields is None:
+            fields = []
+            for name in names:
+                fields.append(
+                    MySQL_Result_Field(
+                        #Catalog='def',
+                        Table=b'',
+                        ORGTable=b"",
+                        Database=b"",
+                        Name=name,
+                        CharSet=33,
+                        Length=255,
+                        Type=FIELD_TYPE_VAR_STRING,
+                        Flags=FLAG_NOT_NULL,
+                        Decimals=0
+                    )
+                )
+        r = [MySQL_Result_Header(FieldCount=len(fields))]
+        r.extend(fields)
+        r.append(MySQL_Result_EOF(ServerStatus=0x002))
+        for row in rows:
+            r.append(MySQL_Result_Row_Data(ColumnValues=list(row)))
+        r.append(MySQL_Result_EOF(ServerStatus=0x002))
+        return MySQL_Reply(r)
 
     def _handle_COM_INIT_DB(self, p):
         Database = p.Database.decode('utf-8')
         if self._open_db(Database) == True:
-            return MySQL_Result_OK()
+            return reply_ok
         else:
-            return MySQL_Result_Error(Message="No such database")
+            return reply_error_no_database
 
     def _handle_COM_FIELD_LIST(self, p):
         r = []
+        db = self._get_db()
+        if db is None:
+            return reply_error_no_database
         query = "PRAGMA table_info(%s);" % p.Table.decode('ascii')[:-1]
         # FIXME sqlite does not allow ? for PRAGMA? I'm not afraid of SQLi here
         # though.
-        result = self.cursor.execute(query)
-        names = [result.description[x][0] for x in range(len(result.description))]
-        result = [dict(zip(names, i)) for i in result]
+        names, rows = db.execute(query)
+        result = [dict(zip(names, i)) for i in rows]
         for res in result:
             x = MySQL_Result_Field(
                 Catalog='def',
@@ -130,23 +344,22 @@ class mysqld(connection):
         query = self.regex_statement.findall(p.Query)
 
         if len(query) > 0 and query[0].lower() == b"select":
-            print("foo")
             r = self._handle_com_query_select(p, query[1:])
 
         elif len(query) > 0 and query[0].lower() == b"show":
             r = self._handle_com_query_show(p, query[1:])
 
         # ToDo: Support for MySQL_Result_*()
-        if isinstance(r, list):
+        if isinstance(r, (list, MySQL_Reply)):
             return r
 
         if r is True:
-            return MySQL_Result_OK(Message="")
+            return reply_ok
 
         if re.match(b'set ', p.Query, re.I):
-            r = MySQL_Result_OK(Message="#2")
+            r = reply_ok_set
 
-        elif re.match(r'select\s+database\s*\(\s*\)$', p.Query, re.I):
+        elif re.match(rb'select\s+database\s*\(\s*\)$', p.Query, re.I):
             r = [
                 MySQL_Result_Header(FieldCount=1),
                 MySQL_Result_Field(
@@ -167,7 +380,7 @@ class mysqld(connection):
                 MySQL_Result_EOF(ServerStatus=0x002)
             ]
 
-        elif re.match(r"show\s+databases$", p.Query, re.I):
+        elif re.match(rb"show\s+databases$", p.Query, re.I):
             r = [
                 MySQL_Result_Header(FieldCount=1),
                 MySQL_Result_Field(
@@ -192,9 +405,16 @@ class mysqld(connection):
             # r.append(MySQL_Result_Row_Data(ColumnValues=['information_schema']))
             r.append(MySQL_Result_EOF(ServerStatus=0x002))
 
-        elif re.match(r'show\s+tables$', p.Query, re.I):
-            r = [
-                MySQL_Result_Header(FieldCount=1),
+        elif re.match(rb'show\s+tables$', p.Query, re.I):
+            db = self._get_db()
+            if db is None:
+                return reply_error_no_database
+            key = normalize_query(p.Query).lower()
+            r = db.cache_get(key)
+            if r is not None:
+                return r
+
+            fields = [
                 MySQL_Result_Field(
                     Catalog='def',
                     Database=self.database.encode("ascii"),
@@ -207,60 +427,25 @@ class mysqld(connection):
                     Type=FIELD_TYPE_VAR_STRING,
                     Flags=FLAG_NOT_NULL,
                     Decimals=0
-                ),
-                MySQL_Result_EOF(ServerStatus=0x002)
+                )
             ]
-
-            result = self.cursor.execute("select tbl_name from sqlite_master where type = 'table'")
-            names = [result.description[x][0] for x in range(len(result.description))]
-            result = [dict(zip(names, i)) for i in result]
-            for res in result:
-                x = MySQL_Result_Row_Data(ColumnValues=[res[name] for name in names])
-                r.append(x)
-            r.append(MySQL_Result_EOF(ServerStatus=0x002))
+            names, rows = db.execute("select tbl_name from sqlite_master where type = 'table'")
+            r = self._result_set(names, rows, fields=fields)
+            db.cache_put(key, r)
 
         elif re.match(b'attach', p.Query, re.I):
-            return MySQL_Result_Error(Message="#1064 - You have an error in your SQL syntax; check the manual that corresponds to your MySQL server version for the right syntax to use")
+            return reply_error_syntax
 
         else:
-            p.show()
             try:
                 query = p.Query.decode('utf-8')
-                print(query)
-                result = self.cursor.execute(query)
-                print(result)
-                if result.description is None:
-                    r = MySQL_Result_OK()
-                else:
-                    names = [result.description[x][0] for x in range(len(result.description))]
-                    print(result)
-                    result = [dict(zip(names, i)) for i in result]
-                    r = [MySQL_Result_Header(FieldCount=len(names))]
-                    for name in names:
-                        r.append(
-                            MySQL_Result_Field(
-                                #Catalog='def',
-                                Table=b'',
-                                ORGTable=b"",
-                                Database=b"",
-                                Name=name,
-                                CharSet=33,
-                                Length=255,
-                                Type=FIELD_TYPE_VAR_STRING,
-                                Flags=FLAG_NOT_NULL,
-                                Decimals=0
-                            )
-                        )
-                    r.append(MySQL_Result_EOF(ServerStatus=0x002))
-                    for res in result:
-                        x = MySQL_Result_Row_Data(ColumnValues=[res[name] for name in names])
-                        # x.show()
-                        r.append(x),
-                    r.append(MySQL_Result_EOF(ServerStatus=0x002))
+                r = self._query(query, key=normalize_query(p.Query))
+                if r is None:
+                    r = reply_ok
             except Exception as e:
                 logger.warn("SQL ERROR %s" % e)
                 logger.warn("SQL ERROR in %s" % p.Query)
-                r = MySQL_Result_Error(Message="Learn SQL!")
+                r = reply_error_sql
         return r
 
     def _handle_com_query_select(self, p, query):
@@ -273,39 +458,16 @@ class mysqld(connection):
         if len(query) == 0:
             return False
 
-        regex_function = re.compile(r"(?P<name>[A-Za-z0-9_.]+)\((?P<args>.*?)\)+")
-        regex_url = re.compile(r"(?P<url>(http|ftp|https)://([\w_-]+(?:(?:\.[\w_-]+)+))([\w.,@?^=%&:/~+#-]*[\w@?^=%&/~+#-])?)")
-
         m = re_select_var.match(p.Query)
         if m:
-            r = []
             var_name = m.group("name").decode("ascii")
             var_full_name = m.group("full_name").decode("ascii")
-            var = self.vars.values.get(var_name)
-            if var is None:
+            r = self.replies.select_var(var_name, var_full_name)
+            if r is None:
                 return [MySQL_Result_Error(Message="ERROR 1193 (HY000): Unknown system variable '%s'" % var_name)]
-
-            r.append(MySQL_Result_Header(FieldCount=1))
-            r.append(
-                MySQL_Result_Field(
-                    Catalog='def',
-                    Name=var_full_name,
-                    CharSet=33,
-                    Length=75,
-                    Type=FIELD_TYPE_VAR_STRING,
-                    Flags=FLAG_NOT_NULL,
-                    Decimals=0
-                )
-            )
-            r.append(MySQL_Result_EOF(ServerStatus=0x002))
-
-            r.append(
-                MySQL_Result_Row_Data(ColumnValues=["%s\0" % var])
-            )
-            r.append(MySQL_Result_EOF(ServerStatus=0x002))
             return r
 
-        m = regex_function.match(query[0])
+        m = re_function.match(query[0])
 
         if m and m.group("name") == b"unhex":
             if len(query) < 4:
@@ -347,7 +509,7 @@ class mysqld(connection):
 
         if m and m.group("name") == b"xpdl3":
             args = m.group("args")
-            m_url = regex_url.search(args)
+            m_url = re_url.search(args)
             if m_url:
                 i = incident("dionaea.download.offer")
                 i.con = self
@@ -367,48 +529,13 @@ class mysqld(connection):
 
         m = re_show_var.match(p.Query)
         if m:
-            r = []
-            r.append(MySQL_Result_Header(FieldCount=2))
-            r.append(
-                MySQL_Result_Field(
-                    Catalog='def',
-                    Name="Variable_name",
-                    CharSet=33,
-                    Length=75,
-                    Type=FIELD_TYPE_VAR_STRING,
-                    Flags=FLAG_NOT_NULL,
-                    Decimals=0
-                )
-            )
-            r.append(
-                MySQL_Result_Field(
-                    Catalog='def',
-                    Name="Value",
-                    CharSet=33,
-                    Length=75,
-                    Type=FIELD_TYPE_VAR_STRING,
-                    Flags=FLAG_NOT_NULL,
-                    Decimals=0
-                )
-            )
-            r.append(MySQL_Result_EOF(ServerStatus=0x002))
-
             var_name = None
             if m.group("like"):
                 var_name = re.escape(m.group("like"))
                 var_name = var_name.replace(b"%", b".*")
                 var_name = re.compile(var_name)
 
-            for name, var in self.vars.values.items():
-                if var_name and not var_name.match(name.encode("ascii")):
-                    continue
-                r.append(
-                    MySQL_Result_Row_Data(ColumnValues=[name + '\0', "%s\0" % var])
-                )
-
-            r.append(MySQL_Result_EOF(ServerStatus=0x002))
-
-            return r
+            return self.replies.show_variables(var_name)
 
     def _report_raw_data(self, data):
         """
@@ -436,6 +563,8 @@ class mysqld(connection):
 
     def handle_io_in(self,data):
         offset = 0
+        # The replies of all packets are sent at once
+        out = []
         while len(data) - offset >= 4:
             h = MySQL_Packet_Header(data[offset:offset+4])
             r = p = None
@@ -450,11 +579,13 @@ class mysqld(connection):
                     if type(Database) == str:
                         Database = Database.encode('ascii')
                     if self._open_db(Database) == True:
-                        r = MySQL_Result_Error(Message="Could not open Database %s" % Database)
+                        r = reply_ok
                     else:
-                        r = MySQL_Result_OK()
+                        r = MySQL_Result_Error(
+                            Message="Could not open Database %s" % Database.decode("utf-8", errors="replace")
+                        )
                 else:
-                    r = MySQL_Result_OK()
+                    r = reply_ok
 
                 i = incident("dionaea.modules.python.mysql.login")
                 i.con = self
@@ -479,22 +610,27 @@ class mysqld(connection):
                 i.command = p.Command
                 if args is not None:
                     i.args = args
-                i.dump()
+                if self.packet_trace.enabled:
+                    i.dump()
                 i.report()
 
             if p is not None:
                 h = h / p
-            h.show()
+            if self.packet_trace.enabled:
+                # Only the raw data of this packet, incomplete packets are dumped once they are complete
+                self.packet_trace.trace("in", h, data[offset:offset + 4 + h.Length])
 
             if r is not None:
-                if type(r) is not list:
-                    r = [r]
-                buf = b''
-                for i in range(len(r)):
-                    rp = r[i]
-                    rp = MySQL_Packet_Header(Number=h.Number+1+i) / rp
-                    rp.show()
-                    buf += rp.build()
-                self.send(buf)
+                if not isinstance(r, MySQL_Reply):
+                    if type(r) is not list:
+                        r = [r]
+                    r = MySQL_Reply(r)
+                r.trace(self.packet_trace, "out", h.Number + 1)
+                out.append(r.build(h.Number + 1))
             offset += 4 + h.Length
+
+        if out:
+            buf = b"".join(out)
+            self.packet_trace.dump("out", buf)
+            self.send(buf)
         return offset
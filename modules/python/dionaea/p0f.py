@@ -6,10 +6,14 @@
 
 from dionaea import IHandlerLoader
 from dionaea.core import ihandler, incident, connection
-from struct import pack, unpack, calcsize
+from collections import OrderedDict
+from ipaddress import ip_address
+from struct import Struct
 from socket import inet_aton
+from typing import Any, Dict, List, Optional, Tuple
 
 import logging
+import time
 
 logger = logging.getLogger('p0f')
 logger.setLevel(logging.DEBUG)
@@ -23,82 +27,324 @@ class P0FHandlerLoader(IHandlerLoader):
         return p0fhandler(config=config)
 
 
+def _decode(value: bytes) -> str:
+    pos = value.find(b'\x00')
+    if pos >= 0:
+        value = value[:pos]
+    try:
+        return value.decode("ascii")
+    except UnicodeDecodeError:
+        logger.warning("Unable to decode p0f information %r", value, exc_info=True)
+        return value.decode("ascii", errors="replace")
+
+
+class P0F2Protocol(object):
+    """
+    Query API of p0f 2.x, the responses are matched by the id of the query.
+    """
+    version = 2
+    magic = 0x0defaced
+    # p0f >= 2.0.8
+    query_struct = Struct("III4s4sHH")
+    response_struct = Struct("IIB20s40sB30s30sBBBhHi")
+    response_size = response_struct.size
+    names = ("magic", "id", "type", "genre", "detail", "dist", "link", "tos", "fw", "nat", "real", "score", "mflags",
+             "uptime")
+    ordered = False
+
+    def query(self, query_id: int, con) -> Optional[bytes]:
+        try:
+            return self.query_struct.pack(
+                self.magic,
+                1,                              # type
+                query_id,
+                inet_aton(con.remote.host),     # remote host
+                inet_aton(con.local.host),      # local host
+                con.remote.port,                # remote port
+                con.local.port                  # local port
+            )
+        except OSError:
+            # p0f 2.x only supports IPv4
+            return None
+
+    def parse(self, data: bytes) -> Tuple[Optional[int], Optional[Dict[str, str]]]:
+        """
+        :return: Tuple of the id of the query and the values of the incident
+        """
+        values = {}
+        for name, value in zip(self.names, self.response_struct.unpack(data)):
+            if isinstance(value, bytes):
+                values[name] = _decode(value)
+            else:
+                values[name] = str(value)
+        return int(values["id"]), values
+
+
+class P0F3Protocol(object):
+    """
+    Query API of p0f 3.x, the responses are sent in the order of the queries.
+    """
+    version = 3
+    magic = 0x50304601
+    response_magic = 0x50304602
+    status_ok = 0x10
+    query_struct = Struct("=IB16s")
+    response_struct = Struct("=IIIIIIIIIhBB32s32s32s32s32s32s")
+    response_size = response_struct.size
+    ordered = True
+
+    def query(self, query_id: int, con) -> Optional[bytes]:
+        try:
+            addr = ip_address(con.remote.host)
+        except ValueError:
+            return None
+        if addr.version == 6 and addr.ipv4_mapped is not None:
+            addr = addr.ipv4_mapped
+        return self.query_struct.pack(self.magic, addr.version, addr.packed)
+
+    def parse(self, data: bytes) -> Tuple[Optional[int], Optional[Dict[str, str]]]:
+        (magic, status, first_seen, last_seen, total_conn, uptime_min, up_mod_days, last_nat, last_chg, distance,
+         bad_sw, os_match_q, os_name, os_flavor, http_name, http_flavor, link_type, language) = \
+            self.response_struct.unpack(data)
+        if magic != self.response_magic or status != self.status_ok:
+            return None, None
+        # Use the names of p0f 2.x for the values available in both versions
+        return None, {
+            "genre": _decode(os_name),
+            "detail": _decode(os_flavor),
+            "dist": str(distance),
+            "link": _decode(link_type),
+            "tos": "",
+            "fw": "0",
+            "nat": "1" if last_nat else "0",
+            "uptime": str(uptime_min // 60),
+            "http_name": _decode(http_name),
+            "http_flavor": _decode(http_flavor),
+            "language": _decode(language),
+            "first_seen": str(first_seen),
+            "last_seen": str(last_seen),
+            "total_conn": str(total_conn),
+            "os_match_q": str(os_match_q),
+            "bad_sw": str(bad_sw),
+        }
+
+
+protocols = {
+    2: P0F2Protocol,
+    3: P0F3Protocol,
+}
+
+
 class p0fconnection(connection):
-    def __init__(self, p0fpath, con):
+    """
+    Long-lived connection to the query socket of p0f, all queries are sent without waiting for the previous responses.
+    """
+    def __init__(self, handler):
         connection.__init__(self, 'tcp')
-        self.con = con
-        self.con.ref()
-        self.connect(p0fpath, 0)
+        self.handler = handler
+        self.protocol = handler.protocol
+        self.set_io_in_framing(min_size=self.protocol.response_size)
+        self.established = False
+        #: Sent queries by id, in the order they have been sent
+        self.queries: "OrderedDict[int, str]" = OrderedDict()
+        self.answered = 0
+        self.connect(handler.path, 0)
+
+    def query(self, query_id: int, host: str, data: bytes):
+        self.queries[query_id] = host
+        if self.established:
+            self.send(data)
 
     def handle_established(self):
-        if True:
-            # p0f >= 2.0.8
-            data = pack("III4s4sHH",
-                        0x0defaced,                     # p0f magic
-                        1,                              # type
-                        0xffffffff,                     # id
-                        inet_aton(self.con.remote.host),# remote host
-                        inet_aton(self.con.local.host), # local host
-                        self.con.remote.port,           # remote port
-                        self.con.local.port)            # local port
-        else:
-            # p0f < 2.0.8
-            data = pack("=II4s4sHH",
-                        0x0defaced,                     # p0f magic
-                        0xffffffff,                     # type
-                        inet_aton(self.con.remote.host),# remote host
-                        inet_aton(self.con.local.host), # local host
-                        self.con.remote.port,           # remote port
-                        self.con.local.port)            # local port
-
-        self.send(data)
+        self.established = True
+        self.timeouts.idle = self.handler.timeout
+        for query_id, host in self.queries.items():
+            data = self.handler.get_query(query_id)
+            if data is not None:
+                self.send(data)
 
     def handle_io_in(self, data):
-        fmt = "IIB20s40sB30s30sBBBhHi"
-        if len(data) != calcsize(fmt):
-            return 0
-        values = unpack(fmt, data)
-        names=["magic","id","type","genre","detail","dist","link",
-               "tos","fw","nat","real","score","mflags","uptime"]
-        icd = incident(origin='dionaea.modules.python.p0f')
-        for i in range(len(values)):
-            s = values[i]
-            if type(s) == bytes:
-                if s.find(b'\x00'):
-                    s = s[:s.find(b'\x00')]
-                try:
-                    s = s.decode("ascii")
-                except UnicodeDecodeError:
-                    logger.warning("Unable to decode p0f information %s=%r", i, s, exc_info=True)
-                icd.set(names[i], s)
-            elif type(s) == int:
-                icd.set(names[i], str(s))
-        icd.set('con',self.con)
-        icd.report()
-        self.close()
-        return len(data)
+        size = self.protocol.response_size
+        offset = 0
+        while len(data) - offset >= size:
+            query_id, values = self.protocol.parse(bytes(data[offset:offset + size]))
+            offset += size
+            if self.protocol.ordered:
+                if not self.queries:
+                    logger.warning("Unexpected response from p0f")
+                    continue
+                query_id, host = self.queries.popitem(last=False)
+            else:
+                host = self.queries.pop(query_id, None)
+                if host is None:
+                    logger.warning("Response from p0f for unknown query %d", query_id)
+                    continue
+            self.answered += 1
+            self.handler.resolve(query_id, host, values)
+        return offset
+
+    def handle_timeout_idle(self):
+        if not self.queries:
+            return True
+        logger.warning("No response from p0f for %d queries", len(self.queries))
+        self.handler.connection_lost(self, retry=False)
+        return False
 
     def handle_disconnect(self):
-        self.con.unref()
+        self.handler.connection_lost(self, retry=self.answered > 0)
         return 0
 
     def handle_error(self, err):
-        self.con.unref()
+        logger.warning("Unable to query p0f at %s", self.handler.path)
+        self.handler.connection_lost(self, retry=False)
+
 
 class p0fhandler(ihandler):
+    #: Seconds to wait before connecting again after the connection to p0f failed
+    reconnect_delay = 5.0
+
     def __init__(self, config=None):
         logger.debug("p0fHandler")
         ihandler.__init__(self, 'dionaea.connection.*')
-        self.p0fpath = config.get("path")
+        if config is None:
+            config = {}
+        self.p0fpath = self.path = config.get("path")
+        version = int(config.get("version", 2))
+        if version not in protocols:
+            logger.warning("Unsupported p0f version %s, using version 2", version)
+            version = 2
+        self.protocol = protocols[version]()
+        self.cache_ttl = float(config.get("cache_ttl", 600))
+        self.cache_size = int(config.get("cache_size", 10000))
+        self.timeout = float(config.get("timeout", 10))
+
+        self.client: Optional[p0fconnection] = None
+        self._failed_at: Optional[float] = None
+        self._next_id = 0
+        #: Values of the incidents by remote host and the time they expire
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, str]]]" = OrderedDict()
+        #: Pending queries by id with the remote host, the query and the waiting connections
+        self._queries: Dict[int, Tuple[str, bytes, List[Any]]] = {}
+        self._query_ids: Dict[str, int] = {}
+        self.cache_hits = 0
+        self.connections = 0
+        self.queries_sent = 0
 
     def handle_incident(self, icd):
         if icd.origin == 'dionaea.connection.tcp.accept' or icd.origin == 'dionaea.connection.tls.accept' or icd.origin == 'dionaea.connection.tcp.reject':
             logger.debug("p0f action")
-#           icd.dump()
-            con = icd.get('con')
-            p = p0fconnection(self.p0fpath, con)
+            self.lookup(icd.get('con'))
+
+    def lookup(self, con):
+        """
+        Report the p0f incident of a connection, the result of a previous query of the remote host is used if known.
+        """
+        host = con.remote.host
+        values = self._cache_get(host)
+        if values is not None:
+            self.cache_hits += 1
+            self._report(con, values)
+            return
+
+        query_id = self._query_ids.get(host)
+        if query_id is not None:
+            # Wait for the response of the pending query of the remote host
+            con.ref()
+            self._queries[query_id][2].append(con)
+            return
+
+        if self._failed_at is not None and time.monotonic() - self._failed_at < self.reconnect_delay:
+            return
 
+        self._next_id = (self._next_id + 1) & 0xffffffff
+        query_id = self._next_id
+        data = self.protocol.query(query_id, con)
+        if data is None:
+            logger.debug("Unable to query p0f for %s", host)
+            return
+        con.ref()
+        self._queries[query_id] = (host, data, [con])
+        self._query_ids[host] = query_id
+        self._send_query(query_id)
 
+    def get_query(self, query_id: int) -> Optional[bytes]:
+        query = self._queries.get(query_id)
+        if query is None:
+            return None
+        return query[1]
 
+    def _send_query(self, query_id: int):
+        if self.client is None:
+            self.client = p0fconnection(self)
+            self.connections += 1
+        host, data, _ = self._queries[query_id]
+        self.queries_sent += 1
+        self.client.query(query_id, host, data)
 
-# p0f = p0fHandler('un:///tmp/p0f.sock')
+    def resolve(self, query_id: int, host: str, values: Optional[Dict[str, str]]):
+        """
+        Called by the connection with the response of a query.
+        """
+        query = self._queries.pop(query_id, None)
+        if self._query_ids.get(host) == query_id:
+            del self._query_ids[host]
+        if query is None:
+            return
+        cons = query[2]
+        # p0f 2.x also answers with RESP_BADQUERY and RESP_NOMATCH, e.g. if it has not seen the SYN yet. Only cache
+        # fingerprints, the next connection of the host is queried again.
+        if values is not None and values.get("type", "0") == "0":
+            self._cache_put(host, values)
+        for con in cons:
+            if values is not None:
+                self._report(con, values)
+            con.unref()
+
+    def connection_lost(self, client: p0fconnection, retry: bool):
+        """
+        Called if the connection to p0f has been closed, the unanswered queries are sent again if p0f answered queries
+        on this connection. p0f 2.x closes the connection after every response.
+        """
+        if client is not self.client:
+            return
+        self.client = None
+        queries = list(client.queries)
+        client.queries.clear()
+        if retry:
+            self._failed_at = None
+            for query_id in queries:
+                if query_id in self._queries:
+                    self._send_query(query_id)
+            return
+
+        self._failed_at = time.monotonic()
+        for query_id in queries:
+            query = self._queries.get(query_id)
+            if query is not None:
+                self.resolve(query_id, query[0], None)
+
+    def _cache_get(self, host: str) -> Optional[Dict[str, str]]:
+        entry = self._cache.get(host)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._cache[host]
+            return None
+        self._cache.move_to_end(host)
+        return entry[1]
+
+    def _cache_put(self, host: str, values: Dict[str, str]):
+        if self.cache_ttl <= 0 or self.cache_size <= 0:
+            return
+        self._cache[host] = (time.monotonic() + self.cache_ttl, values)
+        self._cache.move_to_end(host)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _report(con, values: Dict[str, str]):
+        icd = incident(origin='dionaea.modules.python.p0f')
+        for name, value in values.items():
+            icd.set(name, value)
+        icd.set('con', con)
+        icd.report()
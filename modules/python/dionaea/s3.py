@@ -4,16 +4,39 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
-from dionaea.core import ihandler, incident, g_dionaea
-from dionaea import IHandlerLoader
+"""
+Upload the unique captured files to an S3 bucket.
+
+The incident callback only records the file in the backlog and queues it, the files are uploaded by a pool of worker
+threads sharing a single client. The backlog is a SQLite database, files not uploaded yet are queued again after a
+restart and failed uploads are retried with an increasing delay. The keys of the uploaded files are kept in memory, so
+a file is never uploaded twice. If enabled, the workers skip objects already existing in the bucket.
+"""
+
+from dionaea import IHandlerLoader, Timer
+from dionaea.core import ihandler
 
 import logging
-import socket
+import queue
+import sqlite3
+import time
+from threading import Lock, Thread
+from typing import List, Optional, Set, Tuple
+
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 logger = logging.getLogger('s3')
 logger.setLevel(logging.DEBUG)
 
+MB = 1024 * 1024
+
+STATUS_PENDING = "pending"
+STATUS_UPLOADED = "uploaded"
+STATUS_FAILED = "failed"
+
 
 class S3HandlerLoader(IHandlerLoader):
     name = "s3"
@@ -23,10 +46,101 @@ class S3HandlerLoader(IHandlerLoader):
         return s3handler("*", config=config)
 
 
+class S3Backlog(object):
+    """
+    Files to upload and uploaded files in a SQLite database, it is used by the event loop and the workers.
+
+    :param filename: The database file, with ':memory:' the backlog is lost on restart.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = Lock()
+        self.dbh: Optional[sqlite3.Connection] = sqlite3.connect(filename, check_same_thread=False)
+        # Adding a file must not wait for the disk
+        self.dbh.execute("PRAGMA journal_mode=WAL")
+        self.dbh.execute("PRAGMA synchronous=NORMAL")
+        self.dbh.execute(
+            """CREATE TABLE IF NOT EXISTS uploads (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL, -- pending, uploaded, failed
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                timestamp REAL NOT NULL,
+                error TEXT
+            )"""
+        )
+        self.dbh.execute("CREATE INDEX IF NOT EXISTS uploads_status_idx ON uploads (status, next_attempt)")
+        self.dbh.commit()
+
+    def close(self):
+        with self._lock:
+            if self.dbh is None:
+                return
+            self.dbh.close()
+            self.dbh = None
+
+    def _execute(self, sql: str, args: tuple = ()) -> List[tuple]:
+        with self._lock:
+            if self.dbh is None:
+                return []
+            rows = self.dbh.execute(sql, args).fetchall()
+            self.dbh.commit()
+            return rows
+
+    def uploaded_keys(self) -> Set[str]:
+        return {row[0] for row in self._execute("SELECT key FROM uploads WHERE status = ?", (STATUS_UPLOADED,))}
+
+    def due(self, now: float) -> List[Tuple[str, str, int]]:
+        """
+        :return: Key, path and attempts of the pending files to upload now
+        """
+        return self._execute(
+            "SELECT key, path, attempts FROM uploads WHERE status = ? AND next_attempt <= ? ORDER BY next_attempt",
+            (STATUS_PENDING, now)
+        )
+
+    def add(self, key: str, path: str, now: float):
+        """
+        Add a file to upload, the attempts of a known file not uploaded yet are reset.
+        """
+        self._execute(
+            """INSERT INTO uploads (key, path, status, attempts, next_attempt, timestamp) VALUES (?, ?, ?, 0, ?, ?)
+               ON CONFLICT (key) DO UPDATE SET
+                   path = excluded.path, status = excluded.status, attempts = 0, next_attempt = excluded.next_attempt,
+                   error = NULL
+               WHERE status != ?""",
+            (key, path, STATUS_PENDING, now, now, STATUS_UPLOADED)
+        )
+
+    def uploaded(self, key: str, now: float):
+        self._execute(
+            "UPDATE uploads SET status = ?, timestamp = ?, error = NULL WHERE key = ?",
+            (STATUS_UPLOADED, now, key)
+        )
+
+    def retry(self, key: str, attempts: int, next_attempt: float, error: str):
+        self._execute(
+            "UPDATE uploads SET attempts = ?, next_attempt = ?, error = ? WHERE key = ?",
+            (attempts, next_attempt, error, key)
+        )
+
+    def failed(self, key: str, attempts: int, error: str):
+        self._execute(
+            "UPDATE uploads SET status = ?, attempts = ?, error = ? WHERE key = ?",
+            (STATUS_FAILED, attempts, error, key)
+        )
+
+
 class s3handler(ihandler):
+    #: Max seconds to wait before an upload is retried
+    max_retry_interval = 3600.0
+
     def __init__(self, path, config=None):
         logger.debug("%s ready!" % (self.__class__.__name__))
         ihandler.__init__(self, path)
+        if config is None:
+            config = {}
 
         self.bucket_name = config.get("bucket_name")
         self.region_name = config.get("region_name")
@@ -34,30 +148,197 @@ class s3handler(ihandler):
         self.secret_access_key = config.get("secret_access_key")
         self.endpoint_url = config.get("endpoint_url")
         self.verify = config.get("verify")
-        self.s3_dest_folder = config.get("s3_dest_folder")
-        self.s3 = ''
+        self.s3_dest_folder = config.get("s3_dest_folder") or ""
+
+        self.num_workers = max(1, int(config.get("workers", 2)))
+        self.check_exists = bool(config.get("check_exists", True))
+        self.retry_interval = max(1.0, float(config.get("retry_interval", 60)))
+        self.max_attempts = max(1, int(config.get("max_attempts", 10)))
+        max_concurrency = max(1, int(config.get("max_concurrency", 4)))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=int(float(config.get("multipart_threshold", 8)) * MB),
+            multipart_chunksize=int(float(config.get("multipart_chunksize", 8)) * MB),
+            max_concurrency=max_concurrency,
+            use_threads=max_concurrency > 1,
+        )
+        # The client is thread safe, it is shared by all workers and keeps the connections open
+        self.s3 = self._create_client(max_pool_connections=self.num_workers * max_concurrency)
+
+        filename = config.get("file")
+        if not filename:
+            logger.warning("No backlog file configured, files not uploaded yet are lost on restart")
+            filename = ":memory:"
+        self.backlog = S3Backlog(filename)
+        #: Keys of the uploaded files
+        self.uploaded_keys = self.backlog.uploaded_keys()
+        logger.info("Loaded %d uploaded file(s) from the backlog %s", len(self.uploaded_keys), filename)
+
+        self._queue: queue.Queue = queue.Queue()
+        #: Keys of the queued files and the files being uploaded
+        self._queued: Set[str] = set()
+        self._lock = Lock()
+        self._running = False
+        self._workers: List[Thread] = []
+        self.retry_timer: Optional[Timer] = None
+
+        self.queued = 0
+        self.uploaded = 0
+        self.skipped = 0
+        self.existing = 0
+        self.retries = 0
+        self.failed = 0
+
+    def _create_client(self, max_pool_connections: int = 10):
+        return boto3.session.Session().client(
+            's3',
+            self.region_name,
+            aws_access_key_id=self.access_key_id,
+            aws_secret_access_key=self.secret_access_key,
+            endpoint_url=self.endpoint_url or None,
+            verify=self.verify,
+            config=Config(max_pool_connections=max_pool_connections),
+        )
+
+    def start(self):
+        self._running = True
+        for i in range(self.num_workers):
+            worker = Thread(target=self._run, name="s3-%d" % i, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        # Queue the files left in the backlog and retry the failed uploads later
+        self.queue_due()
+        self.retry_timer = Timer(
+            interval=min(self.retry_interval, 60.0),
+            function=self.queue_due,
+            repeat=True,
+        )
+        self.retry_timer.start()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Stop the workers after the current uploads, the queued files stay in the backlog.
+        """
+        if self.retry_timer is not None:
+            self.retry_timer.stop()
+            self.retry_timer = None
+        self._running = False
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self._workers:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        self._workers = []
+        self.backlog.close()
+        logger.info("s3 stopped: %s", self.stats())
 
+    def stats(self) -> dict:
+        return {
+            "queue_size": self._queue.qsize(),
+            "queued": self.queued,
+            "uploaded": self.uploaded,
+            "skipped": self.skipped,
+            "existing": self.existing,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
 
     def handle_incident(self, icd):
         pass
 
     def handle_incident_dionaea_download_complete_unique(self, icd):
+        self.submit(self.s3_dest_folder + icd.md5hash, icd.file)
 
-        # Dionaea will upload unique samples to Amazon S3 bucket with Boto3 (AWS SDK Python)
-        # Create an S3 client
-        try:
-            self.s3 = boto3.client(
-                    's3',
-                    self.region_name,
-                    aws_access_key_id=self.access_key_id,
-                    aws_secret_access_key=self.secret_access_key,
-                    endpoint_url=self.endpoint_url or None,
-                    verify=self.verify)
-
-            # Uploads the given file using a Boto 3 managed uploader, which will split up large
-            # files automatically and upload parts in parallel.
-            self.s3.upload_file(icd.file, self.bucket_name, self.s3_dest_folder+icd.md5hash)
-            logger.info("File (MD5) uploaded to S3 bucket: {0}".format(icd.md5hash))
+    def submit(self, key: str, path: str) -> bool:
+        """
+        Add a file to the backlog and queue it. Called from the event loop, it never waits for S3.
+
+        :return: False if the file has already been uploaded or is queued
+        """
+        if key in self.uploaded_keys:
+            self.skipped += 1
+            return False
+        with self._lock:
+            if key in self._queued:
+                return False
+            self._queued.add(key)
+        self.backlog.add(key, path, time.time())
+        self._put(key, path, 0)
+        return True
+
+    def queue_due(self):
+        """
+        Queue the files of the backlog to upload now.
+        """
+        for key, path, attempts in self.backlog.due(time.time()):
+            with self._lock:
+                if key in self._queued:
+                    continue
+                self._queued.add(key)
+            self._put(key, path, attempts)
+
+    def _put(self, key: str, path: str, attempts: int):
+        if not self._running:
+            # Queued from the backlog as soon as the workers have been started
+            with self._lock:
+                self._queued.discard(key)
+            return
+        self.queued += 1
+        self._queue.put((key, path, attempts))
 
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            key, path, attempts = job
+            try:
+                self._upload(key, path, attempts)
+            except Exception:
+                logger.warning("Unable to upload %s to S3", key, exc_info=True)
+            finally:
+                with self._lock:
+                    self._queued.discard(key)
+
+    def _upload(self, key: str, path: str, attempts: int):
+        try:
+            if self.check_exists and self._exists(key):
+                logger.info("File (MD5) already in S3 bucket: {0}".format(key))
+                self.existing += 1
+            else:
+                # The managed uploader splits up large files and uploads the parts in parallel
+                self.s3.upload_file(path, self.bucket_name, key, Config=self.transfer_config)
+                logger.info("File (MD5) uploaded to S3 bucket: {0}".format(key))
+                self.uploaded += 1
+        except FileNotFoundError as e:
+            logger.warning("Unable to upload %s to S3: %s", key, e)
+            self.failed += 1
+            self.backlog.failed(key, attempts + 1, str(e))
+            return
         except Exception as e:
-            logger.warn("S3 exception: {0}".format(e))
+            attempts += 1
+            if attempts >= self.max_attempts:
+                logger.warning("Unable to upload %s to S3 after %d attempt(s): %s", key, attempts, e)
+                self.failed += 1
+                self.backlog.failed(key, attempts, str(e))
+                return
+            delay = min(self.retry_interval * 2 ** (attempts - 1), self.max_retry_interval)
+            logger.warning("Unable to upload %s to S3, retry in %d seconds: %s", key, delay, e)
+            self.retries += 1
+            self.backlog.retry(key, attempts, time.time() + delay, str(e))
+            return
+        self.uploaded_keys.add(key)
+        self.backlog.uploaded(key, time.time())
+
+    def _exists(self, key: str) -> bool:
+        try:
+            self.s3.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
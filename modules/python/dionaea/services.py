@@ -9,6 +9,7 @@ import fnmatch
 
 from dionaea.core import g_dionaea, ihandler
 from dionaea import ServiceLoader, load_config_from_files, load_submodules
+from dionaea.bistream import bistream_limits
 
 
 logger = logging.getLogger('services')
@@ -156,6 +157,7 @@ def new():
     load_submodules()
 
     module_config = g_dionaea.config().get("module")
+    bistream_limits.configure(module_config)
     filename_patterns = module_config.get("service_configs", [])
     g_service_configs = load_config_from_files(filename_patterns)
 
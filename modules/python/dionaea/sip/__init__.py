@@ -14,10 +14,10 @@ import logging
 import random
 import os
 import datetime
-import tempfile
 
-from dionaea.core import connection, g_dionaea, incident
+from dionaea.core import connection, incident
 from dionaea import Timer, ServiceLoader
+from dionaea.bistream import Bistream, bistream_limits
 
 from dionaea.sip.extras import msg_to_icd, SipConfig, ErrorWithResponse
 
@@ -147,8 +147,9 @@ class RtpUdpStream(connection):
         self.remote.host = remote_address
         self.remote.port = remote_port
 
-        self._bistream = []
-        self._bistream_enabled = bistream_enabled
+        self._bistream = None
+        if bistream_enabled:
+            self._bistream = Bistream()
 
         # Send byte buffer
         self.__sendBuffer = b''
@@ -169,25 +170,27 @@ class RtpUdpStream(connection):
         logger.debug("Closing stream dump (in)")
         connection.close(self)
 
-        if len(self._bistream) == 0:
+        if not self._bistream:
+            return
+
+        if not bistream_limits.dir:
+            logger.warning("Unable to save RTP stream, bistream.dir is not set")
+            self._bistream.close()
             return
 
         now = datetime.datetime.now()
         dirname = "%04i-%02i-%02i" % (now.year, now.month, now.day)
-        bistream_path = os.path.join(g_dionaea.config()['bistreams']['python']['dir'], dirname)
-        if not os.path.exists(bistream_path):
-            os.makedirs(bistream_path)
-
-        fp = tempfile.NamedTemporaryFile(
-            delete = False,
-            prefix = "SipCall-{local_port}-{remote_host}:{remote_port}-".format(
-                local_port = self.local.port, remote_host = self.remote.host,
-                remote_port = self.remote.port),
-            dir = bistream_path
-        )
-        fp.write(b"stream = ")
-        fp.write(str(self._bistream).encode())
-        fp.close()
+        bistream_path = os.path.join(bistream_limits.dir, dirname)
+        try:
+            self._bistream.save(
+                bistream_path,
+                prefix="SipCall-{local_port}-{remote_host}:{remote_port}-".format(
+                    local_port=self.local.port, remote_host=self.remote.host,
+                    remote_port=self.remote.port)
+            )
+        except OSError:
+            logger.warning("Unable to save RTP stream to %s", bistream_path, exc_info=True)
+        self._bistream.close()
 
     def handle_established(self):
         logger.debug("{!s} handle_established".format(self))
@@ -207,8 +210,8 @@ class RtpUdpStream(connection):
         logger.debug("{!s} handle_io_in".format(self))
         #logger.debug("Incoming RTP data (length {})".format(len(data)))
 
-        if self._bistream_enabled:
-            self._bistream.append(("in", data))
+        if self._bistream is not None:
+            self._bistream.append("in", data)
         if self._pcap is not None:
             self._pcap.write(src_port = self.remote.port, dst_port = self.local.port, data = data)
 
@@ -276,7 +279,7 @@ class SipCall(connection):
 
         self._timers["idle"].start()
 
-    def __handle_timeout_idle(self, watcher, events):
+    def __handle_timeout_idle(self):
         logger.debug("{!s} __handle_timeout_idle".format(self))
 
         # check if at least one rtp stream is active
@@ -444,7 +447,7 @@ class SipCall(connection):
             if timer is None:
                 continue
 
-            logger.debug("SipCall timer {} active {} pending {}".format(timer,timer.active,timer.pending))
+            logger.debug("SipCall timer {} active {}".format(timer, timer.active))
             #if timer.active == True or timer.pending == True:
             #    logger.warn("SipCall Stopping {}".format(name))
 
@@ -608,32 +611,30 @@ class SipSession(connection):
         logger.debug("{!s} handle_io_in".format(self))
 
         if self.transport == "udp":
-            # Header must be terminated by an empty line.
-            # If empty line is missing add it.
-            # This works only for sip over udp but not for sip over tcp,
-            # because one UDP package is exactly one sip message.
+            # One UDP package is exactly one sip message, the empty line at the end of the header is optional.
             # SIP-Servers like Asterisk do it the same way.
-            len_used = len(data)
-
-            if not b"\n\r\n" in data and not b"\n\n" in data:
-                data = data + b"\n\r\n"
-
-            # all lines must end with \r\n
-            data = data.replace(b"\r\n", b"\n")
-            data = data.replace(b"\n", b"\r\n")
             try:
-                msg = rfc3261.Message.froms(data, session=self)
+                (len_used, data_load) = rfc3261.Message.loads(data, session=self, datagram=True)
             except rfc3261.SipParsingError:
                 self.close()
-                return len_used
+                return len(data)
             except ErrorWithResponse as response:
                 self.send(response.create_response().dumps())
                 self.close()
-                return len_used
+                return len(data)
+
+            self._handle_message(rfc3261.Message(**data_load))
+            return len(data)
 
-        elif self.transport in ("tcp", "tls"):
+        # Handle all complete messages, clients may send the next request before the response has been received
+        offset = 0
+        while offset < len(data) and self._state != SipSession.CLOSED:
+            # Skip the empty lines used as keep-alive
+            if data[offset:offset + 1] in (b"\r", b"\n"):
+                offset += 1
+                continue
             try:
-                (len_used, data_load) = rfc3261.Message.loads(data, session=self)
+                (len_used, data_load) = rfc3261.Message.loads(data, session=self, offset=offset)
             except rfc3261.SipParsingError:
                 self.close()
                 return len(data)
@@ -644,18 +645,23 @@ class SipSession(connection):
 
             # this is not the complete message, wait for the rest
             if len_used == 0:
-                return 0
+                break
 
-            msg = rfc3261.Message(**data_load)
-            logger.debug("Got {} bytes, Used {} bytes".format(len(data), len_used))
+            offset += len_used
+            logger.debug("Got {} bytes, Used {} bytes".format(len(data), offset))
+            self._handle_message(rfc3261.Message(**data_load))
 
+        logger.debug("io_in: returning {}".format(offset))
+        return offset
+
+    def _handle_message(self, msg):
         msg.set_personality(self.personality)
 
         handler_name = msg.method.decode("utf-8").upper()
 
         if not self.config.is_handled_by_personality(handler_name, self.personality):
             self.handle_unknown(msg)
-            return len(data)
+            return
 
         logger.info("Received: {}".format(handler_name))
 
@@ -671,9 +677,6 @@ class SipSession(connection):
             else:
                 self.handle_unknown(msg)
 
-        logger.debug("io_in: returning {}".format(len_used))
-        return len_used
-
     def close(self):
         logger.debug("{!s} close".format(self))
         self._state = SipSession.CLOSED
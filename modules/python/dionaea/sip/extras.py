@@ -15,6 +15,7 @@ import re
 import sqlite3
 import struct
 import time
+from collections import OrderedDict
 
 logger = logging.getLogger('sip')
 logger.setLevel(logging.DEBUG)
@@ -99,6 +100,16 @@ class SipConfig(object):
             self._cur.execute("CREATE TABLE IF NOT EXISTS sdp (name STRING, sdp STRING)")
             self._cur.execute("INSERT INTO sdp (name, sdp) VALUES ('default', ?)", (DEFAULT_SDP,))
 
+        # Release the lock, the database is also opened by the connections of the clients
+        self._conn.commit()
+
+        self.user_db = UserDatabase(
+            self.users,
+            default_sdp=self._get_default_sdp,
+            cache_size=config.get("user_cache_size", 1024),
+            reload_interval=config.get("user_reload_interval", 1.0)
+        )
+
         # set default values
         self.personalities = {
             "default": {
@@ -174,47 +185,15 @@ class SipConfig(object):
         )
 
     def get_user_by_username(self, personality, username):
-        def regexp(expr, value):
-            if type(expr) != str:
-                expr = str(expr)
-            regex = re.compile(expr)
-            return regex.match(value) is not None
-
-        conn = sqlite3.connect(self.users)
-
-        sqlite3.enable_callback_tracebacks(True)
-        conn.create_function("regexp", 2, regexp)
-
         if username is None:
             username = b""
 
         username = username.decode("utf-8")
 
-        cur = conn.cursor()
-        cur.execute("SELECT username, password, pickup_delay_min, pickup_delay_max, action, sdp FROM users WHERE personality = ? AND ? REGEXP username", (personality, username))
-        row = cur.fetchone()
+        return self.user_db.get_user(personality, username)
 
-        if row is None:
-            return None
-
-        password = row[1]
-        if type(password) == int:
-            password = str(password)
-
-        # ToDo: sdp is not used! Recheck!!!
-        sdp = row[5]
-        if sdp == '' or sdp is None:
-            sdp = self.personalities[personality].default_sdp
-
-        return User(
-            username=username,
-            username_regex=row[0],
-            password=password,
-            pickup_delay_min=row[2],
-            pickup_delay_max=row[3],
-            action=row[4],
-            sdp=row[5]
-        )
+    def _get_default_sdp(self, personality):
+        return self.personalities.get(personality, self.personalities["default"])["default_sdp"]
 
     def get_personality_by_address(self, address):
         for pers_name, personality in self.personalities.items():
@@ -438,6 +417,132 @@ class Timer(object):
         self.timeout = kwargs.get("timeout", 30)
 
 
+class UserDatabase(object):
+    """
+    Match usernames against the users table of the SQLite database.
+
+    All rows are loaded and the regular expressions are compiled once. The table is loaded again if the file has
+    been modified, the file is checked at most once per reload interval. The results of the lookups are kept in a
+    LRU cache.
+
+    :param filename: The SQLite database with the users table
+    :param default_sdp: Function to get the name of the default SDP of a personality
+    :param cache_size: Max number of cached lookups
+    :param reload_interval: Min time in seconds between two checks of the file
+    """
+    def __init__(self, filename, default_sdp=None, cache_size=1024, reload_interval=1.0):
+        self.filename = filename
+        self.default_sdp = default_sdp
+        self.cache_size = max(0, int(cache_size))
+        self.reload_interval = float(reload_interval)
+        self.hits = 0
+        self.misses = 0
+        self._users = {}
+        self._cache = OrderedDict()
+        self._file_key = None
+        self._next_check = 0.0
+
+    def _stat(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _check(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+        file_key = self._stat()
+        if file_key == self._file_key:
+            return
+        self.load()
+        self._file_key = file_key
+
+    def load(self):
+        """
+        Load all users from the database.
+        """
+        users = {}
+        conn = sqlite3.connect(self.filename)
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT username, password, personality, pickup_delay_min, pickup_delay_max, action, sdp FROM users "
+                "ORDER BY rowid"
+            )
+            for row in cur:
+                username_regex = row[0]
+                if type(username_regex) != str:
+                    username_regex = str(username_regex)
+                try:
+                    regex = re.compile(username_regex)
+                except re.error:
+                    logger.warning("Unable to compile username pattern '%s'", username_regex)
+                    continue
+                users.setdefault(row[2], []).append((regex, row))
+        finally:
+            conn.close()
+
+        self._users = users
+        self._cache.clear()
+        logger.info("Loaded %d SIP users from %s", sum(len(v) for v in users.values()), self.filename)
+
+    def get_user(self, personality, username):
+        """
+        Get the first user of the personality matching the username.
+
+        :param personality: Name of the personality
+        :param username: The username
+        :type username: str
+        :return: The user or None
+        """
+        self._check()
+
+        key = (personality, username)
+        try:
+            user = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return user
+        self.misses += 1
+
+        user = None
+        for regex, row in self._users.get(personality, ()):
+            if regex.match(username) is not None:
+                user = self._create_user(personality, username, row)
+                break
+
+        if self.cache_size > 0:
+            self._cache[key] = user
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user
+
+    def _create_user(self, personality, username, row):
+        password = row[1]
+        if type(password) == int:
+            password = str(password)
+
+        sdp = row[6]
+        if (sdp == '' or sdp is None) and self.default_sdp is not None:
+            sdp = self.default_sdp(personality)
+
+        return User(
+            username=username,
+            username_regex=row[0],
+            password=password,
+            pickup_delay_min=row[3],
+            pickup_delay_max=row[4],
+            action=row[5],
+            sdp=sdp
+        )
+
+
 class User(object):
     def __init__(self, **kwargs):
         self.realm = kwargs.get("realm", "test")
@@ -540,5 +645,4 @@ def msg_to_icd(msg, d=None):
         d.set('user_agent', msg.headers.get('user-agent')._value)
     else:
         d.set('user_agent',None)
-    print(d)
     return d
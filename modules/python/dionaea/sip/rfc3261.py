@@ -18,6 +18,8 @@ except:
 logger = logging.getLogger('sip')
 logger.setLevel(logging.DEBUG)
 
+_end_of_head = re.compile(b"\r?\n\r?\n")
+
 # For more information see RFC3261 Section: 21 Response Codes
 # http://tools.ietf.org/html/rfc3261#section-21
 
@@ -358,13 +360,40 @@ class Headers(object):
             if header.name in self._single:
                 self._headers[header.name] = header
             elif header.name in self._headers:
-                self._headers[header.name].append(header)
+                self._get(header.name).append(header)
             else:
                 self._headers[header.name] = [header]
 
+    def append_raw(self, name, value):
+        """
+        Append the raw value of a header, it is only parsed if the header is accessed.
+
+        :param name: The lower case long name of the header
+        :param value: The value without leading and trailing whitespace
+        """
+        values = self._headers.get(name)
+        if type(values) == _RawValues:
+            values.append(value)
+        elif values is None or name in self._single:
+            self._headers[name] = _RawValues((value,))
+        else:
+            self._get(name).append(Header.froms(value, name))
+
+    def _get(self, name):
+        value = self._headers[name]
+        if type(value) != _RawValues:
+            return value
+
+        if name in self._single:
+            value = Header.froms(value[-1], name)
+        else:
+            value = [Header.froms(v, name) for v in value]
+        self._headers[name] = value
+        return value
+
     def dump_list(self):
         ret = []
-        for name, header in self._headers.items():
+        for name, header in self.items():
             if not type(header) == list:
                 header = [header]
             for h in header:
@@ -380,12 +409,20 @@ class Headers(object):
         if name not in self._headers:
             return default
 
-        return self._headers[name]
+        return self._get(name)
 
     def items(self):
+        for name in list(self._headers):
+            self._get(name)
         return self._headers.items()
 
 
+class _RawValues(list):
+    """
+    Raw values of a header not parsed so far.
+    """
+
+
 class Message(object):
     """
     >>> s = b'ACK sip:alice@example.org SIP/2.0\\r\\n'
@@ -558,40 +595,49 @@ class Message(object):
         return True
 
     @classmethod
-    def loads(cls, data, session=None):
+    def loads(cls, data, session=None, offset=0, datagram=False):
         """
         Parse a SIP-Message and return the used bytes
 
+        The data is scanned once, lines may end with CRLF or LF. The headers are only parsed if they are accessed.
+
+        :param data: The data
+        :param offset: Start of the message in the data, e.g. to parse pipelined messages without copying the data
+        :param datagram: The data is exactly one message, the empty line after the header is optional
         :return: bytes used
         """
+        if type(data) == str:
+            data = bytes(data, "utf-8")
+
         # End Of Head
-        if type(data) == bytes:
-            pos = re.search(b"\r?\n\r?\n", data)
+        pos = _end_of_head.search(data, offset)
+        if pos is not None:
+            head_end = pos.start()
+            body_start = pos.end()
+        elif datagram:
+            # Header must be terminated by an empty line, but SIP servers like Asterisk accept it without
+            head_end = len(data)
+            body_start = len(data)
         else:
-            pos = re.search("\r?\n\r?\n", data)
-
-        if pos is None:
             return (0, {})
 
         # length of used data
-        l = pos.end()
+        l = body_start - offset
 
-        # header without empty line
-        header = data[:pos.start()]
-        headers_data = re.split(b"\r?\n", header)
-
-        # body without empty line
-        body = data[pos.end():]
+        line_end = data.find(b"\n", offset, head_end)
+        if line_end == -1:
+            line_end = head_end
+        first_line = data[offset:line_end].rstrip(b"\r")
 
         # remove first line and parse it
         try:
-            h1, h2, h3 = headers_data[0].split(b" ", 2)
+            h1, h2, h3 = first_line.split(b" ", 2)
         except:
-            logger.warning("Can't parse first line of sip message: %s", repr(headers_data[0])[:128])
+            logger.warning("Can't parse first line of sip message: %s", repr(first_line)[:128])
             raise SipParsingError
 
-        del headers_data[0]
-
+        method = None
+        uri = None
         response_code = None
         status_message = None
         try:
@@ -601,9 +647,27 @@ class Message(object):
 
         # ToDo: check protocol
         headers = Headers()
-        for h in headers_data:
-            header = Header.froms(h)
-            headers.append(header)
+        name = None
+        value = None
+        for line in data[line_end + 1:head_end].split(b"\n"):
+            if line == b"" or line == b"\r":
+                # only at the end of a datagram without empty line
+                continue
+            if line[:1] in (b" ", b"\t") and name is not None:
+                # folded header line
+                value = value + b" " + line.strip()
+                continue
+            if name is not None:
+                headers.append_raw(name, value)
+            name, sep, value = line.partition(b":")
+            if not sep:
+                logger.warning("Can't parse header line of sip message: %s", repr(line)[:128])
+                raise SipParsingError
+            name = name.strip().lower()
+            name = Header._header_compact2long.get(name, name)
+            value = value.strip()
+        if name is not None:
+            headers.append_raw(name, value)
 
         sdp = None
         try:
@@ -611,30 +675,37 @@ class Message(object):
         except:
             content_length = None
 
-        if content_length is not None:
-            if content_length <=  len(body):
-                content = body[:content_length]
-
-                content_type = headers.get(b"content-type", None)
-                if content_type is not None and content_type.value.lower().strip() == b"application/sdp":
-                    try:
-                        sdp = rfc4566.SDP.froms(content)
-                    except rfc4566.SdpParsingError:
-                        msg = Message(**{
-                            "session": session,
-                            "method": method,
-                            "uri": uri,
-                            "response_code": response_code,
-                            "status_message": status_message,
-                            "protocol": protocol,
-                            "body": body,
-                            "headers": headers
-                        })
-                        raise ErrorWithResponse(msg, BAD_REQUEST, "Invalid SIP body")
-
-                l += content_length
-            else:
-                logger.info("Body is to short than the given content-length: Content-Length %d, Body %d", content_length, len(body))
+        if content_length is None:
+            # Without Content-Length a stream can not be parsed, a datagram ends with the body
+            body = data[body_start:] if datagram else b""
+        elif content_length <= len(data) - body_start:
+            body = data[body_start:] if datagram else data[body_start:body_start + content_length]
+            content = data[body_start:body_start + content_length]
+
+            content_type = headers.get(b"content-type", None)
+            if content_type is not None and content_type.value.lower().strip() == b"application/sdp":
+                try:
+                    sdp = rfc4566.SDP.froms(content)
+                except rfc4566.SdpParsingError:
+                    msg = Message(**{
+                        "session": session,
+                        "method": method,
+                        "uri": uri,
+                        "response_code": response_code,
+                        "status_message": status_message,
+                        "protocol": protocol,
+                        "body": body,
+                        "headers": headers
+                    })
+                    raise ErrorWithResponse(msg, BAD_REQUEST, "Invalid SIP body")
+
+            l += content_length
+        elif datagram:
+            body = data[body_start:]
+            logger.info("Body is to short than the given content-length: Content-Length %d, Body %d", content_length, len(body))
+        else:
+            # wait for the rest of the body
+            return (0, {})
 
         return (
             l,
@@ -678,7 +749,7 @@ class Via(object):
     b'z9hG4bK77asjd' b'192.0.2.207'
     """
 
-    _syntax = re.compile(r"SIP */ *2\.0 */ *(?P<protocol>[a-zA-Z]+) *(?P<address>[^ :;]*) *(:(?P<port>[0-9]+))?( *; *(?P<params>.*))?")
+    _syntax = re.compile(rb"SIP */ *2\.0 */ *(?P<protocol>[a-zA-Z]+) *(?P<address>[^ :;]*) *(:(?P<port>[0-9]+))?( *; *(?P<params>.*))?")
 
     def __init__(self, protocol = None, address = None, port = None, params = None):
         if params is None:
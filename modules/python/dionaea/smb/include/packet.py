@@ -13,15 +13,125 @@
 import time
 import itertools
 import logging
+import struct
 
 logger = logging.getLogger('scapy')
 logger.setLevel(logging.DEBUG)
 
 
-from .fieldtypes import StrField,ConditionalField,Emph
+from .fieldtypes import Field,StrField,ConditionalField,Emph
 from .helpers import VolatileValue, Gen, SetGen, BasePacket
 
 
+#######################
+## Compiled layouts  ##
+#######################
+
+# struct format characters of fields that can be packed and unpacked together
+_struct_fmt_chars = "bBhHiIlLqQ"
+
+
+class FieldRun:
+    """A run of consecutive fixed size fields packed and unpacked with one struct.Struct"""
+    __slots__ = ("fields", "names", "struct", "size")
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.names = tuple(f.name for f in fields)
+        byteorder = fields[0].fmt[0]
+        if byteorder == "!":
+            byteorder = ">"
+        self.struct = struct.Struct(byteorder + "".join(f.fmt[1:] for f in fields))
+        self.size = self.struct.size
+
+
+def _struct_byteorder(f):
+    """Return the byte order of a field that only uses the default conversions of Field, None otherwise"""
+    t = type(f)
+    if not isinstance(f, Field):
+        return None
+    if t.getfield is not Field.getfield or t.addfield is not Field.addfield:
+        return None
+    if t.m2i is not Field.m2i or t.i2m is not Field.i2m:
+        return None
+    if len(f.fmt) != 2 or f.fmt[1] not in _struct_fmt_chars:
+        return None
+    if f.fmt[0] in "!>":
+        return ">"
+    if f.fmt[0] == "<":
+        return "<"
+    return None
+
+
+def compile_layout(fields_desc):
+    """
+    Compile the fields of a packet class into a list of fields and runs of fixed size fields.
+
+    :param fields_desc: The fields of the packet
+    :return: List of Field and FieldRun objects
+    """
+    layout = []
+    run = []
+    run_byteorder = None
+    for f in fields_desc:
+        byteorder = _struct_byteorder(f)
+        if byteorder is not None and (not run or byteorder == run_byteorder):
+            run.append(f)
+            run_byteorder = byteorder
+            continue
+        if len(run) > 1:
+            layout.append(FieldRun(run))
+        else:
+            layout.extend(run)
+        run = []
+        if byteorder is not None:
+            run.append(f)
+            run_byteorder = byteorder
+        else:
+            layout.append(f)
+    if len(run) > 1:
+        layout.append(FieldRun(run))
+    else:
+        layout.extend(run)
+    return layout
+
+
+# Attributes of a packet instance that are not fields. They are set without searching the layers for a field with the
+# same name, names of fields are removed by the metaclass.
+_instance_attrs = {
+    "aliastypes", "ctx", "default_fields", "explicit", "fields", "fieldtype", "initialized", "name",
+    "overload_fields", "overloaded_fields", "packetfields", "post_transforms", "sent_time", "time", "underlayer",
+}
+
+
+_immutable_types = (int, bytes, str, bool, float)
+
+
+def _is_volatile(v):
+    return isinstance(v, (Gen, VolatileValue))
+
+
+def _compile_packet_class(cls):
+    """Precompute the lookup tables and the struct layout of a packet class"""
+    fields_desc = cls.fields_desc
+    cls._default_fields = {}
+    cls._fieldtype = {}
+    cls._packetfields = []
+    for f in fields_desc:
+        _instance_attrs.discard(f.name)
+        cls._default_fields[f.name] = f.default
+        cls._fieldtype[f.name] = f
+        if f.holds_packets:
+            cls._packetfields.append(f)
+    # name -> index of the first field with this name
+    cls._field_index = {}
+    for i, f in enumerate(fields_desc):
+        cls._field_index.setdefault(f.name, i)
+    cls._aliastypes = [cls] + cls.aliastypes
+    cls._volatile_defaults = any(_is_volatile(v) for v in cls._default_fields.values())
+    cls._layout = compile_layout(fields_desc)
+
+
 ######################################
 ## Packet abstract and base classes ##
 ######################################
@@ -62,20 +172,19 @@ class Packet_metaclass(type):
             newcls.register_variant()
         for f in newcls.fields_desc:
             f.register_owner(newcls)
+        _compile_packet_class(newcls)
         return newcls
 
     def __getattr__(self, attr):
-        for k in self.fields_desc:
-            if k.name == attr:
-                return k
-        raise AttributeError(attr)
+        index = self.__dict__.get("_field_index", {}).get(attr)
+        if index is None:
+            raise AttributeError(attr)
+        return self.fields_desc[index]
 
     def __call__(cls, *args, **kargs):
         if "dispatch_hook" in cls.__dict__:
             cls =  cls.dispatch_hook(*args, **kargs)
-        i = cls.__new__(cls, cls.__name__, cls.__bases__, cls.__dict__)
-        i.__init__(*args, **kargs)
-        return i
+        return type.__call__(cls, *args, **kargs)
 
 class Packet(BasePacket, metaclass=Packet_metaclass):
     name=None
@@ -105,22 +214,24 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
                                                            ("%s=%r"%i) for i in fval.items())))
 
     def __init__(self, _pkt="", _ctx=None, post_transform=None, _internal=0, _underlayer=None, **fields):
+        # Write to __dict__ directly, __setattr__ is only needed for fields
+        d = self.__dict__
         if _ctx:
-            self.ctx = _ctx
-        self.time  = time.time()
-        self.sent_time = 0
+            d["ctx"] = _ctx
+        d["time"] = time.time()
+        d["sent_time"] = 0
         if self.name is None:
-            self.name = self.__class__.__name__
-        self.aliastypes = [ self.__class__ ] + self.aliastypes
-        self.default_fields = {}
-        self.overloaded_fields = {}
-        self.fields={}
-        self.fieldtype={}
-        self.packetfields=[]
-        self.__dict__["payload"] = NoPayload()
+            d["name"] = self.__class__.__name__
+        d["aliastypes"] = self._aliastypes
+        d["default_fields"] = {}
+        d["overloaded_fields"] = {}
+        d["fields"] = {}
+        d["fieldtype"] = {}
+        d["packetfields"] = []
+        d["payload"] = NoPayload()
         self.init_fields()
-        self.underlayer = _underlayer
-        self.initialized = 1
+        d["underlayer"] = _underlayer
+        d["initialized"] = 1
         if _pkt:
             self.dissect(_pkt)
             if not _internal:
@@ -128,15 +239,19 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
         for f in list(fields.keys()):
             self.fields[f] = self.get_field(f).any2i(self,fields[f])
         if type(post_transform) is list:
-            self.post_transforms = post_transform
+            d["post_transforms"] = post_transform
         elif post_transform is None:
-            self.post_transforms = []
+            d["post_transforms"] = []
         else:
-            self.post_transforms = [post_transform]
+            d["post_transforms"] = [post_transform]
 
 
     def init_fields(self):
-        self.do_init_fields(self.fields_desc)
+        # The tables are precomputed by the metaclass, fieldtype and packetfields are never modified
+        d = self.__dict__
+        d["default_fields"] = self._default_fields.copy()
+        d["fieldtype"] = self._fieldtype
+        d["packetfields"] = self._packetfields
 
     def do_init_fields(self, flist):
         for f in flist:
@@ -189,8 +304,10 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
         """Returns a deep copy of the instance."""
         clone = self.__class__()
         clone.fields = self.fields.copy()
-        for k in clone.fields:
-            clone.fields[k]=self.get_field(k).do_copy(clone.fields[k])
+        for k, v in clone.fields.items():
+            # immutable values do not need to be copied
+            if v.__class__ not in _immutable_types:
+                clone.fields[k]=self.get_field(k).do_copy(v)
         clone.default_fields = self.default_fields.copy()
         clone.overloaded_fields = self.overloaded_fields.copy()
         clone.overload_fields = self.overload_fields.copy()
@@ -221,7 +338,15 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
 
     def __getattr__(self, attr):
         if self.initialized:
-            fld,v = self.getfield_and_val(attr)
+            # inlined getfield_and_val() for the fields of this layer
+            fields = self.fields
+            if attr in fields:
+                return self.fieldtype[attr].i2h(self, fields[attr])
+            if attr in self.overloaded_fields:
+                return self.fieldtype[attr].i2h(self, self.overloaded_fields[attr])
+            if attr in self.default_fields:
+                return self.fieldtype[attr].i2h(self, self.default_fields[attr])
+            fld,v = self.payload.getfield_and_val(attr)
             if fld is not None:
                 return fld.i2h(self, v)
             return v
@@ -243,6 +368,9 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
             self.payload.setfieldval(attr,val)
 
     def __setattr__(self, attr, val):
+        if attr in _instance_attrs:
+            self.__dict__[attr] = val
+            return
         if self.initialized:
             try:
                 self.setfieldval(attr,val)
@@ -326,8 +454,23 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
         return len(self.build())
     def do_build(self):
         p=b''
-        for f in self.fields_desc:
-            p = f.addfield(self, p, self.getfieldval(f.name))
+        fields = self.fields
+        overloaded_fields = self.overloaded_fields
+        default_fields = self.default_fields
+        for f in self._layout:
+            if f.__class__ is FieldRun:
+                values = []
+                for name in f.names:
+                    if name in fields:
+                        v = fields[name]
+                    elif name in overloaded_fields:
+                        v = overloaded_fields[name]
+                    else:
+                        v = default_fields[name]
+                    values.append(0 if v is None else v)
+                p += f.struct.pack(*values)
+            else:
+                p = f.addfield(self, p, self.getfieldval(f.name))
         return p
 
     def post_build(self, pkt, pay):
@@ -337,9 +480,33 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
     def build_payload(self):
         return self.payload.build(internal=1)
 
+    def _build_clone(self):
+        """
+        Return the same packet as next(iter(self)), but without the generators if no field holds a generator or a
+        volatile value.
+        """
+        if self._volatile_defaults:
+            return next(self.__iter__())
+        for v in self.overloaded_fields.values():
+            if _is_volatile(v):
+                return next(self.__iter__())
+        fieldtype = self.fieldtype
+        for k, v in self.fields.items():
+            if _is_volatile(v):
+                return next(self.__iter__())
+            if not fieldtype[k].islist and type(v) in (list, tuple):
+                return next(self.__iter__())
+
+        payload = self.payload
+        if isinstance(payload, NoPayload):
+            payload = None
+        else:
+            payload = payload._build_clone()
+        return self.clone_with(payload=payload, **self.fields)
+
     def build(self,internal=0):
         if not self.explicit:
-            self = next(self.__iter__())
+            self = self._build_clone()
         pkt = self.do_build()
         for t in self.post_transforms:
             pkt = t(pkt)
@@ -368,13 +535,24 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
         return s
 
     def do_dissect(self, s):
-        flist = self.fields_desc[:]
-        flist.reverse()
-        while s and flist:
-            #print('DEBUG:', repr(self), s)
-            f = flist.pop()
+        fields = self.fields
+        for f in self._layout:
+            if not s:
+                break
+            if f.__class__ is FieldRun:
+                if len(s) >= f.size:
+                    fields.update(zip(f.names, f.struct.unpack_from(s)))
+                    s = s[f.size:]
+                    continue
+                # not enough data, dissect field by field until the data is exhausted
+                for f2 in f.fields:
+                    if not s:
+                        break
+                    s,fval = f2.getfield(self, s)
+                    fields[f2.name] = fval
+                continue
             s,fval = f.getfield(self, s)
-            self.fields[f.name] = fval
+            fields[f.name] = fval
         return s
 
     def do_dissect_payload(self, s):
@@ -618,13 +796,16 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
     def display(self,*args,**kargs):  # Deprecated. Use show()
         """Deprecated. Use show() method."""
         self.show(*args,**kargs)
-    def show(self, indent=3, lvl="", label_lvl="", goff=0):
-        """Prints a hierarchical view of the packet. "indent" gives the size of indentation for each layer."""
+    def show(self, indent=3, lvl="", label_lvl="", goff=0, log=None):
+        """Prints a hierarchical view of the packet. "indent" gives the size of indentation for each layer.
+"log" is the function to log the lines, by default the debug method of the scapy logger."""
 #        return
-        logger.debug("%s%s %s sizeof(%i) %s " % (label_lvl,
-                                                 "###[",
-                                                 self.name, self.size(),
-                                                 "]###"))
+        if log is None:
+            log = logger.debug
+        log("%s%s %s sizeof(%i) %s " % (label_lvl,
+                                        "###[",
+                                        self.name, self.size(),
+                                        "]###"))
         off=0
         for f in self.fields_desc:
             size = 0
@@ -632,26 +813,26 @@ class Packet(BasePacket, metaclass=Packet_metaclass):
                 continue
             fvalue = self.getfieldval(f.name)
             if isinstance(fvalue, Packet) or (f.islist and f.holds_packets and type(fvalue) is list):
-                logger.debug("%s  \\%-10s\\" % (label_lvl+lvl, f.name))
+                log("%s  \\%-10s\\" % (label_lvl+lvl, f.name))
                 fvalue_gen = SetGen(fvalue,_iterpacket=0)
                 for fvalue in fvalue_gen:
                     size = fvalue.size()
                     fvalue.show(
-                        indent=indent, label_lvl=label_lvl+lvl+"   |", goff=goff)
+                        indent=indent, label_lvl=label_lvl+lvl+"   |", goff=goff, log=log)
             else:
                 size = f.size(self,fvalue)
-                logger.debug("%s  %-20s%s %-15s sizeof(%3i) off=%3i goff=%3i" % (label_lvl+lvl,
-                                                                                 f.name,
-                                                                                 "=",
-                                                                                 f.i2repr(
-                                                                                     self,fvalue),
-                                                                                 size,
-                                                                                 off,
-                                                                                 goff))
+                log("%s  %-20s%s %-15s sizeof(%3i) off=%3i goff=%3i" % (label_lvl+lvl,
+                                                                        f.name,
+                                                                        "=",
+                                                                        f.i2repr(
+                                                                            self,fvalue),
+                                                                        size,
+                                                                        off,
+                                                                        goff))
             off += size
             goff +=size
         self.payload.show(
-            indent=indent, lvl=lvl+(" "*indent*self.show_indent), label_lvl=label_lvl, goff=goff)
+            indent=indent, lvl=lvl+(" "*indent*self.show_indent), label_lvl=label_lvl, goff=goff, log=log)
     def show2(self):
         """Prints a hierarchical view of an assembled version of the packet, so that automatic fields are calculated (checksums, etc.)"""
         self.__class__(self.build()).show()
@@ -886,7 +1067,7 @@ class NoPayload(Packet):
         return None
     def fragment(self, *args, **kargs):
         raise Exception("cannot fragment this packet")
-    def show(self, indent=3, lvl="", label_lvl="", goff=0):
+    def show(self, indent=3, lvl="", label_lvl="", goff=0, log=None):
         pass
     def sprintf(self, fmt, relax):
         if relax:
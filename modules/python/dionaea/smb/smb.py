@@ -26,6 +26,7 @@ from .include.packet import Raw
 from .include.asn1.ber import BER_len_dec, BER_len_enc, BER_identifier_dec
 from .include.asn1.ber import BER_CLASS_APP, BER_CLASS_CON,BER_identifier_enc
 from .include.asn1.ber import BER_Exception
+from dionaea.trace import PacketTrace
 from dionaea.util import calculate_doublepulsar_opcode, xor
 
 
@@ -47,8 +48,11 @@ def register_rpc_service(service):
 
 class smbd(connection):
     shared_config_values = [
-        "config"
+        "config",
+        "packet_trace"
     ]
+    packet_trace = PacketTrace("smbd")
+    io_in_framing = "netbios"
 
     def __init__ (self, proto="tcp", config=None):
         connection.__init__(self,"tcp")
@@ -69,6 +73,7 @@ class smbd(connection):
         # Avoid import loops
         from .extras import SmbConfig
         self.config = SmbConfig(config=config)
+        self.packet_trace = PacketTrace.from_config("smbd", config)
         # Set the global OS_TYPE value
         # ToDo: This is a quick and dirty hack
         from . import rpcservices
@@ -108,7 +113,7 @@ class smbd(connection):
             self.close()
             return len(data)
 
-        p.show()
+        self.packet_trace.trace("in", p, data)
         r = None
 
         # this is one of the things you have to love, it violates the spec, but
@@ -118,14 +123,12 @@ class smbd(connection):
             p.getlayer(SMB_Header).decode_payload_as(
                 SMB_Sessionsetup_AndX_Request2)
             x = p.getlayer(SMB_Sessionsetup_AndX_Request2)
-            x.show()
+            self.packet_trace.trace("in", x)
 
         r = self.process(p)
-        smblog.debug("packet: %s" % p.summary())
 
         if p.haslayer(Raw):
             smblog.warning("p.haslayer(Raw): %s" % p.getlayer(Raw).build())
-            p.show()
 
 #		i = incident("dionaea.module.python.smb.info")
 #		i.con = self
@@ -138,8 +141,8 @@ class smbd(connection):
             return len(data)
 
         if r:
-            smblog.debug("response: %s" % r.summary())
-            r.show()
+            buf = r.build()
+            self.packet_trace.trace("out", r, buf)
 
 #			i = incident("dionaea.module.python.smb.info")
 #			i.con = self
@@ -149,13 +152,12 @@ class smbd(connection):
 
 #			r.build()
             #r.show2()
-            self.send(r.build())
+            self.send(buf)
         else:
             smblog.error('process() returned None.')
 
         if p.haslayer(Raw):
             smblog.warning("p.haslayer(Raw): %s" % p.getlayer(Raw).build())
-            p.show()
             # some rest seems to be not parsed correctly
             # could be start of some other packet, junk, or failed packet dissection
             # TODO: recover from this...
@@ -210,7 +212,7 @@ class smbd(connection):
                 if sb.startswith(b"NTLMSSP"):
                     # GSS-SPNEGO without OID
                     ntlmssp = NTLMSSP_Header(sb)
-                    ntlmssp.show()
+                    self.packet_trace.trace("in", ntlmssp)
                     # FIXME what is a proper reply?
                     # currently there windows calls Sessionsetup_AndX2_request
                     # after this one with bad reply
@@ -227,7 +229,7 @@ class smbd(connection):
 
                         rntlmchallenge.ServerChallenge = b"\xa4\xdf\xe8\x0b\xf5\xc6\x1e\x3a"
                         rntlmssp = rntlmssp / rntlmchallenge
-                        rntlmssp.show()
+                        self.packet_trace.trace("out", rntlmssp)
                         raw = rntlmssp.build()
                         r.SecurityBlob = raw
                         rstatus = 0xc0000016 # STATUS_MORE_PROCESSING_REQUIRED
@@ -254,7 +256,7 @@ class smbd(connection):
                         cls,pc,tag,sb = BER_identifier_dec(sb)
                         l,sb = BER_len_dec(sb)
                         spnego = SPNEGO(sb)
-                        spnego.show()
+                        self.packet_trace.trace("in", spnego)
                         sb = spnego.NegotiationToken.mechToken.__str__()
                         try:
                             cls,pc,tag,sb = BER_identifier_dec(sb)
@@ -263,7 +265,7 @@ class smbd(connection):
                             return rp
                         l,sb = BER_len_dec(sb)
                         ntlmssp = NTLMSSP_Header(sb)
-                        ntlmssp.show()
+                        self.packet_trace.trace("in", ntlmssp)
                         if ntlmssp.MessageType == 1:
                             r.Action = 0
                             ntlmnegotiate = ntlmssp.getlayer(NTLM_Negotiate)
@@ -277,7 +279,7 @@ class smbd(connection):
 #								rntlmchallenge.TargetNameFields.MaxLen = 0x1E
                             rntlmchallenge.ServerChallenge = b"\xa4\xdf\xe8\x0b\xf5\xc6\x1e\x3a"
                             rntlmssp = rntlmssp / rntlmchallenge
-                            rntlmssp.show()
+                            self.packet_trace.trace("out", rntlmssp)
                             negtokentarg = NegTokenTarg(
                                 negResult=1,supportedMech='1.3.6.1.4.1.311.2.2.10')
                             negtokentarg.responseToken = rntlmssp.build()
@@ -294,10 +296,10 @@ class smbd(connection):
                         # reply
                         # \xa1 BER_length NegTokenTarg('accepted')
                         negtokentarg = NegTokenTarg(sb)
-                        negtokentarg.show()
+                        self.packet_trace.trace("in", negtokentarg)
                         ntlmssp = NTLMSSP_Header(
                             negtokentarg.responseToken.val)
-                        ntlmssp.show()
+                        self.packet_trace.trace("in", ntlmssp)
                         rnegtokentarg = NegTokenTarg(
                             negResult=0, supportedMech=None)
                         raw = rnegtokentarg.build()
@@ -470,7 +472,7 @@ class smbd(connection):
                     if inpacket.FragLen == len(self.buf):
                         outpacket = self.process_dcerpc_packet(self.buf)
                         if outpacket is not None:
-                            outpacket.show()
+                            self.packet_trace.trace("out", outpacket)
                             self.outbuf = outpacket.build()
                         self.buf = b''
         elif Command == SMB_COM_WRITE:
@@ -536,7 +538,7 @@ class smbd(connection):
                 # [MS-RAP].pdf - Remote Administration Protocol
                 rapbuf = bytes(h.Param)
                 rap = RAP_Request(rapbuf)
-                rap.show()
+                self.packet_trace.trace("in", rap)
                 rout = RAP_Response()
                 coff = 0
                 if rap.Opcode == RAP_OP_NETSHAREENUM:
@@ -561,7 +563,7 @@ class smbd(connection):
                                                     0x0101) # RemarkOffsetHigh
                         comments.append(__shares__[i]['comment'])
                         coff += len(__shares__[i]['comment']) + 1
-                    rout.show()
+                    self.packet_trace.trace("out", rout)
                 outpacket = rout
                 self.outbuf = outpacket.build()
                 dceplen = len(self.outbuf) + coff
@@ -701,7 +703,6 @@ class smbd(connection):
             rstatus = 0x00000000  # STATUS_SUCCESS
         else:
             smblog.error('...unknown SMB Command. bailing out.')
-            p.show()
 
         if r:
             smbh = SMB_Header(Status=rstatus)
@@ -726,6 +727,24 @@ class smbd(connection):
             self.state['lastcmd'] = "UNKNOWN"
         return rp
 
+    @staticmethod
+    def _is_valid_dcerpc_packet(dcep):
+        """
+        Check the fields used to answer a DCERPC packet, so malformed packets are dropped before they are processed.
+        """
+        try:
+            if dcep.PacketType == 11: #bind
+                for item in dcep.CtxItems:
+                    if len(item.UUID) != 16 or len(item.TransferSyntax) != 16:
+                        return False
+                    if not isinstance(item.TransferSyntaxVersion, int):
+                        return False
+            elif dcep.PacketType == 0: #request
+                return isinstance(dcep.OpNum, int)
+        except Exception:
+            return False
+        return True
+
     def process_dcerpc_packet(self, buf):
         if not isinstance(buf, DCERPC_Header):
             smblog.debug("got buf, make DCERPC_Header")
@@ -735,15 +754,10 @@ class smbd(connection):
 
         outbuf = None
 
-        smblog.debug("data")
-        try:
-            dcep.show()
-        except:
+        self.packet_trace.trace("in", dcep)
+        if not self._is_valid_dcerpc_packet(dcep):
+            smblog.debug("Malformed DCERPC packet, dropping it")
             return None
-        if dcep.AuthLen > 0:
-            #			print(dcep.getlayer(Raw).underlayer.load)
-            #			dcep.getlayer(Raw).underlayer.decode_payload_as(DCERPC_Auth_Verfier)
-            dcep.show()
 
         if dcep.PacketType == 11: #bind
             outbuf = DCERPC_Header()/DCERPC_Bind_Ack()
@@ -786,8 +800,7 @@ class smbd(connection):
                 c += 1
             outbuf.NumCtxItems = c
             outbuf.FragLen = len(outbuf.build())
-            smblog.debug("dce reply")
-            outbuf.show()
+            self.packet_trace.trace("out", outbuf)
         elif dcep.PacketType == 0: #request
             resp = None
             if 'uuid' in self.state:
@@ -820,6 +833,8 @@ class smbd(connection):
         return 0
 
 class epmapper(smbd):
+    io_in_framing = None
+
     def __init__ (self):
         connection.__init__(self,"tcp")
         smbd.__init__(self)
@@ -836,7 +851,7 @@ class epmapper(smbd):
             smblog.warning("epmapper - not enough data")
             return 0
 
-        smblog.debug("packet: %s" % p.summary())
+        self.packet_trace.trace("in", p, data)
 
         r = self.process_dcerpc_packet(p)
 
@@ -848,13 +863,12 @@ class epmapper(smbd):
             smblog.error('dcerpc processing failed. bailing out.')
             return len(data)
 
-        smblog.debug("response: %s" % r.summary())
-        r.show()
-        self.send(r.build())
+        buf = r.build()
+        self.packet_trace.trace("out", r, buf)
+        self.send(buf)
 
         if p.haslayer(Raw):
             smblog.warning("p.haslayer(Raw): %s" % p.getlayer(Raw).build())
-            p.show()
 
         return len(data)
 
@@ -6,8 +6,9 @@
 
 from dionaea import IHandlerLoader
 from dionaea.core import ihandler, incident, g_dionaea
+from dionaea.digest import ALGORITHMS, file_hasher
+from dionaea.download_store import LAYOUTS, DownloadIndex, DownloadStore
 from dionaea.exception import LoaderError
-from dionaea.util import md5file
 
 import os
 import logging
@@ -31,6 +32,13 @@ class storehandler(ihandler):
     def __init__(self, path, config=None):
         logger.debug("%s ready!" % (self.__class__.__name__))
         ihandler.__init__(self, path)
+        if config is None:
+            config = {}
+
+        file_hasher.configure(
+            cache_size=config.get("hash_cache_size"),
+            chunk_size=config.get("hash_chunk_size"),
+        )
 
         dionaea_config = g_dionaea.config().get("dionaea")
         self.download_dir = dionaea_config.get("download.dir")
@@ -42,32 +50,63 @@ class storehandler(ihandler):
             if not os.access(self.download_dir, os.W_OK):
                 raise LoaderError("Not allowed to create files in the '%s' directory", self.download_dir)
 
+        layout = config.get("layout", "flat")
+        if layout not in LAYOUTS:
+            raise LoaderError("Unknown layout '%s', must be one of %s", layout, ", ".join(LAYOUTS))
+
+        index = None
+        index_filename = config.get("index")
+        if index_filename:
+            try:
+                index = DownloadIndex(index_filename)
+            except Exception as e:
+                raise LoaderError("Unable to open the download index '%s': %s", index_filename, str(e))
+
+        self.store = DownloadStore(
+            self.download_dir,
+            layout=layout,
+            shard_depth=int(config.get("shard_depth", 2)),
+            index=index,
+        )
+
+    def start(self):
+        if self.store.index is not None:
+            self.store.index.start()
+
+    def stop(self):
+        self.store.stop()
+
     def handle_incident(self, icd):
         logger.debug("storing file")
         p = icd.path
-        # ToDo: use sha1 or sha256
-        md5 = md5file(p)
-        # ToDo: use sys.path.join()
-        n = os.path.join(self.download_dir, md5)
+        # All digests are computed at once and attached to the incidents, so other handlers do not read the file again
+        digests = file_hasher.digests(p)
+        md5 = digests["md5"]
+        n = self.store.get_path(digests)
         i = incident("dionaea.download.complete.hash")
         i.file = n
         i.url = icd.url
         if hasattr(icd, 'con'):
             i.con = icd.con
-        i.md5hash = md5
+        self._set_digests(i, digests)
         i.report()
 
-        try:
-            os.stat(n)
-            i = incident("dionaea.download.complete.again")
-            logger.debug("file %s already existed" % md5)
-        except OSError:
+        # With an index known files are detected without accessing the filesystem
+        n, is_new = self.store.add(p, digests)
+        if is_new:
             logger.debug("saving new file %s to %s" % (md5, n))
-            os.link(p, n)
             i = incident("dionaea.download.complete.unique")
+        else:
+            i = incident("dionaea.download.complete.again")
+            logger.debug("file %s already existed" % md5)
         i.file = n
         if hasattr(icd, 'con'):
             i.con = icd.con
         i.url = icd.url
-        i.md5hash = md5
+        self._set_digests(i, digests)
         i.report()
+
+    @staticmethod
+    def _set_digests(icd, digests):
+        for name in ALGORITHMS:
+            icd.set("%shash" % name, digests[name])
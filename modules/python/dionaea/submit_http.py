@@ -6,7 +6,7 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 from dionaea.core import ihandler, incident, g_dionaea
-from dionaea.util import md5file, sha512file
+from dionaea.digest import incident_digest
 from dionaea import IHandlerLoader
 
 import logging
@@ -80,8 +80,8 @@ class handler(ihandler):
         i = incident("dionaea.upload.request")
         i._url = self.backendurl
 
-        i.sha512 = sha512file(icd.file)
-        i.md5 = md5file(icd.file)
+        i.sha512 = incident_digest(icd, "sha512")
+        i.md5 = incident_digest(icd, "md5")
         i.email = self.email
         i.user = self.user
         i.set('pass', self.passwd)
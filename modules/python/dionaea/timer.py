@@ -0,0 +1,172 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Hierarchical timer wheel driven by the main event loop.
+
+All timers of the Python modules are kept in a single wheel. The core advances the wheel from a libev timer, so all
+callbacks are called in the thread of the event loop and no additional threads are required. Scheduling, cancelling
+and resetting a timer are O(1) operations.
+
+Every level of the wheel has 2^slot_bits slots. A slot of the first level covers one tick, a slot of the next level
+covers all slots of the level below. Timers far in the future are placed in a higher level and moved down the levels
+while the wheel is advanced.
+"""
+
+import logging
+import math
+import time
+from threading import RLock
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("timer")
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_RESOLUTION = 0.1
+
+
+class TimerWheel(object):
+    """
+    Schedule timers with a fixed resolution.
+
+    A timer is any object with the attributes ``_slot`` and ``_expires`` and the method ``_expired()``, see
+    :class:`dionaea.Timer`. The wheel must be advanced regularly by calling :meth:`advance`.
+
+    :param resolution: Length of a tick in seconds
+    :param slot_bits: Number of slots per level as power of 2
+    :param levels: Number of levels
+    :param clock: Monotonic clock
+    """
+    def __init__(self, resolution: float = DEFAULT_RESOLUTION, slot_bits: int = 8, levels: int = 4,
+                 clock: Callable[[], float] = time.monotonic):
+        self.resolution = resolution
+        self.slot_bits = slot_bits
+        self.levels = levels
+        self.clock = clock
+        self._mask = (1 << slot_bits) - 1
+        # Every slot is an ordered set of timers
+        self._wheel: List[List[Dict[Any, None]]] = [[{} for _ in range(1 << slot_bits)] for _ in range(levels)]
+        self._start = clock()
+        self._tick = 0
+        self._count = 0
+        self._lock = RLock()
+
+    def __len__(self):
+        return self._count
+
+    def _now_tick(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = self.clock()
+        return int((now - self._start) / self.resolution)
+
+    def _insert(self, timer: Any):
+        expires = timer._expires
+        for level in range(self.levels):
+            shift = level * self.slot_bits
+            if (expires >> shift) - (self._tick >> shift) <= self._mask:
+                break
+        else:
+            # Too far in the future, park it in the last slot of the top level and place it again once it is reached
+            expires = ((self._tick >> shift) + self._mask) << shift
+        slot = self._wheel[level][(expires >> shift) & self._mask]
+        slot[timer] = None
+        timer._slot = slot
+
+    def schedule(self, timer: Any, delay: float):
+        """
+        Schedule a timer, if it is already scheduled it is moved.
+
+        :param timer: The timer
+        :param delay: Time in seconds until the timer expires, rounded up to the next tick
+        """
+        with self._lock:
+            self._remove(timer)
+            ticks = max(1, math.ceil(delay / self.resolution))
+            timer._expires = max(self._tick, self._now_tick()) + ticks
+            self._insert(timer)
+            self._count += 1
+
+    def cancel(self, timer: Any) -> bool:
+        """
+        Cancel a timer.
+
+        :return: True if the timer was scheduled
+        """
+        with self._lock:
+            return self._remove(timer)
+
+    def _remove(self, timer: Any) -> bool:
+        slot: Optional[Dict[Any, None]] = getattr(timer, "_slot", None)
+        if slot is None:
+            return False
+        del slot[timer]
+        timer._slot = None
+        self._count -= 1
+        return True
+
+    def _cascade(self, level: int):
+        shift = level * self.slot_bits
+        index = (self._tick >> shift) & self._mask
+        slot = self._wheel[level][index]
+        if not slot:
+            return
+        self._wheel[level][index] = {}
+        for timer in slot:
+            self._insert(timer)
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """
+        Advance the wheel to the current time and call the callbacks of all expired timers.
+
+        :param now: Time of the clock to advance to, default is now
+        :return: Number of expired timers
+        """
+        target = self._now_tick(now)
+        expired = 0
+        while True:
+            with self._lock:
+                if self._tick >= target:
+                    break
+                if self._count == 0:
+                    self._tick = target
+                    break
+                self._tick += 1
+                for level in range(self.levels - 1, 0, -1):
+                    if self._tick & ((1 << (level * self.slot_bits)) - 1) == 0:
+                        self._cascade(level)
+                index = self._tick & self._mask
+                due = self._wheel[0][index]
+                if not due:
+                    continue
+                # Timers can be cancelled while the callbacks of the other timers are running
+                self._wheel[0][index] = {}
+
+            while True:
+                with self._lock:
+                    if not due:
+                        break
+                    timer = next(iter(due))
+                    del due[timer]
+                    timer._slot = None
+                    self._count -= 1
+                expired += 1
+                try:
+                    timer._expired()
+                except Exception:
+                    logger.error("There was an error in the timer callback %r", timer, exc_info=True)
+        return expired
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "timers": self._count,
+                "tick": self._tick,
+                "resolution": self.resolution,
+            }
+
+
+#: Wheel of the process, advanced by the core
+timer_wheel = TimerWheel()
@@ -0,0 +1,124 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Trace the packets of a service for debugging.
+
+Tracing is disabled by default and the packets are not formatted at all. If enabled in the config of a service the
+dissected packets are logged with the logger ``<service>.trace`` and the raw data can be written to a dump file.
+
+The dump file contains one record per packet. Every record starts with a header (timestamp as double, direction as
+unsigned char, length of the data as unsigned int in network byte order) followed by the raw data.
+"""
+
+import logging
+import struct
+import time
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+
+DIRECTION_IN = 0
+DIRECTION_OUT = 1
+
+_directions = {
+    "in": DIRECTION_IN,
+    "out": DIRECTION_OUT,
+}
+
+record_header = struct.Struct("!dBI")
+
+logger = logging.getLogger("trace")
+logger.setLevel(logging.DEBUG)
+
+
+class PacketTrace(object):
+    """
+    Trace the packets of a service.
+
+    :param name: Name of the service, used for the name of the logger
+    :param enabled: Enable tracing
+    :param filename: Write the raw data to this dump file
+    """
+    def __init__(self, name: str, enabled: bool = False, filename: Optional[str] = None):
+        self.name = name
+        self.logger = logging.getLogger("%s.trace" % name)
+        self.enabled = enabled
+        self.filename = filename
+        self._fp: Optional[BinaryIO] = None
+        if self.enabled and self.filename:
+            try:
+                self._fp = open(self.filename, "ab")
+            except OSError:
+                logger.warning("Unable to open trace file %s", self.filename, exc_info=True)
+
+    @classmethod
+    def from_config(cls, name: str, config: Optional[Dict[str, Any]]) -> "PacketTrace":
+        """
+        Create a trace from the 'trace' value of a service config.
+
+        The value can be a bool or a dict with the keys 'enabled' and 'file'.
+        """
+        if not isinstance(config, dict):
+            return cls(name)
+        trace_config = config.get("trace", False)
+        if isinstance(trace_config, dict):
+            return cls(
+                name,
+                enabled=bool(trace_config.get("enabled", True)),
+                filename=trace_config.get("file"),
+            )
+        return cls(name, enabled=bool(trace_config))
+
+    def trace(self, direction: str, packet: Any, data: Optional[bytes] = None):
+        """
+        Trace a packet.
+
+        :param direction: 'in' or 'out'
+        :param packet: The dissected packet, it is only formatted if the trace logger is enabled for DEBUG
+        :param data: The raw data, only written to the dump file if given
+        """
+        if not self.enabled:
+            return
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("%s %s", direction, packet.summary())
+            packet.show(log=self.logger.debug)
+        if data is not None:
+            self.dump(direction, data)
+
+    def dump(self, direction: str, data: bytes):
+        """
+        Write the raw data to the dump file.
+
+        :param direction: 'in' or 'out'
+        :param data: The raw data
+        """
+        if not self.enabled or self._fp is None:
+            return
+        self._fp.write(record_header.pack(time.time(), _directions.get(direction, DIRECTION_IN), len(data)))
+        self._fp.write(data)
+        self._fp.flush()
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+def read_dump(fp: BinaryIO) -> Iterator[Tuple[float, int, bytes]]:
+    """
+    Read the records of a dump file.
+
+    :param fp: The dump file opened in binary mode
+    :return: Tuples of timestamp, direction and data
+    """
+    while True:
+        header = fp.read(record_header.size)
+        if len(header) < record_header.size:
+            return
+        timestamp, direction, length = record_header.unpack(header)
+        data = fp.read(length)
+        if len(data) < length:
+            return
+        yield timestamp, direction, data
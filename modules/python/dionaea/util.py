@@ -5,10 +5,10 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
-import hashlib
 import logging
 import re
 
+from dionaea.digest import DEFAULT_CHUNK_SIZE, file_hasher
 
 logger = logging.getLogger("util")
 logger.setLevel(logging.DEBUG)
@@ -22,7 +22,7 @@ def md5file(filename):
     :return: MD5 checksum as hex string
     :rtype: str
     """
-    return hashfile(filename, hashlib.md5())
+    return file_hasher.digest(filename, "md5")
 
 
 def sha512file(filename):
@@ -33,7 +33,7 @@ def sha512file(filename):
     :return: SHA512 checksum as hex string
     :rtype: str
     """
-    return hashfile(filename, hashlib.sha512())
+    return file_hasher.digest(filename, "sha512")
 
 def sha256file(filename):
     """
@@ -43,7 +43,7 @@ def sha256file(filename):
     :return: SHA256 checksum as hex string
     :rtype: str
     """
-    return hashfile(filename, hashlib.sha256())
+    return file_hasher.digest(filename, "sha256")
 
 def hashfile(filename, digest):
     """
@@ -56,7 +56,7 @@ def hashfile(filename, digest):
     """
     fh = open(filename, mode="rb")
     while 1:
-        buf = fh.read(4096)
+        buf = fh.read(DEFAULT_CHUNK_SIZE)
         if len(buf) == 0:
             break
         digest.update(buf)
@@ -74,6 +74,8 @@ def detect_shellshock(connection, data, report_incidents=True):
     :return: List of urls or None
     """
     from dionaea.core import incident
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", errors="replace")
     regex = re.compile(r"\(\)\s*\t*\{.*;\s*\}\s*;")
     if not regex.search(data):
         return None
@@ -0,0 +1,185 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import logging
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+from threading import Thread
+from typing import Callable, ContextManager, Iterator, Optional
+
+logger = logging.getLogger("writer")
+logger.setLevel(logging.DEBUG)
+
+_STOP = object()
+
+
+class BatchWriter(Thread):
+    """
+    Write records to a database, a file or a remote service from a dedicated thread.
+
+    The ihandlers run on the thread of the event loop. They only build records from the incident and pass them to
+    put(). The records are written in the writer thread and committed in batches. If the queue is full the record is
+    dropped, a slow backend must never block the honeypot services.
+
+    A record is a callable and its arguments. The arguments must not reference the incident or the connection,
+    both are gone as soon as the incident callback returns.
+
+    :param commit: Called in the writer thread to commit the written records, e.g. commit a transaction or flush a file.
+    :param rollback: Called in the writer thread if the commit has failed. Without savepoint it is also called if a
+                     record has failed and all records of the batch are lost.
+    :param savepoint: Called in the writer thread to get a context manager wrapping every record, e.g. a SAVEPOINT. If
+                      a record fails only its changes are undone and the other records of the batch are kept.
+    :param max_queue_size: Maximum number of queued records.
+    :param commit_max_rows: Commit after N records have been written.
+    :param commit_interval: Commit at least every N seconds. If 0 commit as soon as the queue is empty.
+    :param name: Name of the thread.
+    """
+    def __init__(self, commit: Callable, rollback: Optional[Callable] = None, max_queue_size: int = 10000,
+                 commit_max_rows: int = 100, commit_interval: float = 0.0, name: str = "writer",
+                 savepoint: Optional[Callable[[], ContextManager]] = None):
+        Thread.__init__(self, name=name, daemon=True)
+        self.commit = commit
+        self.rollback = rollback
+        self.savepoint = savepoint
+        self.commit_max_rows = max(1, commit_max_rows)
+        self.commit_interval = max(0.0, commit_interval)
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_queue_size))
+
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def put(self, func: Callable, *args) -> bool:
+        """
+        Queue a record. This never blocks.
+
+        :param func: Called in the writer thread.
+        :param args: Arguments passed to the function.
+        :return: False if the queue is full and the record has been dropped.
+        """
+        try:
+            self._queue.put_nowait((func, args))
+        except queue.Full:
+            self.dropped += 1
+            # Do not flood the log while the database is slow
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning("%s: Queue is full, %d record(s) dropped", self.name, self.dropped)
+            return False
+        self.queued += 1
+        return True
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the writer.
+        """
+        return {
+            "queue_size": self._queue.qsize(),
+            "queued": self.queued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Write all queued records and stop the thread.
+
+        :param timeout: Wait max N seconds for the thread.
+        """
+        if not self.is_alive():
+            return
+        self._queue.put(_STOP)
+        self.join(timeout)
+        logger.info("%s stopped: %s", self.name, self.stats())
+
+    def run(self) -> None:
+        rows = 0
+        batch_start = time.monotonic()
+        while True:
+            try:
+                if rows == 0:
+                    record = self._queue.get()
+                    batch_start = time.monotonic()
+                elif self.commit_interval > 0:
+                    timeout = batch_start + self.commit_interval - time.monotonic()
+                    record = self._queue.get(timeout=max(0.0, timeout))
+                else:
+                    record = self._queue.get_nowait()
+            except queue.Empty:
+                record = None
+
+            if record is _STOP:
+                if rows > 0 and self._commit():
+                    self.written += rows
+                return
+
+            if record is not None:
+                func, args = record
+                try:
+                    if self.savepoint is None:
+                        func(*args)
+                    else:
+                        with self.savepoint():
+                            func(*args)
+                    rows += 1
+                except Exception:
+                    logger.warning("%s: Unable to write record", self.name, exc_info=True)
+                    self.errors += 1
+                    if self.savepoint is None:
+                        self._rollback()
+                        rows = 0
+                        continue
+
+            if rows == 0:
+                continue
+
+            if record is None or rows >= self.commit_max_rows or \
+                    (self.commit_interval > 0 and time.monotonic() - batch_start >= self.commit_interval):
+                if self._commit():
+                    self.written += rows
+                rows = 0
+
+    def _commit(self) -> bool:
+        try:
+            self.commit()
+        except Exception:
+            logger.warning("%s: Unable to commit records", self.name, exc_info=True)
+            self.errors += 1
+            self._rollback()
+            return False
+        return True
+
+    def _rollback(self) -> None:
+        if self.rollback is None:
+            return
+        try:
+            self.rollback()
+        except Exception:
+            logger.warning("%s: Unable to rollback", self.name, exc_info=True)
+
+
+@contextmanager
+def sqlite_savepoint(dbh: sqlite3.Connection) -> Iterator[None]:
+    """
+    Undo the changes of a record if it fails without rolling back the transaction of the batch.
+
+    :param dbh: The database connection
+    """
+    if not dbh.in_transaction:
+        # Releasing the outermost savepoint would commit the transaction
+        dbh.execute("BEGIN")
+    dbh.execute("SAVEPOINT record")
+    try:
+        yield
+    except BaseException:
+        dbh.execute("ROLLBACK TO SAVEPOINT record")
+        dbh.execute("RELEASE SAVEPOINT record")
+        raise
+    dbh.execute("RELEASE SAVEPOINT record")
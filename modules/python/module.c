@@ -89,6 +89,12 @@ static struct python_runtime
 		struct ihandler pyhandler;
 		struct processor processor;
 	} traceables;
+
+	struct
+	{
+		struct ev_timer watcher;
+		python_timer_cb cb;
+	} timer;
 	GString *sys_path;
 } runtime;
 
@@ -257,6 +263,7 @@ static bool freepy(void)
 {
 	g_debug("%s %s", __PRETTY_FUNCTION__, __FILE__);
 	ev_io_stop(g_dionaea->loop, &runtime.python_cli_io_in);
+	python_timer_stop();
 	if( isatty(STDOUT_FILENO) )
 		tcsetattr(0, TCSADRAIN, &runtime.read_termios);
 
@@ -726,7 +733,12 @@ PyObject *py_config_string(gchar *group, gchar *key)
 	PyObject *obj_value;
 
 	value = g_key_file_get_string(g_dionaea->config, group, key, &error);
+	if (value == NULL) {
+		g_clear_error(&error);
+		Py_RETURN_NONE;
+	}
 	obj_value = PyUnicode_FromString(value);
+	g_free(value);
 
 	return obj_value;
 }
@@ -777,6 +789,14 @@ PyObject *py_config(PyObject *self, PyObject *args)
 	PyDict_SetItemString(obj2, "ihandler_configs", obj_value);
 	obj_value = py_config_string_list("module.python", "service_configs");
 	PyDict_SetItemString(obj2, "service_configs", obj_value);
+	static const char *bistream_keys[] = {
+		"bistream.dir", "bistream.max_size", "bistream.max_total", "bistream.spill_dir", "bistream.spill_size", NULL
+	};
+	for (const char **key = bistream_keys; *key != NULL; key++) {
+		obj_value = py_config_string("module.python", (gchar *)*key);
+		PyDict_SetItemString(obj2, *key, obj_value);
+		Py_DECREF(obj_value);
+	}
 
 	PyDict_SetItemString(obj, "module", obj2);
 
@@ -806,6 +826,33 @@ void traceable_ihandler_cb (struct incident *i, void *ctx)
 	traceback();
 }
 
+static void python_timer_watcher_cb(EV_P_ struct ev_timer *w, int revents)
+{
+	runtime.timer.cb();
+	traceback();
+}
+
+/**
+ * called from cython code,
+ * advances the timer wheel of the python modules from the event loop
+ *
+ * @param interval  resolution of the timer wheel in seconds
+ * @param cb        the cython callback
+ */
+void python_timer_start(double interval, python_timer_cb cb)
+{
+	python_timer_stop();
+	runtime.timer.cb = cb;
+	ev_timer_init(&runtime.timer.watcher, python_timer_watcher_cb, interval, interval);
+	ev_timer_start(g_dionaea->loop, &runtime.timer.watcher);
+}
+
+void python_timer_stop(void)
+{
+	if( ev_is_active(&runtime.timer.watcher) )
+		ev_timer_stop(g_dionaea->loop, &runtime.timer.watcher);
+}
+
 /**
  * called from cython code,
  * exports pointers to the cython protocol functions
@@ -48,6 +48,10 @@ bool traceable_idle_timeout_cb(struct connection *con, void *context);
 bool traceable_listen_timeout_cb(struct connection *con, void *context);
 bool traceable_sustain_timeout_cb(struct connection *con, void *context);
 
+typedef void (*python_timer_cb)(void);
+void python_timer_start(double interval, python_timer_cb cb);
+void python_timer_stop(void);
+
 struct processor;
 void set_processor(struct processor *);
 void python_processor_bistream_create(struct connection *con);
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Import the files of an existing flat download directory into the download store and its index.
+
+The dionaea Python package must be in the module search path, e.g.
+PYTHONPATH=/opt/dionaea/lib/dionaea/python python3 import_downloads.py ...
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from dionaea.download_store import LAYOUTS, DownloadIndex, DownloadStore, import_directory
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import downloaded files into the dionaea download store"
+    )
+    parser.add_argument(
+        "source",
+        help="Flat directory with the files to import, e.g. the current download directory",
+    )
+    parser.add_argument(
+        "--download-dir",
+        required=True,
+        help="The download directory of dionaea (download.dir)",
+    )
+    parser.add_argument(
+        "--index",
+        help="SQLite file of the download index (index of the store ihandler)",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="sha256",
+        help="Layout of the download directory (Default: sha256)",
+    )
+    parser.add_argument(
+        "--shard-depth",
+        type=int,
+        default=2,
+        help="Number of sub directory levels of the sha256 layout (Default: 2)",
+    )
+    parser.add_argument(
+        "--move",
+        action="store_true",
+        help="Move the files instead of creating hard links or copies",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    index = None
+    if args.index:
+        index = DownloadIndex(args.index)
+
+    # The index must contain the same absolute paths as the ones recorded by dionaea
+    store = DownloadStore(
+        os.path.abspath(args.download_dir),
+        layout=args.layout,
+        shard_depth=args.shard_depth,
+        index=index
+    )
+    try:
+        result = import_directory(store, args.source, move=args.move)
+    finally:
+        store.stop()
+
+    print("imported: {imported}, duplicates: {duplicates}, errors: {errors}".format(**result))
+    if result["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,9 @@
 
 #define D_LOG_DOMAIN "incident"
 
+/* max number of origins in the index of the handlers */
+#define IHANDLERS_INDEX_MAX 4096
+
 
 struct opaque_data *opaque_data_new(void)
 {
@@ -170,16 +173,61 @@ struct ihandler *ihandler_new(char *pattern, ihandler_cb cb, void *ctx)
 	i->cb = cb;
 	i->ctx = ctx;
 	g_dionaea->ihandlers->handlers = g_list_append(g_dionaea->ihandlers->handlers, i);
+	ihandlers_index_clear();
 	return i;
 }
 
 void ihandler_free(struct ihandler *i)
 {
 	g_debug("%s i %p", __PRETTY_FUNCTION__, i);
+	if( i == NULL )
+		return;
 	g_dionaea->ihandlers->handlers = g_list_remove(g_dionaea->ihandlers->handlers, i);
+	g_dionaea->ihandlers->generation++;
+	ihandlers_index_clear();
+	g_pattern_spec_free(i->match);
+	g_free((char *)i->path);
 	g_free(i);
 }
 
+void ihandlers_index_clear(void)
+{
+	if( g_dionaea->ihandlers->index != NULL )
+		g_hash_table_remove_all(g_dionaea->ihandlers->index);
+}
+
+/**
+ * Get the handlers matching the origin of an incident.
+ * The patterns are only matched on the first lookup of an origin.
+ *
+ * @param origin the origin of the incident
+ * @return the matching handlers, owned by the index
+ */
+static GPtrArray *ihandlers_lookup(const char *origin)
+{
+	struct ihandlers *ihs = g_dionaea->ihandlers;
+	if( ihs->index == NULL )
+		ihs->index = g_hash_table_new_full(g_str_hash, g_str_equal, g_free, (GDestroyNotify)g_ptr_array_unref);
+
+	GPtrArray *matches = g_hash_table_lookup(ihs->index, origin);
+	if( matches != NULL )
+		return matches;
+
+	if( g_hash_table_size(ihs->index) >= IHANDLERS_INDEX_MAX )
+		g_hash_table_remove_all(ihs->index);
+
+	size_t len = strlen(origin);
+	matches = g_ptr_array_new();
+	for( GList *it=ihs->handlers; it != NULL; it = g_list_next(it) )
+	{
+		struct ihandler *ih = it->data;
+		if( g_pattern_match(ih->match, len, origin, NULL ) == TRUE )
+			g_ptr_array_add(matches, ih);
+	}
+	g_hash_table_insert(ihs->index, g_strdup(origin), matches);
+	return matches;
+}
+
 
 
 struct incident *incident_new(const char *path)
@@ -197,6 +245,11 @@ void incident_free(struct incident *e)
 	g_free(e);
 }
 
+struct opaque_data *incident_value_lookup(struct incident *e, const char *name)
+{
+	return g_hash_table_lookup(e->data, name);
+}
+
 struct opaque_data *incident_value_get(struct incident *e, const char *name, enum opaque_data_type t)
 {
 	struct opaque_data *d;
@@ -375,12 +428,16 @@ void incident_report(struct incident *i)
 {
 	g_debug("reporting %p", i);
 	incident_dump(i);
-	for( GList *it=g_dionaea->ihandlers->handlers; it != NULL; it = g_list_next(it) )
+	struct ihandlers *ihs = g_dionaea->ihandlers;
+	/* a handler may add or remove handlers, keep the matches until all are called */
+	GPtrArray *matches = g_ptr_array_ref(ihandlers_lookup(i->origin));
+	unsigned int generation = ihs->generation;
+	for( guint n = 0; n < matches->len; n++ )
 	{
-		struct ihandler *ih = it->data;
-		if( g_pattern_match(ih->match, strlen(i->origin), i->origin, NULL ) == TRUE )
-		{
-			ih->cb(i, ih->ctx);
-		}
+		struct ihandler *ih = g_ptr_array_index(matches, n);
+		if( generation != ihs->generation && g_list_find(ihs->handlers, ih) == NULL )
+			continue;
+		ih->cb(i, ih->ctx);
 	}
+	g_ptr_array_unref(matches);
 }
@@ -0,0 +1,197 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Minimal replacement of the dionaea.core binding to run the Python services without libdionaea.
+
+The data sent by a connection is captured in the ``sent`` list and incidents are collected in ``incidents``.
+"""
+
+import sys
+import tempfile
+import types
+
+from dionaea.framing import get_framing
+
+#: All reported incidents
+incidents = []
+
+
+class _Node(object):
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.hostname = ""
+
+
+class _Timeouts(object):
+    def __init__(self):
+        self.idle = 0
+        self.listen = 0
+        self.connecting = 0
+        self.handshake = 0
+        self.reconnect = 0
+        self.sustain = 0
+
+
+class _Speed(object):
+    def __init__(self):
+        self.limit = 0
+
+
+class _Traffic(object):
+    def __init__(self):
+        self.speed = _Speed()
+        self.accounting = 0
+
+
+class connection(object):
+    io_in_framing = None
+    io_in_min_size = 0
+    io_in_memoryview = False
+
+    def __init__(self, proto=None):
+        self.transport = proto
+        self.protocol = self.__class__.__name__
+        self.local = _Node("127.0.0.1", 0)
+        self.remote = _Node("127.0.0.2", 1024)
+        self.timeouts = _Timeouts()
+        self._in = _Traffic()
+        self._out = _Traffic()
+        self.sent = []
+        self.closed = False
+        self.set_io_in_framing(self.io_in_framing, self.io_in_min_size, self.io_in_memoryview)
+
+    def set_io_in_framing(self, framing=None, min_size=0, view=False):
+        self._frame_spec = get_framing(framing)
+        self._io_in_min = max(0, min_size)
+        self._io_in_view = bool(view)
+
+    def io_in_deliverable(self, data):
+        """
+        Number of bytes the core passes to handle_io_in(), 0 to wait for more data.
+        """
+        if len(data) < self._io_in_min:
+            return 0
+        if self._frame_spec is None:
+            return len(data)
+        return self._frame_spec.complete_size(data)
+
+    def apply_config(self, config):
+        pass
+
+    def apply_parent_config(self, parent):
+        for name in getattr(parent, "shared_config_values", ()):
+            setattr(self, name, getattr(parent, name))
+
+    def bind(self, *args, **kwargs):
+        pass
+
+    def listen(self, *args, **kwargs):
+        pass
+
+    def connect(self, *args, **kwargs):
+        pass
+
+    def processors(self):
+        pass
+
+    def send(self, data, *args, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        elif not isinstance(data, bytes):
+            # The binding copies buffers like memoryviews to the output buffer
+            data = bytes(data)
+        self.sent.append(data)
+
+    def close(self):
+        self.closed = True
+
+    def ref(self):
+        self.refs = getattr(self, "refs", 0) + 1
+
+    def unref(self):
+        self.refs -= 1
+
+    def handle_established(self):
+        pass
+
+    def handle_disconnect(self):
+        return 0
+
+    def __hash__(self):
+        return id(self)
+
+
+class incident(object):
+    def __init__(self, origin=None):
+        self.origin = origin
+
+    def report(self):
+        incidents.append(self)
+
+    def dump(self):
+        pass
+
+    def set(self, key, value):
+        setattr(self, key, value)
+
+    def keys(self):
+        return [k.encode("ascii") for k in self.to_dict()]
+
+    def to_dict(self):
+        return {k: v for k, v in self.__dict__.items() if k != "origin"}
+
+    def get(self, key):
+        return getattr(self, key)
+
+
+class ihandler(object):
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def dispatch_stats(self):
+        return {}
+
+
+class _Dionaea(object):
+    def __init__(self):
+        self._config = {
+            "dionaea": {
+                "download.dir": tempfile.gettempdir(),
+                "download.suffix": ".tmp",
+            }
+        }
+
+    def config(self):
+        return self._config
+
+    def version(self):
+        return {"dionaea": {"version": "0.0.0"}}
+
+
+def dlhfn(*args):
+    pass
+
+
+def install():
+    """
+    Register the stub as dionaea.core, must be called before any service is imported.
+    """
+    module = types.ModuleType("dionaea.core")
+    module.connection = connection
+    module.incident = incident
+    module.ihandler = ihandler
+    module.g_dionaea = _Dionaea()
+    module.dlhfn = dlhfn
+    sys.modules["dionaea.core"] = module
+    return module
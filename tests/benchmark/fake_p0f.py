@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Fake p0f query server for the p0f handler.
+
+The server answers the queries of the p0f 2.x and 3.x API with a fingerprint derived from the remote address. It is
+used by the p0f benchmark and can serve a unix socket to test dionaea without p0f. Like p0f 2.x the server closes the
+connection after every response if ``--one-shot`` is given.
+
+Usage: python3 tests/benchmark/fake_p0f.py [--version 2|3] [--one-shot] /tmp/p0f.sock
+"""
+
+import argparse
+import os
+import socketserver
+import struct
+import sys
+
+P0F2_QUERY = struct.Struct("III4s4sHH")
+P0F2_RESPONSE = struct.Struct("IIB20s40sB30s30sBBBhHi")
+P0F3_QUERY = struct.Struct("=IB16s")
+P0F3_RESPONSE = struct.Struct("=IIIIIIIIIhBB32s32s32s32s32s32s")
+
+GENRES = [
+    (b"Linux", b"2.6.x"),
+    (b"Windows", b"XP/2000"),
+    (b"FreeBSD", b"9.x"),
+]
+
+
+class FakeP0F(object):
+    """
+    Answer queries without sockets.
+
+    :param version: Version of the query API
+    """
+    def __init__(self, version=3):
+        self.version = version
+        self.query_size = P0F2_QUERY.size if version == 2 else P0F3_QUERY.size
+        self.queries = 0
+
+    def respond(self, data, limit=None):
+        """
+        Answer the complete queries of the data.
+
+        :param limit: Max number of queries to answer
+        :return: Tuple of the number of bytes consumed and the responses
+        """
+        out = []
+        offset = 0
+        while len(data) - offset >= self.query_size and (limit is None or len(out) < limit):
+            query = data[offset:offset + self.query_size]
+            offset += self.query_size
+            self.queries += 1
+            if self.version == 2:
+                out.append(self._respond2(query))
+            else:
+                out.append(self._respond3(query))
+        return offset, b"".join(out)
+
+    def _respond2(self, query):
+        magic, _, query_id, src, _, _, _ = P0F2_QUERY.unpack(query)
+        if magic != 0x0defaced:
+            return P0F2_RESPONSE.pack(0x0defaced, query_id, 1, b"", b"", 0, b"", b"", 0, 0, 0, 0, 0, -1)
+        genre, detail = GENRES[src[-1] % len(GENRES)]
+        return P0F2_RESPONSE.pack(
+            0x0defaced, query_id, 0, genre, detail, src[-1] % 16, b"ethernet/modem", b"", 0, 0, 0, 0, 0, 42
+        )
+
+    def _respond3(self, query):
+        magic, addr_type, addr = P0F3_QUERY.unpack(query)
+        if magic != 0x50304601 or addr_type not in (4, 6):
+            return P0F3_RESPONSE.pack(0x50304602, 0x00, *([0] * 7), 0, 0, 0, *([b""] * 6))
+        host = addr[:4] if addr_type == 4 else addr
+        genre, detail = GENRES[host[-1] % len(GENRES)]
+        return P0F3_RESPONSE.pack(
+            0x50304602, 0x10, 1700000000, 1700000100, 3, 42 * 60, 49, 0, 0, host[-1] % 16, 0, 0,
+            genre, detail, b"", b"", b"Ethernet or modem", b""
+        )
+
+
+def serve(path, version, one_shot):
+    fake = FakeP0F(version)
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            data = b""
+            while True:
+                chunk = self.request.recv(4096)
+                if not chunk:
+                    return
+                consumed, out = fake.respond(data + chunk, limit=1 if one_shot else None)
+                data = (data + chunk)[consumed:]
+                if out:
+                    self.request.sendall(out)
+                    if one_shot:
+                        return
+
+    if os.path.exists(path):
+        os.unlink(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        print("Fake p0f %d.x listening on %s" % (version, path))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake p0f query server")
+    parser.add_argument("--version", type=int, choices=(2, 3), default=3, help="Version of the API (Default: 3)")
+    parser.add_argument("--one-shot", action="store_true", help="Close the connection after every response")
+    parser.add_argument("path", help="Path of the unix socket")
+    args = parser.parse_args()
+    serve(args.path, args.version, args.one_shot)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Benchmark of the responses of the HTTP service.
+
+A web root with a small page, a not existing page and a bigger file is created and the pages are requested like
+scanners do. The requests per second with and without the static content cache are reported with the counters of
+the cache and the number of send() calls per response. The responses of both are compared. A big file, which is not
+cached, is used to measure the bandwidth of the file path.
+
+Usage: PYTHONPATH=modules/python python3 tests/benchmark/http_responses.py [-n REQUESTS] [-s KBYTES]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import core_stub
+
+core_stub.install()
+
+from dionaea.http import STATE_SENDFILE, httpd  # noqa: E402
+
+
+def create_root(root, size):
+    with open(os.path.join(root, "index.html"), "w") as fp:
+        fp.write("<html><body>It works!</body></html>\n")
+    with open(os.path.join(root, "setup.cgi"), "wb") as fp:
+        fp.write(b"#" * (256 * 1024))
+    with open(os.path.join(root, "firmware.bin"), "wb") as fp:
+        fp.write(os.urandom(size))
+
+
+#: Number of send() calls of all requests
+sends = 0
+
+
+def request(parent, path, method=b"GET"):
+    """
+    Send a request to a new connection and return the response.
+    """
+    global sends
+    con = httpd()
+    con.apply_parent_config(parent)
+    con.handle_established()
+    con.handle_io_in(method + b" " + path + b" HTTP/1.1\r\nHost: 192.0.2.1\r\nUser-Agent: scanner\r\n\r\n")
+    # The core calls handle_io_out() every time the output buffer has been sent
+    while con.state == STATE_SENDFILE:
+        con.handle_io_out()
+    sends += len(con.sent)
+    return b"".join(con.sent)
+
+
+def run(name, parent, paths, count):
+    global sends
+    sends = 0
+    start = time.perf_counter()
+    for i in range(count):
+        request(parent, paths[i % len(paths)])
+    duration = time.perf_counter() - start
+    print("%-30s %10.1f requests/s %6.1f sends/response" % (name, count / duration, sends / count))
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the responses of the HTTP service")
+    parser.add_argument("-n", "--requests", type=int, default=5000, help="Number of requests (Default: 5000)")
+    parser.add_argument("-s", "--size", type=int, default=16384,
+                        help="Size of the big file in kbytes (Default: 16384)")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as root:
+        create_root(root, args.size * 1024)
+        parents = {}
+        for name, enabled in (("without cache", False), ("with cache", True)):
+            parent = httpd()
+            parent.apply_config({"root": root, "static_cache": {"enabled": enabled}})
+            parents[name] = parent
+
+        paths = [b"/", b"/index.html", b"/wp-login.php", b"/HNAP1/"]
+        for path in paths + [b"/setup.cgi"]:
+            for method in (b"GET", b"HEAD"):
+                responses = [request(parent, path, method) for parent in parents.values()]
+                if responses[0] != responses[1]:
+                    print("error: the responses of %s %s differ" % (method, path), file=sys.stderr)
+                    return 1
+
+        times = [run("small pages %s" % name, parent, paths, args.requests) for name, parent in parents.items()]
+        print("%-30s %10.1fx" % ("speedup:", times[0] / times[1]))
+
+        count = max(1, args.requests // 10)
+        for name, parent in parents.items():
+            duration = run("file of 256 KiB %s" % name, parent, [b"/setup.cgi"], count)
+            print("%-30s %10.1f MiB/s" % ("", count * 256 / 1024 / duration))
+
+        count = max(1, args.requests // 500)
+        duration = run("file of %d KiB" % args.size, parents["with cache"], [b"/firmware.bin"], count)
+        print("%-30s %10.1f MiB/s" % ("", count * args.size / 1024 / duration))
+
+        stats = parents["with cache"].static_cache.stats()
+        print("cache: %(entries)d entries, %(size)d bytes, %(hits)d hits, %(misses)d misses" % stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Benchmark of file uploads to the HTTP service.
+
+A multipart/form-data POST request with a file is sent in chunks to the HTTP service and the digests of the reported
+file are computed like the store handler does. If the cgi module is available (Python < 3.13), the previous
+implementation is used as reference: the body was written to a temporary file, parsed with cgi.FieldStorage, every
+file was copied to another temporary file and it was read again to compute the digests. The digests of both are
+compared.
+
+Usage: PYTHONPATH=modules/python python3 tests/benchmark/http_upload.py [-n UPLOADS] [-s KBYTES] [-c CHUNK_SIZE]
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import core_stub
+
+core = core_stub.install()
+
+from dionaea.digest import file_hasher, hash_file  # noqa: E402
+from dionaea.http import httpd  # noqa: E402
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import cgi
+except ImportError:
+    cgi = None
+
+BOUNDARY = b"----WebKitFormBoundary7MA4YWxkTrZu0gW"
+
+
+def create_body(size):
+    parts = [
+        (b'Content-Disposition: form-data; name="submit"', b"Upload"),
+        (b'Content-Disposition: form-data; name="file"; filename="x.exe"\r\nContent-Type: application/octet-stream',
+         os.urandom(size)),
+    ]
+    body = b""
+    for headers, value in parts:
+        body += b"--" + BOUNDARY + b"\r\n" + headers + b"\r\n\r\n" + value + b"\r\n"
+    return body + b"--" + BOUNDARY + b"--\r\n"
+
+
+def upload_current(parent, request, chunk_size, digests):
+    """
+    Send the request in chunks like the core does and compute the digests like the store handler.
+    """
+    def report(icd):
+        digests.append(file_hasher.digests(icd.path))
+
+    core.incident.report = report
+    con = httpd()
+    con.apply_parent_config(parent)
+    con.handle_established()
+    buf = b""
+    for pos in range(0, len(request), chunk_size):
+        data = buf + request[pos:pos + chunk_size]
+        buf = data[con.handle_io_in(data):]
+
+
+def upload_legacy(parent, request, chunk_size, digests):
+    """
+    Process the request like the previous implementation did.
+    """
+    end = request.index(b"\r\n\r\n") + 4
+    fp_body = tempfile.NamedTemporaryFile(delete=False, dir=parent.download_dir, prefix="http-")
+    for pos in range(end, len(request), chunk_size):
+        fp_body.write(request[pos:pos + chunk_size])
+    fp_body.seek(0)
+    form = cgi.FieldStorage(fp=fp_body, environ={
+        "REQUEST_METHOD": "POST",
+        "CONTENT_LENGTH": len(request) - end,
+        "CONTENT_TYPE": "multipart/form-data; boundary=" + BOUNDARY.decode(),
+    })
+    for name in form.keys():
+        if form[name].filename is None:
+            continue
+        with tempfile.NamedTemporaryFile(delete=False, dir=parent.download_dir, prefix="http-") as fp:
+            shutil.copyfileobj(form[name].file, fp)
+        digests.append(hash_file(fp.name))
+        os.unlink(fp.name)
+    fp_body.close()
+    os.unlink(fp_body.name)
+
+
+def run(name, func, parent, request, chunk_size, count, size):
+    digests = []
+    start = time.perf_counter()
+    for _ in range(count):
+        func(parent, request, chunk_size, digests)
+    duration = time.perf_counter() - start
+    print("%-30s %10.1f uploads/s %10.1f MiB/s" % (name, count / duration, count * size / 1024 / 1024 / duration))
+    return duration, digests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of file uploads to the HTTP service")
+    parser.add_argument("-n", "--uploads", type=int, default=50, help="Number of uploads (Default: 50)")
+    parser.add_argument("-s", "--size", type=int, default=1024, help="Size of the file in kbytes (Default: 1024)")
+    parser.add_argument("-c", "--chunk-size", type=int, default=64 * 1024,
+                        help="Size of the received chunks (Default: 65536)")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    size = args.size * 1024
+    body = create_body(size)
+    request = (
+        b"POST /upload.php HTTP/1.1\r\nHost: 192.0.2.1\r\n"
+        b"Content-Type: multipart/form-data; boundary=" + BOUNDARY + b"\r\n"
+        b"Content-Length: %d\r\n\r\n" % len(body)
+    ) + body
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        core.g_dionaea.config()["dionaea"]["download.dir"] = tmpdir
+        parent = httpd()
+        parent.apply_config({"root": tmpdir})
+
+        current_time, digests = run("current", upload_current, parent, request, args.chunk_size, args.uploads, size)
+        if len(digests) != args.uploads or len(set(map(str, digests))) != 1:
+            print("error: uploads not reported", file=sys.stderr)
+            return 1
+        if cgi is None:
+            print("cgi module not available, skipping the previous implementation")
+            return 0
+
+        legacy_time, legacy_digests = run("legacy", upload_legacy, parent, request, args.chunk_size, args.uploads,
+                                          size)
+        print("%-30s %10.1fx" % ("speedup:", legacy_time / current_time))
+        if digests != legacy_digests:
+            print("error: the digests differ", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Micro benchmark of reading the values of an incident.
+
+The time to read single values of every type and to convert all values with to_dict() and with getattr() for every
+key is reported.
+
+The compiled binding and a running core are required. Start dionaea in the foreground and run the benchmark in the
+interactive Python shell:
+    >>> exec(open("tests/benchmark/incident.py").read())
+"""
+
+import time
+
+from dionaea.core import incident
+
+
+def _measure(func, count):
+    clock = time.perf_counter_ns
+    start = clock()
+    for _ in range(count):
+        func()
+    return (clock() - start) / count
+
+
+def run(count=100000):
+    icd = incident("dionaea.benchmark")
+    values = {
+        "opnum": 4711,
+        "url": "http://example.org/malware.exe",
+        "data": b"\x90" * 64,
+        "list": [1, "two", 3],
+        "dict": {"genre": "Windows", "dist": 2},
+        "none": None,
+    }
+    for key, value in values.items():
+        icd.set(key, value)
+    for key in ("dist", "nat", "tos", "uptime", "link"):
+        icd.set(key, 1)
+
+    results = []
+    for key in values:
+        results.append(("getattr %s" % key, _measure(lambda key=key: getattr(icd, key), count)))
+
+    def read_all():
+        return {k.decode("ascii"): getattr(icd, k.decode("ascii")) for k in icd.keys()}
+
+    results.append(("getattr all keys", _measure(read_all, count)))
+    results.append(("to_dict", _measure(icd.to_dict, count)))
+
+    assert read_all() == icd.to_dict()
+
+    for name, value in results:
+        print("%-20s %10.1f ns" % (name, value))
+    return results
+
+
+if __name__ == "__main__":
+    run()
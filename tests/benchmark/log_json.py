@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Micro-benchmark for the serialization of log_json events.
+
+Usage: PYTHONPATH=modules/python python3 tests/benchmark/log_json.py [-n EVENTS]
+"""
+
+import argparse
+from datetime import datetime
+import json
+import time
+
+from dionaea.encoder import ENCODERS, TimestampCache, flatten_lists
+
+SCHEMA = (
+    (("credentials",), ("password", "username")),
+    (("ftp", "commands"), ("command", "arguments")),
+)
+
+
+def create_event(i, timestamp):
+    return {
+        "connection": {
+            "protocol": "ftpd",
+            "transport": "tcp",
+            "type": "accept"
+        },
+        "dst_ip": "192.0.2.1",
+        "dst_port": 21,
+        "src_hostname": "",
+        "src_ip": "198.51.100.%d" % (i % 256),
+        "src_port": 1024 + i % 60000,
+        "timestamp": timestamp(),
+        "credentials": [
+            {"username": "root", "password": "toor"},
+            {"username": "admin", "password": "admin%d" % i},
+        ],
+        "ftp": {
+            "commands": [
+                {"command": "USER", "arguments": ["root"]},
+                {"command": "PASS", "arguments": ["toor"]},
+                {"command": "RETR", "arguments": ["x.exe"]},
+            ]
+        }
+    }
+
+
+def legacy_flatten(data):
+    """The implementation used before the schema based flattening"""
+    for k in ["credentials", "ftp.commands"]:
+        d = None
+        d2 = data
+        k2 = ""
+        for k2 in k.split("."):
+            d = d2
+            d2 = d.get(k2)
+            if d2 is None:
+                break
+        if d is None or d2 is None:
+            continue
+        result = {}
+        keys = set()
+        for obj in d2:
+            keys = keys | set(obj.keys())
+        for key in keys:
+            result[key] = []
+        for obj in d2:
+            for key in keys:
+                v = obj.get(key)
+                if isinstance(v, (tuple, list)):
+                    v = " ".join(v)
+                result[key].append(v)
+        d[k2] = result
+    return data
+
+
+def run(name, count, timestamp, flatten, encode):
+    start = time.perf_counter()
+    size = 0
+    for i in range(count):
+        data = flatten(create_event(i, timestamp))
+        size += len(encode(data))
+    duration = time.perf_counter() - start
+    print("%-40s %10.0f events/s %8d bytes/event" % (name, count / duration, size / count))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="count", type=int, default=100000, help="Number of events")
+    args = parser.parse_args()
+
+    def legacy_timestamp():
+        return datetime.utcnow().isoformat()
+
+    def legacy_encode(data):
+        return json.dumps(data).encode("utf-8")
+
+    def flatten(data):
+        return flatten_lists(data, SCHEMA)
+
+    run("legacy (utcnow, set flatten, json)", args.count, legacy_timestamp, legacy_flatten, legacy_encode)
+    for name, encode in ENCODERS.items():
+        run("%s (cached timestamp, schema)" % name, args.count, TimestampCache(), flatten, encode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Benchmark of the replies of the MySQL service.
+
+Logins like the ones of brute force scanners and round-trips of SHOW VARIABLES and SELECT @@version are sent to the
+MySQL service. The result sets are compared with the ones built packet by packet like before and the time of both is
+reported. Sessions selecting the rows of a table of a sqlite database measure the shared databases and the query cache.
+
+Usage: PYTHONPATH=modules/python python3 tests/benchmark/mysql_replies.py [-n ROUNDS]
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+
+import core_stub
+
+core_stub.install()
+
+from dionaea.mysql.include.packets import (  # noqa: E402
+    FIELD_TYPE_VAR_STRING, FLAG_NOT_NULL, MySQL_Packet_Header, MySQL_Result_EOF, MySQL_Result_Field,
+    MySQL_Result_Header, MySQL_Result_Row_Data
+)
+from dionaea.mysql.mysql import mysqld  # noqa: E402
+
+
+def mysql_packet(number, payload):
+    return struct.pack("<I", len(payload))[:3] + struct.pack("B", number) + payload
+
+
+LOGIN = mysql_packet(
+    1,
+    struct.pack("<IIB23x", 0x000aa285, 16777216, 33) + b"root\0" + b"\x14" + b"\x01" * 20 + b"\0"
+)
+SHOW_VARIABLES = mysql_packet(0, b"\x03show variables")
+SELECT_VERSION = mysql_packet(0, b"\x03select @@version")
+INIT_DB = mysql_packet(0, b"\x02psn")
+SELECT_ROWS = mysql_packet(0, b"\x03select * from cards")
+
+
+def create_database(filename, rows):
+    dbh = sqlite3.connect(filename)
+    dbh.execute("CREATE TABLE cards (number TEXT, name TEXT)")
+    dbh.executemany(
+        "INSERT INTO cards VALUES (?, ?)",
+        (("4111%012d" % i, "name%d" % i) for i in range(rows))
+    )
+    dbh.commit()
+    dbh.close()
+
+
+def legacy_show_variables(vars):
+    """
+    Build the result set of SHOW VARIABLES packet by packet like the previous implementation did.
+    """
+    r = [MySQL_Result_Header(FieldCount=2)]
+    for name in ("Variable_name", "Value"):
+        r.append(
+            MySQL_Result_Field(
+                Catalog='def',
+                Name=name,
+                CharSet=33,
+                Length=75,
+                Type=FIELD_TYPE_VAR_STRING,
+                Flags=FLAG_NOT_NULL,
+                Decimals=0
+            )
+        )
+    r.append(MySQL_Result_EOF(ServerStatus=0x002))
+    for name, var in vars.values.items():
+        r.append(MySQL_Result_Row_Data(ColumnValues=[name + '\0', "%s\0" % var]))
+    r.append(MySQL_Result_EOF(ServerStatus=0x002))
+
+    buf = b''
+    for i in range(len(r)):
+        rp = MySQL_Packet_Header(Number=(1 + i) & 0xff) / r[i]
+        buf += rp.build()
+    return buf
+
+
+def connect(parent):
+    con = mysqld()
+    con.apply_parent_config(parent)
+    con.handle_established()
+    return con
+
+
+def login(parent):
+    con = connect(parent)
+    con.handle_io_in(LOGIN)
+    return con
+
+
+def run(name, func, rounds, unit):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    duration = time.perf_counter() - start
+    print("%-30s %10.1f %s/s" % (name, rounds / duration, unit))
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the replies of the MySQL service")
+    parser.add_argument("-n", "--rounds", type=int, default=1000, help="Number of rounds (Default: 1000)")
+    parser.add_argument("-r", "--rows", type=int, default=300, help="Number of rows of the table (Default: 300)")
+    args = parser.parse_args()
+
+    # Failed queries are logged
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "psn.sqlite")
+        create_database(filename, args.rows)
+        return run_all(args, filename)
+
+
+def run_all(args, filename):
+    parent = mysqld()
+    parent.apply_config({
+        "databases": {
+            "information_schema": {"path": ":memory:"},
+            "psn": {"path": filename},
+        }
+    })
+
+    con = login(parent)
+    con.sent.clear()
+    con.handle_io_in(SHOW_VARIABLES)
+    if b"".join(con.sent) != legacy_show_variables(parent.vars):
+        print("error: the result sets of SHOW VARIABLES differ", file=sys.stderr)
+        return 1
+    print("variables:                     %d" % len(parent.vars.values))
+
+    def round_trip(data):
+        con.handle_io_in(data)
+        con.sent.clear()
+
+    run("login", lambda: login(parent), args.rounds, "logins")
+    legacy_time = run("legacy: SHOW VARIABLES", lambda: legacy_show_variables(parent.vars), args.rounds,
+                      "round-trips")
+    current_time = run("current: SHOW VARIABLES", lambda: round_trip(SHOW_VARIABLES), args.rounds, "round-trips")
+    print("%-30s %10.1fx" % ("speedup:", legacy_time / current_time))
+    run("SELECT @@version", lambda: round_trip(SELECT_VERSION), args.rounds, "round-trips")
+
+    def session():
+        con = login(parent)
+        con.handle_io_in(INIT_DB)
+        con.handle_io_in(SELECT_ROWS)
+
+    run("session with SELECT", session, args.rounds, "sessions")
+    db = parent.databases["psn"]
+    print("query cache:                   %d hits, %d misses" % (db.cache_hits, db.cache_misses))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Benchmark of the p0f handler.
+
+A scanner connecting from a few addresses to many ports is simulated. Every accepted connection is looked up with the
+p0f handler, the queries are answered by a fake p0f server and the responses are passed back to the handler. The
+previous implementation opened a connection to p0f and sent a query for every accepted connection, it is used as
+reference, its time does not include connecting to p0f. The number of connections to p0f, the number of queries
+and the reported incidents are compared.
+
+Usage: PYTHONPATH=modules/python python3 tests/benchmark/p0f_client.py [-n CONNECTIONS] [-a ADDRESSES] [--version 2|3]
+"""
+
+import argparse
+import logging
+import sys
+import time
+from ipaddress import ip_address
+
+import core_stub
+
+core = core_stub.install()
+
+from dionaea import p0f  # noqa: E402
+from fake_p0f import FakeP0F  # noqa: E402
+
+
+class Connection(core.connection):
+    def __init__(self, remote_host, remote_port):
+        core.connection.__init__(self, "tcp")
+        self.remote.host = remote_host
+        self.remote.port = remote_port
+        self.local.host = "192.0.2.1"
+        self.local.port = 1024 + remote_port % 1000
+
+
+def legacy_lookup(protocol, fake, con):
+    """
+    Query p0f with a new connection like the previous implementation did.
+
+    :return: The values of the incident
+    """
+    data = protocol.query(0xffffffff, con)
+    _, response = fake.respond(data)
+    return protocol.parse(response)[1]
+
+
+def pump(handler, fake, one_shot):
+    """
+    Pass the queries sent to p0f to the fake server and the responses back to the handler.
+    """
+    while handler.client is not None:
+        client = handler.client
+        if not client.established:
+            client.handle_established()
+        data = b"".join(client.sent)
+        client.sent = []
+        if not data:
+            return
+        _, response = fake.respond(data, limit=1 if one_shot else None)
+        client.handle_io_in(response)
+        if one_shot:
+            # p0f 2.x closes the connection after the response
+            client.handle_disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the p0f handler")
+    parser.add_argument("-n", "--connections", type=int, default=20000,
+                        help="Number of accepted connections (Default: 20000)")
+    parser.add_argument("-a", "--addresses", type=int, default=50, help="Number of remote addresses (Default: 50)")
+    parser.add_argument("-b", "--batch", type=int, default=20,
+                        help="Number of connections accepted before p0f answers (Default: 20)")
+    parser.add_argument("--version", type=int, choices=(2, 3), default=3, help="Version of the p0f API (Default: 3)")
+    parser.add_argument("--one-shot", action="store_true", help="p0f closes the connection after every response")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    cons = [
+        Connection(str(ip_address("198.51.100.1") + i % args.addresses), i % 65535 + 1)
+        for i in range(args.connections)
+    ]
+
+    fake = FakeP0F(args.version)
+    protocol = p0f.protocols[args.version]()
+    start = time.perf_counter()
+    expected = [legacy_lookup(protocol, fake, con) for con in cons]
+    legacy_time = time.perf_counter() - start
+    legacy_queries = fake.queries
+
+    fake = FakeP0F(args.version)
+    handler = p0f.p0fhandler(config={"path": "un:///tmp/p0f.sock", "version": args.version})
+    core_stub.incidents.clear()
+    start = time.perf_counter()
+    for i, con in enumerate(cons):
+        handler.lookup(con)
+        if (i + 1) % args.batch == 0:
+            pump(handler, fake, args.one_shot)
+    pump(handler, fake, args.one_shot)
+    current_time = time.perf_counter() - start
+
+    print("connections:                %d from %d addresses" % (args.connections, args.addresses))
+    print("legacy:  %10.1f us/connection %8d p0f connections %8d queries" % (
+        legacy_time / args.connections * 1e6, args.connections, legacy_queries))
+    print("current: %10.1f us/connection %8d p0f connections %8d queries %8d cache hits" % (
+        current_time / args.connections * 1e6, handler.connections, fake.queries, handler.cache_hits))
+
+    results = {}
+    for icd in core_stub.incidents:
+        values = icd.to_dict()
+        results[id(values.pop("con"))] = values
+    for con, values in zip(cons, expected):
+        result = results.get(id(con))
+        if result is None or result["genre"] != values["genre"] or result["detail"] != values["detail"]:
+            print("error: the results differ for %s:%d" % (con.remote.host, con.remote.port), file=sys.stderr)
+            return 1
+    if any(getattr(con, "refs", 0) for con in cons):
+        print("error: connections still referenced", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
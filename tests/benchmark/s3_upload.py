@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Benchmark of the S3 handler.
+
+Unique files are uploaded to a local S3-compatible stand-in, the in-process mock of moto is used if no endpoint is
+given. The previous implementation created a client and uploaded the file in the incident callback, it is used as
+reference. The time the event loop is blocked by the incident callbacks and the time until all files have been
+uploaded are compared. Files submitted again must be skipped and files left in the backlog must be uploaded after a
+restart.
+
+Usage: PYTHONPATH=modules/python python3 tests/benchmark/s3_upload.py [-n FILES] [-s KBYTES] [-w WORKERS]
+       [--endpoint-url URL]
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import core_stub
+
+core = core_stub.install()
+
+import boto3  # noqa: E402
+
+from dionaea import s3  # noqa: E402
+
+try:
+    from moto import mock_aws
+except ImportError:
+    try:
+        # moto < 5
+        from moto import mock_s3 as mock_aws
+    except ImportError:
+        mock_aws = None
+
+CREDENTIALS = {
+    "access_key_id": "testing",
+    "secret_access_key": "testing",
+    "region_name": "us-east-1",
+}
+
+
+def create_client(endpoint_url):
+    return boto3.client(
+        "s3",
+        CREDENTIALS["region_name"],
+        aws_access_key_id=CREDENTIALS["access_key_id"],
+        aws_secret_access_key=CREDENTIALS["secret_access_key"],
+        endpoint_url=endpoint_url,
+    )
+
+
+def count_objects(client, bucket):
+    count = 0
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket):
+        count += len(page.get("Contents", []))
+    return count
+
+
+def upload_legacy(endpoint_url, bucket, files):
+    """
+    Upload the files like the previous implementation did in the incident callback.
+
+    :return: The time the event loop has been blocked
+    """
+    start = time.perf_counter()
+    for md5, path in files:
+        client = create_client(endpoint_url)
+        client.upload_file(path, bucket, "dionaea/" + md5)
+    return time.perf_counter() - start
+
+
+def create_handler(args, bucket, backlog):
+    config = dict(CREDENTIALS)
+    config.update({
+        "bucket_name": bucket,
+        "endpoint_url": args.endpoint_url,
+        "s3_dest_folder": "dionaea/",
+        "file": backlog,
+        "workers": args.workers,
+        "max_concurrency": args.concurrency,
+        "multipart_threshold": args.chunk_size,
+        "multipart_chunksize": args.chunk_size,
+    })
+    return s3.s3handler("*", config=config)
+
+
+def submit(handler, files):
+    """
+    :return: The time the event loop has been blocked
+    """
+    start = time.perf_counter()
+    for md5, path in files:
+        handler.submit(handler.s3_dest_folder + md5, path)
+    return time.perf_counter() - start
+
+
+def wait(handler, timeout=300.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = handler.stats()
+        if stats["uploaded"] + stats["existing"] + stats["retries"] + stats["failed"] >= stats["queued"]:
+            return
+        time.sleep(0.005)
+    raise TimeoutError("Uploads not finished")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the S3 handler")
+    parser.add_argument("-n", "--files", type=int, default=100, help="Number of files (Default: 100)")
+    parser.add_argument("-s", "--size", type=int, default=64, help="Size of the files in kbytes (Default: 64)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of upload workers (Default: 4)")
+    parser.add_argument("-c", "--concurrency", type=int, default=4,
+                        help="Number of threads per multipart upload (Default: 4)")
+    parser.add_argument("--chunk-size", type=float, default=8, help="Size of the multipart chunks in MB (Default: 8)")
+    parser.add_argument("--endpoint-url", help="URL of a S3-compatible server, e.g. moto_server or MinIO")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    if args.endpoint_url is None:
+        if mock_aws is None:
+            print("error: moto is not installed and no endpoint URL given", file=sys.stderr)
+            return 1
+        mock = mock_aws()
+    else:
+        mock = contextlib.nullcontext()
+
+    with tempfile.TemporaryDirectory() as tmpdir, mock:
+        files = []
+        for i in range(args.files):
+            path = os.path.join(tmpdir, "file-%d" % i)
+            with open(path, "wb") as fp:
+                fp.write(os.urandom(args.size * 1024))
+            files.append(("%032x" % i, path))
+
+        client = create_client(args.endpoint_url)
+        for bucket in ("dionaea-legacy", "dionaea-current", "dionaea-restart"):
+            client.create_bucket(Bucket=bucket)
+
+        legacy_time = upload_legacy(args.endpoint_url, "dionaea-legacy", files)
+
+        handler = create_handler(args, "dionaea-current", os.path.join(tmpdir, "s3.sqlite"))
+        handler.start()
+        start = time.perf_counter()
+        blocked_time = submit(handler, files)
+        wait(handler)
+        current_time = time.perf_counter() - start
+        # Submit the files again, they must be skipped
+        submit(handler, files)
+        stats = handler.stats()
+        handler.stop()
+
+        print("files:   %d of %d kbytes" % (args.files, args.size))
+        print("legacy:  %10.3f ms/file blocked %10.1f files/s" % (
+            legacy_time / args.files * 1e3, args.files / legacy_time))
+        print("current: %10.3f ms/file blocked %10.1f files/s %d worker(s)" % (
+            blocked_time / args.files * 1e3, args.files / current_time, args.workers))
+        print("stats:   %s" % stats)
+
+        if count_objects(client, "dionaea-current") != args.files or stats["uploaded"] != args.files:
+            print("error: files not uploaded", file=sys.stderr)
+            return 1
+        if stats["skipped"] != args.files:
+            print("error: files uploaded twice", file=sys.stderr)
+            return 1
+
+        # Files submitted before a restart are uploaded from the backlog
+        backlog = os.path.join(tmpdir, "restart.sqlite")
+        handler = create_handler(args, "dionaea-restart", backlog)
+        submit(handler, files)
+        handler.stop()
+        handler = create_handler(args, "dionaea-restart", backlog)
+        handler.start()
+        wait(handler)
+        handler.stop()
+        if count_objects(client, "dionaea-restart") != args.files:
+            print("error: files of the backlog not uploaded after the restart", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
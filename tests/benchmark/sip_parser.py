@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Micro-benchmark of the SIP message parser.
+
+The messages of the SIPVicious scanners (svmap, svwar, svcrack as "friendly-scanner") are parsed like they are received
+over UDP with the parser of the SIP service and with the previous implementation, which rewrote the line endings and
+parsed all headers. The dissected messages of both are compared. A dump file of the packet trace or a bistream can be
+used instead of the built-in messages.
+
+Usage: PYTHONPATH=modules/python python3 tests/benchmark/sip_parser.py [-n ROUNDS] [--dump FILE]
+"""
+
+import argparse
+import re
+import sys
+import time
+
+import core_stub
+
+core_stub.install()
+
+from dionaea.sip import rfc2396, rfc3261, rfc4566  # noqa: E402
+from dionaea.trace import DIRECTION_IN, read_dump  # noqa: E402
+
+SDP = (
+    b"v=0\r\n"
+    b"o=root 1234 1234 IN IP4 198.51.100.7\r\n"
+    b"s=session\r\n"
+    b"c=IN IP4 198.51.100.7\r\n"
+    b"t=0 0\r\n"
+    b"m=audio 10000 RTP/AVP 0 8 101\r\n"
+    b"a=rtpmap:0 PCMU/8000\r\n"
+    b"a=rtpmap:101 telephone-event/8000\r\n"
+)
+
+
+def scanner_message(method, user, cseq, extra=b"", body=b"", eol=b"\r\n"):
+    lines = [
+        method + b" sip:" + user + b"@192.0.2.1 SIP/2.0",
+        b"Via: SIP/2.0/UDP 198.51.100.7:5060;branch=z9hG4bK-1852917311;rport",
+        b"Max-Forwards: 70",
+        b'From: "sipvicious"<sip:100@1.1.1.1>;tag=6434396633623535313363340131363237303133303133',
+        b"To: \"sipvicious\"<sip:" + user + b"@192.0.2.1>",
+        b"Call-ID: 1093214931163325462916826@192.0.2.1",
+        b"CSeq: " + cseq + b" " + method,
+        b"Contact: <sip:100@198.51.100.7:5060>",
+        b"User-Agent: friendly-scanner",
+        b"Accept: application/sdp",
+    ]
+    lines.extend(extra)
+    lines.append(b"Content-Length: %d" % len(body))
+    return eol.join(lines) + eol + eol + body
+
+
+def scanner_messages():
+    return [
+        # svmap
+        scanner_message(b"OPTIONS", b"100", b"1"),
+        # svwar
+        scanner_message(b"REGISTER", b"1001", b"1", extra=[b"Expires: 3600"]),
+        scanner_message(b"INVITE", b"1002", b"1", extra=[b"Content-Type: application/sdp"], body=SDP),
+        # svcrack
+        scanner_message(b"REGISTER", b"1003", b"2", extra=[
+            (
+                b'Authorization: Digest username="1003",realm="asterisk",nonce="1d2c3b4a",'
+                b'uri="sip:192.0.2.1",response="5f0e6b6d5d4e7d4c3b2a190807060504",algorithm=MD5'
+            ),
+        ]),
+        # scanners with bare line feeds and without the empty line at the end
+        scanner_message(b"OPTIONS", b"100", b"1", eol=b"\n"),
+        scanner_message(b"OPTIONS", b"100", b"1")[:-2],
+    ]
+
+
+def legacy_loads(data):
+    """
+    Parse a datagram like the previous implementation did.
+    """
+    if b"\n\r\n" not in data and b"\n\n" not in data:
+        data = data + b"\n\r\n"
+    data = data.replace(b"\r\n", b"\n")
+    data = data.replace(b"\n", b"\r\n")
+
+    pos = re.search(b"\r?\n\r?\n", data)
+    headers_data = re.split(b"\r?\n", data[:pos.start()])
+    body = data[pos.end():]
+    h1, h2, h3 = headers_data[0].split(b" ", 2)
+    del headers_data[0]
+    method, uri, protocol = h1, rfc2396.Address.froms(h2), h3
+
+    headers = rfc3261.Headers()
+    for h in headers_data:
+        headers.append(rfc3261.Header.froms(h))
+
+    sdp = None
+    content_length = int(headers.get(b"content-length").value)
+    content_type = headers.get(b"content-type", None)
+    if content_type is not None and content_type.value.lower().strip() == b"application/sdp":
+        sdp = rfc4566.SDP.froms(body[:content_length])
+    return {"method": method, "uri": uri, "protocol": protocol, "headers": headers, "sdp": sdp}
+
+
+def handle(msg):
+    """
+    Access the headers used to handle a REGISTER, OPTIONS or INVITE request.
+    """
+    headers = msg["headers"]
+    for name in (b"to", b"from", b"call-id", b"cseq", b"via"):
+        headers.get(name)
+
+
+def summary(msg):
+    sdp = msg["sdp"]
+    return (
+        msg["method"],
+        msg["uri"].dumps(),
+        msg["protocol"],
+        sorted(msg["headers"].dump_list()),
+        None if sdp is None else sdp.dumps(),
+    )
+
+
+def run(name, func, messages, rounds, access):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in messages:
+            msg = func(data)
+            if access:
+                handle(msg)
+    duration = time.perf_counter() - start
+    print("%-30s %10.1f us/message" % (name, duration / (rounds * len(messages)) * 1e6))
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the SIP message parser")
+    parser.add_argument("-n", "--rounds", type=int, default=2000, help="Number of rounds (Default: 2000)")
+    parser.add_argument("--dump", help="Use the incoming messages of a dump file")
+    args = parser.parse_args()
+
+    if args.dump:
+        with open(args.dump, "rb") as fp:
+            messages = [data for _, direction, data in read_dump(fp) if direction == DIRECTION_IN]
+    else:
+        messages = scanner_messages()
+
+    def loads(data):
+        return rfc3261.Message.loads(data, datagram=True)[1]
+
+    for data in messages:
+        if summary(loads(data)) != summary(legacy_loads(data)):
+            print("error: the results differ for %r" % data[:64], file=sys.stderr)
+            return 1
+
+    for access in (False, True):
+        title = "parse and access headers" if access else "parse"
+        legacy_time = run("legacy: %s" % title, legacy_loads, messages, args.rounds, access)
+        current_time = run("current: %s" % title, loads, messages, args.rounds, access)
+        print("%-30s %10.1fx" % ("speedup:", legacy_time / current_time))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
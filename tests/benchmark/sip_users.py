@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Micro-benchmark of the lookup of SIP users.
+
+A users table with many accounts is created and the usernames of a scanner are looked up with a query per lookup
+like before and with the in-memory matcher of the SIP service. The results of both are compared.
+
+Usage: PYTHONPATH=modules/python python3 tests/benchmark/sip_users.py [-u USERS] [-n LOOKUPS]
+"""
+
+import argparse
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+import core_stub
+
+core_stub.install()
+
+from dionaea.sip.extras import SipConfig  # noqa: E402
+
+
+def query_user(filename, personality, username):
+    """
+    Lookup with a new connection and a REGEXP query like it was done before.
+    """
+    def regexp(expr, value):
+        return re.compile(str(expr)).match(value) is not None
+
+    conn = sqlite3.connect(filename)
+    conn.create_function("regexp", 2, regexp)
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT username FROM users WHERE personality = ? AND ? REGEXP username",
+            (personality, username)
+        )
+        row = cur.fetchone()
+    finally:
+        conn.close()
+    return None if row is None else row[0]
+
+
+def create_users(filename, count):
+    config = SipConfig({"users": filename})
+    conn = sqlite3.connect(filename)
+    conn.executemany(
+        "INSERT INTO users (username, password, personality, pickup_delay_min, pickup_delay_max, action, sdp) "
+        "VALUES (?, ?, 'default', 5, 10, 'default', 'default')",
+        (("^user%05d$" % i, "secret%d" % i) for i in range(count))
+    )
+    conn.commit()
+    conn.close()
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the lookup of SIP users")
+    parser.add_argument("-u", "--users", type=int, default=10000, help="Number of users (Default: 10000)")
+    parser.add_argument("-n", "--lookups", type=int, default=200, help="Number of lookups (Default: 200)")
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "accounts.sqlite")
+        config = create_users(filename, args.users)
+
+        # Scanners try numeric extensions, known accounts and random names
+        usernames = []
+        for i in range(args.lookups):
+            kind = i % 3
+            if kind == 0:
+                usernames.append(str(random.randint(100, 999)))
+            elif kind == 1:
+                usernames.append("user%05d" % random.randrange(args.users))
+            else:
+                usernames.append("scan%d" % random.randrange(args.lookups))
+
+        start = time.perf_counter()
+        expected = [query_user(filename, "default", name) for name in usernames]
+        query_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        users = [config.get_user_by_username("default", name.encode("utf-8")) for name in usernames]
+        matcher_time = time.perf_counter() - start
+
+        # The first lookup loads the table
+        start = time.perf_counter()
+        for name in usernames:
+            config.get_user_by_username("default", name.encode("utf-8"))
+        cached_time = time.perf_counter() - start
+
+    result = [None if user is None else user.username_regex for user in users]
+    print("users:             %d" % args.users)
+    print("lookups:           %d" % args.lookups)
+    print("query:             %10.1f us/lookup" % (query_time / args.lookups * 1e6))
+    print("matcher:           %10.1f us/lookup (including load)" % (matcher_time / args.lookups * 1e6))
+    print("matcher (warm):    %10.1f us/lookup" % (cached_time / args.lookups * 1e6))
+    print("speedup:           %10.1fx" % (query_time / matcher_time))
+    if result != expected:
+        print("error: the results differ", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Benchmark SMB negotiate and session setup requests with and without packet tracing.
+
+With tracing enabled every packet is formatted like it was done unconditionally before.
+
+Usage: PYTHONPATH=modules/python python3 tests/benchmark/smb_trace.py [-n REQUESTS]
+"""
+
+import argparse
+import logging
+import struct
+import time
+
+import core_stub
+
+core_stub.install()
+
+from dionaea.smb.smb import smbd  # noqa: E402
+from dionaea.trace import PacketTrace  # noqa: E402
+
+
+def smb_request(command, words, data):
+    header = struct.pack(
+        "<4sBIBHH8sHHHHH",
+        b"\xffSMB", command, 0, 0x18, 0xc801, 0, b"\0" * 8, 0, 0xffff, 1, 0, 1
+    )
+    smb = header + struct.pack("<B", len(words) // 2) + words + struct.pack("<H", len(data)) + data
+    return struct.pack(">I", len(smb)) + smb
+
+
+def create_requests():
+    negotiate = smb_request(0x72, b"", b"\x02NT LM 0.12\0")
+    # NTLMSSP NEGOTIATE without domain and workstation
+    ntlmssp = b"NTLMSSP\0" + struct.pack("<II", 1, 0x60088215) + b"\0" * 16
+    words = struct.pack("<BBHHHHIHII", 0xff, 0, 0, 4356, 10, 0, 0, len(ntlmssp), 0, 0x8000e05c)
+    session_setup = smb_request(0x73, words, ntlmssp + b"\0Windows\0\0Windows\0\0")
+    return [negotiate, session_setup]
+
+
+def run(name, count, packet_trace, requests):
+    con = smbd()
+    con.apply_config(config={})
+    con.packet_trace = packet_trace
+    start = time.perf_counter()
+    for i in range(count):
+        data = requests[i % len(requests)]
+        con.handle_io_in(data)
+        con.sent.clear()
+    duration = time.perf_counter() - start
+    print("%-30s %10.0f requests/s" % (name, count / duration))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="count", type=int, default=10000, help="Number of requests")
+    args = parser.parse_args()
+
+    # Format the log records like dionaea but discard them
+    logging.getLogger().addHandler(logging.NullHandler())
+    logging.getLogger().setLevel(logging.DEBUG)
+    logging.getLogger().propagate = False
+
+    requests = create_requests()
+    con = smbd()
+    con.apply_config(config={})
+    for data in requests:
+        con.handle_io_in(data)
+    if len(con.sent) != len(requests):
+        raise RuntimeError("Unexpected number of responses")
+
+    run("trace enabled (before)", args.count, PacketTrace("smbd", enabled=True), requests)
+    run("trace disabled", args.count, PacketTrace("smbd"), requests)
+
+
+if __name__ == "__main__":
+    main()
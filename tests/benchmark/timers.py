@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# This file is part of the dionaea honeypot
+#
+# SPDX-FileCopyrightText: 2026 dionaea developers
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Stress test of the timer wheel used by dionaea.Timer.
+
+A large number of timers like the ones of SIP calls are started, reset and cancelled. The wheel is advanced like the
+event loop does and the time per operation, the number of threads and the expired timers are reported. No
+libdionaea is required.
+
+Usage:
+    PYTHONPATH=modules/python python3 tests/benchmark/timers.py [-n TIMERS]
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+import core_stub
+
+core_stub.install()
+
+from dionaea import Timer  # noqa: E402
+from dionaea.timer import timer_wheel  # noqa: E402
+
+
+def run(count):
+    fired = []
+    threads_before = threading.active_count()
+
+    def callback(index):
+        fired.append(index)
+
+    timers = [
+        Timer(random.uniform(1.0, 60.0), callback, args=[i], repeat=(i % 10 == 0))
+        for i in range(count)
+    ]
+
+    start = time.perf_counter()
+    for timer in timers:
+        timer.start()
+    schedule_time = time.perf_counter() - start
+    threads_running = threading.active_count()
+
+    # Every incoming SIP message resets the idle timer of the call
+    start = time.perf_counter()
+    for timer in timers:
+        timer.reset()
+    reset_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for timer in timers[1::2]:
+        timer.cancel()
+    cancel_time = time.perf_counter() - start
+    cancelled = len(timers[1::2])
+
+    # Advance the wheel tick by tick for two minutes like the event loop does
+    now = time.monotonic()
+    ticks = int(120 / timer_wheel.resolution)
+    start = time.perf_counter()
+    for tick in range(1, ticks + 1):
+        timer_wheel.advance(now + tick * timer_wheel.resolution)
+    advance_time = time.perf_counter() - start
+
+    repeating = len(timer_wheel)
+    for timer in timers:
+        timer.cancel()
+
+    print("timers:            %d" % count)
+    print("threads:           %d before, %d with all timers running" % (threads_before, threads_running))
+    print("start:             %8.3f us/timer" % (schedule_time / count * 1e6))
+    print("reset:             %8.3f us/timer" % (reset_time / count * 1e6))
+    print("cancel:            %8.3f us/timer" % (cancel_time / cancelled * 1e6))
+    print("advance:           %8.3f us/tick (%d ticks)" % (advance_time / ticks * 1e6, ticks))
+    print("callbacks:         %d, %d distinct timers" % (len(fired), len(set(fired))))
+    print("still scheduled:   %d repeating timers" % repeating)
+
+    if threads_running != threads_before:
+        print("error: the number of threads has changed", file=sys.stderr)
+        return 1
+    if len(set(fired)) != count - cancelled:
+        print("error: not all timers have expired", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test of the timer wheel")
+    parser.add_argument("-n", "--timers", type=int, default=100000, help="Number of timers (Default: 100000)")
+    args = parser.parse_args()
+    random.seed(0)
+    sys.exit(run(args.timers))
+
+
+if __name__ == "__main__":
+    main()